@@ -1,16 +1,25 @@
 """Quick and dirty migrations for AnoSQL."""
 
 from datetime import datetime
+from functools import lru_cache
 from hashlib import sha256
 import logging
 import re
 import typing as t
 
-from anosql.core import from_str, Queries
+from anosql.core import (
+    from_str,
+    Queries,
+    SQLOperationType,
+)
 
 
 log = logging.getLogger(__name__)
 
+# The name of the record holding the fingerprint of the last fully applied set of migrations. Its
+# committed_at is 0, so it's never listed as a migration.
+FINGERPRINT = "anosql_migrations_fingerprint"
+
 
 class MigrationDescriptor(t.NamedTuple):
     name: str
@@ -54,7 +63,7 @@ ORDER BY
 -- Get a given migration by name
 SELECT
     `name`
-,   `committed_at`,
+,   `committed_at`
 ,   `sha256sum`
 FROM `anosql_migration`
 WHERE
@@ -63,6 +72,16 @@ ORDER BY
     `rowid` ASC
 ;
 
+-- name: anosql_migrations_get_fingerprint?
+-- Get the fingerprint of the last fully applied set of migrations
+SELECT
+    `sha256sum`
+FROM `anosql_migration`
+WHERE
+    `name` = :name
+AND `committed_at` = 0
+;
+
 -- name: anosql_migrations_create<!
 -- Insert a migration, marking it as committed
 INSERT OR REPLACE INTO `anosql_migration` (
@@ -93,23 +112,32 @@ def with_migrations(driver_adapter, queries: Queries, conn) -> Queries:
     return queries
 
 
+@lru_cache(maxsize=None)
+def sha256sum(sql: str) -> str:
+    """Hash a migration's SQL. Memoized, as the same migrations are hashed on every connect."""
+
+    return sha256(sql.encode("utf-8")).hexdigest()
+
+
 def create_tables(queries: Queries, conn) -> None:
     """Create the migrations table (if it doesn't exist)."""
 
     if queries.anosql_migrations_create_table(conn):
         log.info("Created migrations table")
 
-    # Insert the bootstrap 'fixup' record
-    execute_migration(
-        queries,
-        conn,
-        MigrationDescriptor(
-            name="anosql_migrations_create_table",
-            sha256sum=sha256(
-                queries.anosql_migrations_create_table.sql.encode("utf-8")
-            ).hexdigest(),
-        ),
+    # Insert the bootstrap 'fixup' record, unless it's already there. Only that record is read, so
+    # that connecting to an up to date database needn't list every migration.
+    bootstrap = MigrationDescriptor(
+        name="anosql_migrations_create_table",
+        sha256sum=sha256sum(queries.anosql_migrations_create_table.sql),
     )
+    if not any(
+        committed_at > 0 and digest == bootstrap.sha256sum
+        for _, committed_at, digest in queries.anosql_migrations_get(
+            conn, name=bootstrap.name
+        )
+    ):
+        execute_migration(queries, conn, bootstrap)
 
 
 def committed_migrations(queries: Queries, conn) -> t.Iterable[MigrationDescriptor]:
@@ -139,10 +167,26 @@ def available_migrations(queries: Queries, conn) -> t.Iterable[MigrationDescript
         yield MigrationDescriptor(
             name=query_name,
             committed_at=None,
-            sha256sum=sha256(query_fn.sql.encode("utf-8")).hexdigest(),
+            sha256sum=sha256sum(query_fn.sql),
         )
 
 
+def fingerprint(migrations: t.Iterable[MigrationDescriptor]) -> str:
+    """A single hash identifying a whole set of migrations."""
+
+    migrations = sorted(migrations, key=lambda m: m.name)
+    return sha256(
+        "\n".join(f"{m.name}:{m.sha256sum}" for m in migrations).encode("utf-8")
+    ).hexdigest()
+
+
+def applied_fingerprint(queries: Queries, conn) -> t.Optional[str]:
+    """The fingerprint of the last set of migrations to have been fully applied, if any."""
+
+    row = queries.anosql_migrations_get_fingerprint(conn, name=FINGERPRINT)
+    return row[0] if row else None
+
+
 def execute_migration(queries: Queries, conn, migration: MigrationDescriptor):
     """Execute a given migration singularly."""
 
@@ -169,17 +213,68 @@ def execute_migration(queries: Queries, conn, migration: MigrationDescriptor):
         )
 
 
-def run_migrations(queries, conn):
-    """Run all remaining migrations."""
+def execute_migrations(queries: Queries, conn, migrations: t.List[MigrationDescriptor]):
+    """Execute the given migrations, in order, all in one transaction.
 
-    avail = set(available_migrations(queries, conn))
-    committed = set(committed_migrations(queries, conn))
+    Either every migration commits, or none do. As the migration records are written in the same
+    transaction, each is written once, already marked as committed.
+    """
+
+    now = int(datetime.utcnow().timestamp())
+    with conn:
+        for migration in migrations:
+            # The first write begins the transaction, so that DDL is part of it
+            queries.anosql_migrations_create(
+                conn,
+                name=migration.name,
+                date=now,
+                sha256sum=migration.sha256sum,
+            )
+            getattr(queries, migration.name)(conn)
+
+
+def _is_script(queries: Queries, migration: MigrationDescriptor) -> bool:
+    query_fn = getattr(queries, migration.name)
+    return getattr(query_fn, "op_type", None) == SQLOperationType.SCRIPT
+
+
+def run_migrations(queries, conn, single_transaction=False):
+    """Run all remaining migrations.
 
-    for migration in sorted(avail, key=lambda m: m.name):
-        if migration in committed:
-            log.info(f"Skipping committed migration {migration.name}")
+    If the set of available migrations is the same as was last fully applied, as recorded by its
+    fingerprint, there's nothing to do, and no other migration records are read.
 
-        else:
+    By default, each migration runs (and commits) in a transaction of its own, so that a failed
+    run resumes from the migration which failed. With single_transaction, all the remaining
+    migrations run in one transaction instead, unless any are scripts (``#`` queries), which
+    drivers may commit as they execute.
+    """
+
+    avail = set(available_migrations(queries, conn))
+    avail_fingerprint = fingerprint(avail)
+    if applied_fingerprint(queries, conn) == avail_fingerprint:
+        log.debug("All migrations applied")
+        return
+
+    committed = set(committed_migrations(queries, conn))
+    pending = sorted(avail - committed, key=lambda m: m.name)
+    for migration in sorted(avail & committed, key=lambda m: m.name):
+        log.info(f"Skipping committed migration {migration.name}")
+
+    if (
+        pending
+        and single_transaction
+        and not any(_is_script(queries, m) for m in pending)
+    ):
+        log.info(f"Beginning migrations {', '.join(m.name for m in pending)}")
+        try:
+            execute_migrations(queries, conn, pending)
+        except Exception:
+            log.exception("Migrations failed!")
+            raise
+
+    else:
+        for migration in pending:
             log.info(f"Beginning migration {migration.name}")
 
             try:
@@ -187,3 +282,8 @@ def run_migrations(queries, conn):
             except Exception as e:
                 log.exception(f"Migration {migration.name} failed!", e)
                 raise e
+
+    with conn:
+        queries.anosql_migrations_create(
+            conn, name=FINGERPRINT, date=0, sha256sum=avail_fingerprint
+        )
@@ -107,3 +107,58 @@ def test_post_committed_migrations(migrated_conn, queries):
     assert any(m.name == "migration_0000_create_kv" for m in ms), "\n".join(
         migrated_conn.iterdump()
     )
+
+
+def test_fingerprint_fast_path(migrated_conn, monkeypatch):
+    """Assert that once all migrations are applied, reconnecting reads only the fingerprint."""
+
+    def committed_migrations(*args):
+        raise AssertionError("listed committed migrations")
+
+    monkeypatch.setattr(anosql_migrations, "committed_migrations", committed_migrations)
+
+    # As on reconnecting, with fresh queries
+    q = anosql.from_str(_SQL, "sqlite3")
+    q = anosql_migrations.with_migrations("sqlite3", q, migrated_conn)
+    anosql_migrations.run_migrations(q, migrated_conn)
+
+
+def test_fingerprint_changes(migrated_conn, queries):
+    """Assert that adding a migration invalidates the fingerprint, and applies it."""
+
+    q = anosql.from_str(
+        _SQL
+        + "\n-- name: migration_0001_create_kv2\n"
+        + "CREATE TABLE kv2 (`id` INT);\n",
+        "sqlite3",
+    )
+    q = anosql_migrations.with_migrations("sqlite3", q, migrated_conn)
+    anosql_migrations.run_migrations(q, migrated_conn)
+    assert table_exists(migrated_conn, "kv2")
+
+    avail = anosql_migrations.available_migrations(q, migrated_conn)
+    assert anosql_migrations.applied_fingerprint(
+        q, migrated_conn
+    ) == anosql_migrations.fingerprint(avail)
+
+
+def test_single_transaction(conn):
+    """Assert that single transaction migrations all apply, or all roll back."""
+
+    q = anosql.from_str(
+        _SQL
+        + "\n-- name: migration_0001_create_kv2\n"
+        + "CREATE TABLE kv2 (`id` INT);\n"
+        + "\n-- name: migration_0002_broken\n"
+        + "CREATE TABLE kv (`id` INT);\n",
+        "sqlite3",
+    )
+    q = anosql_migrations.with_migrations("sqlite3", q, conn)
+
+    with pytest.raises(sqlite3.OperationalError):
+        anosql_migrations.run_migrations(q, conn, single_transaction=True)
+    assert not table_exists(conn, "kv")
+    assert not table_exists(conn, "kv2")
+    assert [m.name for m in anosql_migrations.committed_migrations(q, conn)] == [
+        "anosql_migrations_create_table"
+    ]
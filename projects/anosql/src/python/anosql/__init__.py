@@ -1,3 +1,4 @@
+from .bulk import bulk_load, BulkLoadProgress
 from .core import (
     from_path,
     from_str,
@@ -7,12 +8,19 @@ from .exceptions import (
     SQLLoadException,
     SQLParseException,
 )
+from .instrument import QueryMetrics
+from .rows import dict_row, namedtuple_row
 
 
 __all__ = [
+    "bulk_load",
+    "BulkLoadProgress",
     "from_path",
     "from_str",
+    "QueryMetrics",
     "SQLOperationType",
     "SQLLoadException",
     "SQLParseException",
+    "dict_row",
+    "namedtuple_row",
 ]
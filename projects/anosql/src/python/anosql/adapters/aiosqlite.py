@@ -0,0 +1,75 @@
+"""
+A driver object implementing support for SQLite3, via aiosqlite
+"""
+
+from contextlib import asynccontextmanager
+
+from ..rows import aiter_rows
+from .sqlite3 import (
+    _debug,
+    _has_returning,
+    SQLite3DriverAdapter,
+)
+
+
+class AioSQLiteAdapter(object):
+    """As `SQLite3DriverAdapter`, for aiosqlite connections; each method is a coroutine."""
+
+    is_aio_driver = True
+
+    process_sql = staticmethod(SQLite3DriverAdapter.process_sql)
+
+    @staticmethod
+    async def select(conn, _query_name, sql, parameters):
+        _debug(sql, parameters)
+        async with conn.execute(sql, parameters) as cur:
+            return await cur.fetchall()
+
+    @staticmethod
+    async def select_stream(
+        conn, _query_name, sql, parameters, batch_size, row_factory
+    ):
+        _debug(sql, parameters)
+        async with conn.execute(sql, parameters) as cur:
+            async for row in aiter_rows(cur, batch_size, row_factory):
+                yield row
+
+    @staticmethod
+    @asynccontextmanager
+    async def select_cursor(conn, _query_name, sql, parameters):
+        _debug(sql, parameters)
+        async with conn.execute(sql, parameters) as cur:
+            yield cur
+
+    @staticmethod
+    async def insert_update_delete(conn, _query_name, sql, parameters):
+        _debug(sql, parameters)
+        async with conn.execute(sql, parameters):
+            pass
+
+    @staticmethod
+    async def insert_update_delete_many(conn, _query_name, sql, parameters):
+        _debug(sql, parameters)
+        async with conn.executemany(sql, parameters):
+            pass
+
+    @staticmethod
+    async def insert_returning(conn, _query_name, sql, parameters):
+        _debug(sql, parameters)
+        async with conn.execute(sql, parameters) as cur:
+            if not _has_returning(sql):
+                # Original behavior - return the last row ID
+                return cur.lastrowid
+            else:
+                # New behavior - honor a `RETURNING` clause
+                return await cur.fetchall()
+
+    @staticmethod
+    async def explain(conn, _query_name, sql, parameters):
+        async with conn.execute("EXPLAIN QUERY PLAN " + sql, parameters) as cur:
+            return await cur.fetchall()
+
+    @staticmethod
+    async def execute_script(conn, sql):
+        _debug(sql, None)
+        await conn.executescript(sql)
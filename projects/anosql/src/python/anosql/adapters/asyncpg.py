@@ -0,0 +1,102 @@
+"""
+A driver object implementing support for PostgreSQL, via asyncpg
+"""
+
+from contextlib import asynccontextmanager
+from functools import lru_cache
+
+from ..tokenizer import (
+    parameter_names,
+    rewrite_parameters,
+)
+
+
+@lru_cache(maxsize=None)
+def _positional(sql):
+    """Rewrite `:name` parameters to asyncpg's `$n`, returning the SQL and parameter names.
+
+    This is done (and memoized) at execution time rather than in `process_sql`, so that the
+    names needn't be remembered alongside queries loaded from the query cache.
+    """
+
+    names = parameter_names(sql)
+    positions = {name: "${}".format(i + 1) for i, name in enumerate(names)}
+    return rewrite_parameters(sql, positions.__getitem__), names
+
+
+def _args(names, parameters):
+    if isinstance(parameters, dict):
+        return [parameters[name] for name in names]
+    return list(parameters)
+
+
+class _Description(object):
+    """Presents a prepared statement's columns as a DB-API cursor description, for row factories."""
+
+    def __init__(self, statement):
+        self.description = [(a.name, a.type) for a in statement.get_attributes()]
+
+
+class AsyncPGAdapter(object):
+    """Executes queries against asyncpg connections; each method is a coroutine."""
+
+    is_aio_driver = True
+
+    @staticmethod
+    def process_sql(_query_name, _op_type, sql):
+        return sql
+
+    @staticmethod
+    async def select(conn, _query_name, sql, parameters):
+        sql, names = _positional(sql)
+        return await conn.fetch(sql, *_args(names, parameters))
+
+    @staticmethod
+    async def select_stream(
+        conn, _query_name, sql, parameters, batch_size, row_factory
+    ):
+        sql, names = _positional(sql)
+        # asyncpg cursors only exist within a transaction
+        async with conn.transaction():
+            statement = await conn.prepare(sql)
+            make_row = row_factory(_Description(statement)) if row_factory else None
+            async for record in statement.cursor(
+                *_args(names, parameters), prefetch=batch_size
+            ):
+                yield make_row(record) if make_row else record
+
+    @staticmethod
+    @asynccontextmanager
+    async def select_cursor(conn, _query_name, sql, parameters):
+        sql, names = _positional(sql)
+        async with conn.transaction():
+            yield conn.cursor(sql, *_args(names, parameters))
+
+    @staticmethod
+    async def insert_update_delete(conn, _query_name, sql, parameters):
+        sql, names = _positional(sql)
+        await conn.execute(sql, *_args(names, parameters))
+
+    @staticmethod
+    async def insert_update_delete_many(conn, _query_name, sql, parameters):
+        sql, names = _positional(sql)
+        await conn.executemany(sql, [_args(names, p) for p in parameters])
+
+    @staticmethod
+    async def insert_returning(conn, _query_name, sql, parameters):
+        sql, names = _positional(sql)
+        res = await conn.fetchrow(sql, *_args(names, parameters))
+        if res:
+            return res[0] if len(res) == 1 else res
+        else:
+            return None
+
+    @staticmethod
+    async def explain(conn, _query_name, sql, parameters):
+        sql, names = _positional(sql)
+        rows = await conn.fetch("EXPLAIN " + sql, *_args(names, parameters))
+        return [row[0] for row in rows]
+
+    @staticmethod
+    async def execute_script(conn, sql):
+        await conn.execute(sql)
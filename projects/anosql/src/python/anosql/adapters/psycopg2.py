@@ -1,26 +1,25 @@
 from contextlib import contextmanager
+from itertools import count
 
-from ..patterns import var_pattern
+from ..rows import iter_rows
+from ..tokenizer import (
+    escape_percent,
+    rewrite_parameters,
+)
 
 
-def replacer(match):
-    gd = match.groupdict()
-    if gd["dblquote"] is not None:
-        return gd["dblquote"]
-    elif gd["quote"] is not None:
-        return gd["quote"]
-    else:
-        return "{lead}%({var_name})s{trail}".format(
-            lead=gd["lead"],
-            var_name=gd["var_name"],
-            trail=gd["trail"],
-        )
+# Server-side cursors are named, uniquely among a connection's open cursors
+_cursor_ids = count()
 
 
 class PsycoPG2Adapter(object):
     @staticmethod
-    def process_sql(_query_name, _op_type, sql):
-        return var_pattern.sub(replacer, sql)
+    def process_sql(_query_name, op_type, sql):
+        from ..core import SQLOperationType
+
+        # Scripts are executed without parameters, so psycopg2 won't unescape them
+        escape = escape_percent if op_type != SQLOperationType.SCRIPT else None
+        return rewrite_parameters(sql, "%({})s".format, escape)
 
     @staticmethod
     def select(conn, _query_name, sql, parameters):
@@ -28,6 +27,15 @@ class PsycoPG2Adapter(object):
             cur.execute(sql, parameters)
             return cur.fetchall()
 
+    @staticmethod
+    def select_stream(conn, query_name, sql, parameters, batch_size, row_factory):
+        # A server-side cursor, so that rows are only sent as they're fetched
+        name = "anosql_{}_{}".format(query_name, next(_cursor_ids))
+        with conn.cursor(name) as cur:
+            cur.itersize = batch_size
+            cur.execute(sql, parameters)
+            yield from iter_rows(cur, batch_size, row_factory)
+
     @staticmethod
     @contextmanager
     def select_cursor(conn, _query_name, sql, parameters):
@@ -55,6 +63,12 @@ class PsycoPG2Adapter(object):
             else:
                 return None
 
+    @staticmethod
+    def explain(conn, _query_name, sql, parameters):
+        with conn.cursor() as cur:
+            cur.execute("EXPLAIN " + sql, parameters)
+            return [row[0] for row in cur.fetchall()]
+
     @staticmethod
     def execute_script(conn, sql):
         with conn.cursor() as cur:
@@ -3,15 +3,36 @@ A driver object implementing support for SQLite3
 """
 
 from contextlib import contextmanager
+from functools import lru_cache
 import logging
-import re
 import sqlite3
 
+from ..rows import iter_rows
+from ..tokenizer import normalize
+
 
 log = logging.getLogger(__name__)
 
 
+def _debug(sql, parameters):
+    # Only build the log record when it'll be used; this is on every query's hot path
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug({"sql": sql, "parameters": parameters})
+
+
+@lru_cache(maxsize=None)
+def _has_returning(sql):
+    return "returning" in sql.lower()
+
+
 class SQLite3DriverAdapter(object):
+    """Executes queries against sqlite3 connections.
+
+    Queries are executed directly on the connection, whose statement cache keeps each query's
+    prepared statement (keyed by its processed SQL, which is fixed per query name) between calls.
+    Connections serving many distinct queries may want a larger ``cached_statements``.
+    """
+
     @staticmethod
     def process_sql(_query_name, _op_type, sql):
         """Munge queries.
@@ -26,36 +47,27 @@ class SQLite3DriverAdapter(object):
 
         """
 
-        # Normalize out comments
-        sql = re.sub(r"-{2,}.*?\n", "", sql)
-
-        # Normalize out a variety of syntactically irrelevant whitespace
-        #
-        # FIXME: This is technically invalid, because what if you had `foo ` as
-        # a table name. Shit idea, but this won't handle it correctly.
-        sql = re.sub(r"\s+", " ", sql)
-        sql = re.sub(r"\(\s+", "(", sql)
-        sql = re.sub(r"\s+\)", ")", sql)
-        sql = re.sub(r"\s+,", ",", sql)
-        sql = re.sub(r"\s+;", ";", sql)
-
-        return sql
+        return normalize(sql)
 
     @staticmethod
     def select(conn, _query_name, sql, parameters):
-        cur = conn.cursor()
-        log.debug({"sql": sql, "parameters": parameters})
-        cur.execute(sql, parameters)
-        results = cur.fetchall()
-        cur.close()
-        return results
+        _debug(sql, parameters)
+        return conn.execute(sql, parameters).fetchall()
+
+    @staticmethod
+    def select_stream(conn, _query_name, sql, parameters, batch_size, row_factory):
+        _debug(sql, parameters)
+        cur = conn.execute(sql, parameters)
+        try:
+            yield from iter_rows(cur, batch_size, row_factory)
+        finally:
+            cur.close()
 
     @staticmethod
     @contextmanager
     def select_cursor(conn: sqlite3.Connection, _query_name, sql, parameters):
-        cur = conn.cursor()
-        log.debug({"sql": sql, "parameters": parameters})
-        cur.execute(sql, parameters)
+        _debug(sql, parameters)
+        cur = conn.execute(sql, parameters)
         try:
             yield cur
         finally:
@@ -63,34 +75,38 @@ class SQLite3DriverAdapter(object):
 
     @staticmethod
     def insert_update_delete(conn: sqlite3.Connection, _query_name, sql, parameters):
-        log.debug({"sql": sql, "parameters": parameters})
+        _debug(sql, parameters)
         conn.execute(sql, parameters)
 
     @staticmethod
     def insert_update_delete_many(
         conn: sqlite3.Connection, _query_name, sql, parameters
     ):
-        log.debug({"sql": sql, "parameters": parameters})
+        _debug(sql, parameters)
         conn.executemany(sql, parameters)
 
     @staticmethod
     def insert_returning(conn: sqlite3.Connection, _query_name, sql, parameters):
-        cur = conn.cursor()
-        log.debug({"sql": sql, "parameters": parameters})
-        cur.execute(sql, parameters)
+        _debug(sql, parameters)
+        cur = conn.execute(sql, parameters)
 
-        if "returning" not in sql.lower():
+        if not _has_returning(sql):
             # Original behavior - return the last row ID
             results = cur.lastrowid
         else:
             # New behavior - honor a `RETURNING` clause
             results = cur.fetchall()
 
-        log.debug({"results": results})
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug({"results": results})
         cur.close()
         return results
 
+    @staticmethod
+    def explain(conn: sqlite3.Connection, _query_name, sql, parameters):
+        return conn.execute("EXPLAIN QUERY PLAN " + sql, parameters).fetchall()
+
     @staticmethod
     def execute_script(conn: sqlite3.Connection, sql):
-        log.debug({"sql": sql, "parameters": None})
+        _debug(sql, None)
         conn.executescript(sql)
@@ -0,0 +1,79 @@
+"""
+Bulk loading via ``*!`` queries.
+
+Handing a ``*!`` query millions of rows at once either materializes them all, or holds one huge
+transaction open for the duration. `bulk_load` instead streams rows from any iterable through the
+query in fixed size chunks, committing after each one, and reports progress as it goes.
+"""
+
+from collections import namedtuple
+from itertools import islice
+import logging
+from time import perf_counter
+
+from .core import SQLOperationType
+
+
+log = logging.getLogger(__name__)
+
+
+class BulkLoadProgress(namedtuple("BulkLoadProgress", ["rows", "chunks", "seconds"])):
+    """How much of a bulk load has completed, and how long it's taken so far."""
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def bulk_load(conn, query, rows, chunk_size=1000, commit=True, progress=None):
+    """Execute a ``*!`` query over many rows, chunk_size rows (one transaction) at a time.
+
+    Args:
+        conn: The database connection to execute the query on.
+        query (function): A loaded ``*!`` query method.
+        rows (iterable): The parameter sequences or mappings to execute the query with.
+        chunk_size (int): How many rows to execute (and commit) at once.
+        commit (bool): Whether to commit after each chunk, or leave that to the caller.
+        progress (callable): Called with a `BulkLoadProgress` after each chunk. Optional.
+
+    Returns:
+        BulkLoadProgress: The totals for the whole load.
+
+    If a chunk fails, it's rolled back (when committing) and the error is raised; the chunks
+    before it remain committed.
+    """
+
+    if getattr(query, "op_type", None) != SQLOperationType.INSERT_UPDATE_DELETE_MANY:
+        raise ValueError("bulk_load requires a *! query, got {!r}".format(query))
+
+    rows = iter(rows)
+    start = perf_counter()
+    total = chunks = 0
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+
+        try:
+            query(conn, chunk)
+            if commit:
+                conn.commit()
+        except Exception:
+            if commit:
+                conn.rollback()
+            raise
+
+        total += len(chunk)
+        chunks += 1
+        stats = BulkLoadProgress(total, chunks, perf_counter() - start)
+        log.debug(
+            "%s: loaded %d rows in %d chunks (%.0f rows/s)",
+            query.__name__,
+            stats.rows,
+            stats.chunks,
+            stats.rows_per_second,
+        )
+        if progress:
+            progress(stats)
+
+    return BulkLoadProgress(total, chunks, perf_counter() - start)
@@ -0,0 +1,69 @@
+"""
+An on-disk cache of parsed queries.
+
+Parsing a ``.sql`` file, and processing each of its queries for a driver, is pure; the result
+depends only on the file's content and the driver adapter. So the parsed queries of each file can
+be cached on disk, keyed by a hash of both, and re-used by later processes which load the same
+file, until it changes.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+
+log = logging.getLogger(__name__)
+
+# Bump to invalidate existing caches whenever parsing or processing changes output
+CACHE_VERSION = 3
+
+
+def cache_key(sql_bytes, driver_adapter):
+    """The key of a file's parsed queries; a hash of its content and the driver adapter."""
+
+    adapter_type = type(driver_adapter)
+    digest = hashlib.sha256()
+    digest.update(
+        "{}\0{}.{}\0".format(
+            CACHE_VERSION, adapter_type.__module__, adapter_type.__qualname__
+        ).encode("utf-8")
+    )
+    digest.update(sql_bytes)
+    return digest.hexdigest()
+
+
+def load(cache_dir, key):
+    """Load cached parsed queries, as returned by `anosql.core.parse_query`, or None."""
+
+    try:
+        with open(os.path.join(cache_dir, key + ".json")) as fp:
+            return [
+                (name, docs, op_type, sql, tuple(parameters))
+                for name, docs, op_type, sql, parameters in json.load(fp)
+            ]
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, TypeError) as e:
+        # A corrupt or unreadable entry is just a miss; it'll be overwritten
+        log.warning("Ignoring unreadable query cache entry %s: %s", key, e)
+        return None
+
+
+def store(cache_dir, key, queries):
+    """Cache parsed queries, atomically, so concurrent loaders never read a partial entry."""
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as fp:
+                json.dump(queries, fp)
+            os.replace(tmp_path, os.path.join(cache_dir, key + ".json"))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError as e:
+        # The cache is only an optimization, so failing to write it isn't fatal
+        log.warning("Failed to write query cache entry %s: %s", key, e)
@@ -1,5 +1,10 @@
+from functools import partial
+import io
 import os
 
+from . import cache
+from .adapters.aiosqlite import AioSQLiteAdapter
+from .adapters.asyncpg import AsyncPGAdapter
 from .adapters.psycopg2 import PsycoPG2Adapter
 from .adapters.sqlite3 import SQLite3DriverAdapter
 from .exceptions import (
@@ -12,9 +17,13 @@ from .patterns import (
     query_name_definition_pattern,
     valid_query_name_pattern,
 )
+from .rows import DEFAULT_BATCH_SIZE
+from .tokenizer import parameter_names
 
 
 _ADAPTERS = {
+    "aiosqlite": AioSQLiteAdapter,
+    "asyncpg": AsyncPGAdapter,
     "psycopg2": PsycoPG2Adapter,
     "sqlite3": SQLite3DriverAdapter,
 }
@@ -59,9 +68,16 @@ def register_driver_adapter(driver_name, driver_adapter):
                 def execute_script(self, conn, sql):
                     pass
 
+                def select_stream(self, conn, sql, parameters, batch_size, row_factory):
+                    pass
+
 
             anosql.register_driver_adapter("mydb", MyDbAdapter)
 
+        Adapters for asyncio drivers set ``is_aio_driver = True``, and implement each method as a
+        coroutine (or an async context manager, or async generator, as appropriate), so that
+        the loaded query methods are all awaitable.
+
         If your adapter constructor takes arguments you can register a function which can build
         your adapter instance::
 
@@ -100,6 +116,7 @@ class SQLOperationType(object):
     SCRIPT = 3
     SELECT = 4
     SELECT_ONE_ROW = 5
+    SELECT_STREAM = 6
 
 
 class Queries:
@@ -111,15 +128,18 @@ class Queries:
     @DynamicAttrs
     """
 
-    def __init__(self, queries=None):
+    def __init__(self, queries=None, metrics=None):
         """Queries constructor.
 
         Args:
             queries (list(tuple)):
+            metrics (anosql.instrument.QueryMetrics): The metrics the queries report to, if any.
         """
         if queries is None:
             queries = []
+        self.metrics = metrics
         self._available_queries = set()
+        self._lazy_children = {}
 
         for query_name, fn in queries:
             self.add_query(query_name, fn)
@@ -131,6 +151,8 @@ class Queries:
         Returns:
             list(str): List of dot-separated method accessor names.
         """
+        for child_name in list(self._lazy_children):
+            getattr(self, child_name)
         return sorted(self._available_queries)
 
     def __repr__(self):
@@ -164,51 +186,140 @@ class Queries:
         for child_query_name in child_queries.available_queries:
             self._available_queries.add("{}.{}".format(child_name, child_query_name))
 
+    def add_lazy_child_queries(self, child_name, loader):
+        """Adds a Queries object as a property, which is only loaded when first accessed.
 
-def _create_fns(query_name, docs, op_type, sql, driver_adapter):
-    def fn(conn, *args, **kwargs):
-        parameters = kwargs if len(kwargs) > 0 else args
-        if op_type == SQLOperationType.INSERT_RETURNING:
-            return driver_adapter.insert_returning(conn, query_name, sql, parameters)
-        elif op_type == SQLOperationType.INSERT_UPDATE_DELETE:
-            return driver_adapter.insert_update_delete(
-                conn, query_name, sql, parameters
-            )
-        elif op_type == SQLOperationType.INSERT_UPDATE_DELETE_MANY:
-            return driver_adapter.insert_update_delete_many(
-                conn, query_name, sql, *parameters
+        Args:
+            child_name (str): The property name to group the child queries under.
+            loader (callable): Called with no arguments to load the child Queries instance.
+
+        Returns:
+            None
+
+        """
+        self._lazy_children[child_name] = loader
+
+    def __getattr__(self, name):
+        # Only called for missing attributes, so loaded children cost nothing
+        loader = self.__dict__.get("_lazy_children", {}).get(name)
+        if loader is None:
+            raise AttributeError(
+                "{!r} object has no attribute {!r}".format(type(self).__name__, name)
             )
-        elif op_type == SQLOperationType.SCRIPT:
-            return driver_adapter.execute_script(conn, sql)
-        elif op_type == SQLOperationType.SELECT_ONE_ROW:
-            res = driver_adapter.select(conn, query_name, sql, parameters)
+        self.add_child_queries(name, loader())
+        self._lazy_children.pop(name, None)
+        return getattr(self, name)
+
+
+def _create_fns(
+    query_name,
+    docs,
+    op_type,
+    sql,
+    driver_adapter,
+    metrics=None,
+    parameters=None,
+    prefix="",
+):
+    # Resolve the adapter method once, here, rather than dispatching on op_type per call
+    if op_type == SQLOperationType.INSERT_RETURNING:
+        insert_returning = driver_adapter.insert_returning
+
+        def fn(conn, *args, **kwargs):
+            return insert_returning(conn, query_name, sql, kwargs or args)
+
+    elif op_type == SQLOperationType.INSERT_UPDATE_DELETE:
+        insert_update_delete = driver_adapter.insert_update_delete
+
+        def fn(conn, *args, **kwargs):
+            return insert_update_delete(conn, query_name, sql, kwargs or args)
+
+    elif op_type == SQLOperationType.INSERT_UPDATE_DELETE_MANY:
+        insert_update_delete_many = driver_adapter.insert_update_delete_many
+
+        def fn(conn, *args, **kwargs):
+            parameters = kwargs or args
+            return insert_update_delete_many(conn, query_name, sql, *parameters)
+
+    elif op_type == SQLOperationType.SCRIPT:
+        execute_script = driver_adapter.execute_script
+
+        def fn(conn, *args, **kwargs):
+            return execute_script(conn, sql)
+
+    elif op_type == SQLOperationType.SELECT_ONE_ROW and getattr(
+        driver_adapter, "is_aio_driver", False
+    ):
+        select = driver_adapter.select
+
+        async def fn(conn, *args, **kwargs):
+            res = await select(conn, query_name, sql, kwargs or args)
             return res[0] if len(res) == 1 else None
-        elif op_type == SQLOperationType.SELECT:
-            return driver_adapter.select(conn, query_name, sql, parameters)
-        else:
-            raise ValueError("Unknown op_type: {}".format(op_type))
+
+    elif op_type == SQLOperationType.SELECT_ONE_ROW:
+        select = driver_adapter.select
+
+        def fn(conn, *args, **kwargs):
+            res = select(conn, query_name, sql, kwargs or args)
+            return res[0] if len(res) == 1 else None
+
+    elif op_type == SQLOperationType.SELECT:
+        select = driver_adapter.select
+
+        def fn(conn, *args, **kwargs):
+            return select(conn, query_name, sql, kwargs or args)
+
+    elif op_type == SQLOperationType.SELECT_STREAM:
+        select_stream = driver_adapter.select_stream
+
+        def fn(
+            conn, *args, batch_size=DEFAULT_BATCH_SIZE, row_factory=None, **kwargs
+        ):
+            return select_stream(
+                conn, query_name, sql, kwargs or args, batch_size, row_factory
+            )
+
+    else:
+        raise ValueError("Unknown op_type: {}".format(op_type))
 
     fn.__name__ = query_name
     fn.__doc__ = docs
     fn.sql = sql
+    fn.op_type = op_type
+    fn.parameters = parameters
+
+    if metrics is not None:
+        from .instrument import instrument
+
+        # Report by dotted path, so that same-named queries in different children stay apart
+        fn = instrument(
+            fn, prefix + query_name, op_type, sql, driver_adapter, metrics
+        )
+
+    if op_type != SQLOperationType.SELECT:
+        return [(query_name, fn)]
 
     ctx_mgr_method_name = "{}_cursor".format(query_name)
+    select_cursor = driver_adapter.select_cursor
 
     def ctx_mgr(conn, *args, **kwargs):
-        parameters = kwargs if len(kwargs) > 0 else args
-        return driver_adapter.select_cursor(conn, query_name, sql, parameters)
+        return select_cursor(conn, query_name, sql, kwargs or args)
 
     ctx_mgr.__name__ = ctx_mgr_method_name
     ctx_mgr.__doc__ = docs
     ctx_mgr.sql = sql
+    ctx_mgr.parameters = parameters
 
-    if op_type == SQLOperationType.SELECT:
-        return [(query_name, fn), (ctx_mgr_method_name, ctx_mgr)]
+    return [(query_name, fn), (ctx_mgr_method_name, ctx_mgr)]
 
-    return [(query_name, fn)]
 
+def parse_query(sql_text, driver_adapter):
+    """Parse and process a single named query.
 
-def load_methods(sql_text, driver_adapter):
+    Returns:
+        tuple: The (query_name, docs, op_type, sql, parameters) of the query, where parameters
+               are the names of its ``:name`` parameters, in order of first use.
+    """
     lines = sql_text.strip().splitlines()
     query_name = lines[0].replace("-", "_")
 
@@ -218,6 +329,9 @@ def load_methods(sql_text, driver_adapter):
     elif query_name.endswith("*!"):
         op_type = SQLOperationType.INSERT_UPDATE_DELETE_MANY
         query_name = query_name[:-2]
+    elif query_name.endswith("*"):
+        op_type = SQLOperationType.SELECT_STREAM
+        query_name = query_name[:-1]
     elif query_name.endswith("!"):
         op_type = SQLOperationType.INSERT_UPDATE_DELETE
         query_name = query_name[:-1]
@@ -245,40 +359,107 @@ def load_methods(sql_text, driver_adapter):
             sql += line + "\n"
 
     docs = docs.strip()
+    parameters = tuple(parameter_names(sql))
     sql = driver_adapter.process_sql(query_name, op_type, sql.strip())
 
-    return _create_fns(query_name, docs, op_type, sql, driver_adapter)
+    return query_name, docs, op_type, sql, parameters
+
 
+def _load_parsed(parsed, driver_adapter, metrics=None, prefix=""):
+    query_name, docs, op_type, sql, parameters = parsed
+    return _create_fns(
+        query_name,
+        docs,
+        op_type,
+        sql,
+        driver_adapter,
+        metrics=metrics,
+        parameters=parameters,
+        prefix=prefix,
+    )
 
-def load_queries_from_sql(sql, driver_adapter):
+
+def load_methods(sql_text, driver_adapter, metrics=None, prefix=""):
+    return _load_parsed(
+        parse_query(sql_text, driver_adapter), driver_adapter, metrics, prefix
+    )
+
+
+def parse_queries_from_sql(sql):
+    return [
+        query_text
+        for query_text in query_name_definition_pattern.split(sql)
+        if not empty_pattern.match(query_text)
+    ]
+
+
+def load_queries_from_sql(sql, driver_adapter, metrics=None, prefix=""):
     queries = []
-    for query_text in query_name_definition_pattern.split(sql):
-        if not empty_pattern.match(query_text):
-            for method_pair in load_methods(query_text, driver_adapter):
-                queries.append(method_pair)
+    for query_text in parse_queries_from_sql(sql):
+        for method_pair in load_methods(
+            query_text, driver_adapter, metrics=metrics, prefix=prefix
+        ):
+            queries.append(method_pair)
     return queries
 
 
-def load_queries_from_file(file_path, driver_adapter):
-    with open(file_path) as fp:
-        return load_queries_from_sql(fp.read(), driver_adapter)
+def load_queries_from_file(
+    file_path, driver_adapter, cache_dir=None, metrics=None, prefix=""
+):
+    if cache_dir is None:
+        with open(file_path) as fp:
+            return load_queries_from_sql(
+                fp.read(), driver_adapter, metrics=metrics, prefix=prefix
+            )
 
+    with open(file_path, "rb") as fp:
+        sql_bytes = fp.read()
 
-def load_queries_from_dir_path(dir_path, query_loader):
+    key = cache.cache_key(sql_bytes, driver_adapter)
+    parsed = cache.load(cache_dir, key)
+    if parsed is None:
+        # Decode as open() in text mode would, so that cached and uncached loads agree
+        sql = io.TextIOWrapper(io.BytesIO(sql_bytes)).read()
+        parsed = [
+            parse_query(query_text, driver_adapter)
+            for query_text in parse_queries_from_sql(sql)
+        ]
+        cache.store(cache_dir, key, parsed)
+
+    queries = []
+    for query in parsed:
+        queries.extend(_load_parsed(query, driver_adapter, metrics, prefix))
+    return queries
+
+
+def load_queries_from_dir_path(
+    dir_path, query_loader, cache_dir=None, lazy=False, metrics=None
+):
     if not os.path.isdir(dir_path):
         raise ValueError("The path {} must be a directory".format(dir_path))
 
-    def _recurse_load_queries(path):
-        queries = Queries()
+    def _recurse_load_queries(path, prefix=""):
+        queries = Queries(metrics=metrics)
         for item in os.listdir(path):
             item_path = os.path.join(path, item)
             if os.path.isfile(item_path) and not item.endswith(".sql"):
                 continue
             elif os.path.isfile(item_path) and item.endswith(".sql"):
-                for name, fn in load_queries_from_file(item_path, query_loader):
+                for name, fn in load_queries_from_file(
+                    item_path,
+                    query_loader,
+                    cache_dir=cache_dir,
+                    metrics=metrics,
+                    prefix=prefix,
+                ):
                     queries.add_query(name, fn)
+            elif os.path.isdir(item_path) and lazy:
+                queries.add_lazy_child_queries(
+                    item,
+                    partial(_recurse_load_queries, item_path, prefix + item + "."),
+                )
             elif os.path.isdir(item_path):
-                child_queries = _recurse_load_queries(item_path)
+                child_queries = _recurse_load_queries(item_path, prefix + item + ".")
                 queries.add_child_queries(item, child_queries)
             else:
                 # This should be practically unreachable.
@@ -290,12 +471,13 @@ def load_queries_from_dir_path(dir_path, query_loader):
     return _recurse_load_queries(dir_path)
 
 
-def from_str(sql, driver_name):
+def from_str(sql, driver_name, metrics=None):
     """Load queries from a SQL string.
 
     Args:
         sql (str) A string containing SQL statements and anosql name:
         driver_name (str): The database driver to use to load and execute queries.
+        metrics (anosql.instrument.QueryMetrics): Metrics to report each query call to.
 
     Returns:
         Queries
@@ -323,15 +505,21 @@ def from_str(sql, driver_name):
 
     """
     driver_adapter = get_driver_adapter(driver_name)
-    return Queries(load_queries_from_sql(sql, driver_adapter))
+    return Queries(
+        load_queries_from_sql(sql, driver_adapter, metrics=metrics), metrics=metrics
+    )
 
 
-def from_path(sql_path, driver_name):
+def from_path(sql_path, driver_name, cache_dir=None, lazy=False, metrics=None):
     """Load queries from a sql file, or a directory of sql files.
 
     Args:
         sql_path (str): Path to a ``.sql`` file or directory containing ``.sql`` files.
         driver_name (str): The database driver to use to load and execute queries.
+        cache_dir (str): A directory in which to cache parsed queries between processes,
+                         so that only changed files are re-parsed. Optional.
+        lazy (bool): Load the queries in each sub-directory only when it's first accessed.
+        metrics (anosql.instrument.QueryMetrics): Metrics to report each query call to.
 
     Returns:
         Queries
@@ -345,6 +533,12 @@ def from_path(sql_path, driver_name):
             queries = anosql.from_path("./greetings.sql", driver_name="sqlite3")
             queries2 = anosql.from_path("./sql_dir", driver_name="sqlite3")
 
+        Caching parsed queries, and loading sub-directories on demand::
+
+            queries = anosql.from_path(
+                "./sql_dir", "sqlite3", cache_dir="./.anosql-cache", lazy=True
+            )
+
     """
     if not os.path.exists(sql_path):
         raise SQLLoadException("File does not exist: {}.".format(sql_path), sql_path)
@@ -352,9 +546,16 @@ def from_path(sql_path, driver_name):
     driver_adapter = get_driver_adapter(driver_name)
 
     if os.path.isdir(sql_path):
-        return load_queries_from_dir_path(sql_path, driver_adapter)
+        return load_queries_from_dir_path(
+            sql_path, driver_adapter, cache_dir=cache_dir, lazy=lazy, metrics=metrics
+        )
     elif os.path.isfile(sql_path):
-        return Queries(load_queries_from_file(sql_path, driver_adapter))
+        return Queries(
+            load_queries_from_file(
+                sql_path, driver_adapter, cache_dir=cache_dir, metrics=metrics
+            ),
+            metrics=metrics,
+        )
     else:
         raise SQLLoadException(
             "The sql_path must be a directory or file, got {}".format(sql_path),
@@ -0,0 +1,251 @@
+"""
+Per-query instrumentation.
+
+Queries loaded with a metrics object report each call to it, by query name (the dotted path, such
+as ``users.get_all``, for queries loaded from subdirectories); how long the call took, how many
+rows it returned, and whether it raised. `QueryMetrics` keeps call and error
+counts, row counts and latency histograms in memory. Given a slow query threshold, it also
+captures the plan (as by ``EXPLAIN QUERY PLAN``) of the slowest call of each query exceeding it,
+for adapters which can explain queries.
+
+Any object with the same ``observe``, ``wants_plan`` and ``observe_plan`` methods may be used in
+its place.
+"""
+
+import bisect
+from functools import wraps
+import logging
+import threading
+from time import perf_counter
+
+from .core import SQLOperationType
+
+
+log = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds, in seconds
+DEFAULT_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+# Operations whose plans can be captured, by re-running the statement under EXPLAIN
+EXPLAINABLE = {
+    SQLOperationType.INSERT_RETURNING,
+    SQLOperationType.INSERT_UPDATE_DELETE,
+    SQLOperationType.SELECT,
+    SQLOperationType.SELECT_ONE_ROW,
+}
+
+
+class Histogram(object):
+    """A cumulative histogram over fixed buckets, a la Prometheus."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self) -> dict:
+        cumulative, total = [], 0
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return {
+            "buckets": list(zip(self.buckets + (float("inf"),), cumulative)),
+            "sum": self.sum,
+            "count": self.count,
+        }
+
+
+class QueryMetrics(object):
+    """Thread-safe in-memory metrics, per query name.
+
+    Tracks, per query:
+    - call and error counts
+    - the total rows returned, where known
+    - a latency histogram
+
+    And, for queries which have taken at least slow_query_seconds, the slowest call's duration
+    and plan.
+    """
+
+    def __init__(self, slow_query_seconds=None, buckets=DEFAULT_BUCKETS):
+        self.slow_query_seconds = slow_query_seconds
+        self._lock = threading.Lock()
+        self._buckets = buckets
+        self._calls = {}
+        self._errors = {}
+        self._rows = {}
+        self._latencies = {}
+        self._slow = {}
+
+    def observe(self, query_name, duration, rows=None, error=False):
+        with self._lock:
+            self._calls[query_name] = self._calls.get(query_name, 0) + 1
+            if error:
+                self._errors[query_name] = self._errors.get(query_name, 0) + 1
+            if rows is not None:
+                self._rows[query_name] = self._rows.get(query_name, 0) + rows
+
+            if query_name not in self._latencies:
+                self._latencies[query_name] = Histogram(self._buckets)
+            self._latencies[query_name].observe(duration)
+
+    def wants_plan(self, query_name, duration) -> bool:
+        """Whether a call this slow should have its plan captured."""
+
+        if self.slow_query_seconds is None or duration < self.slow_query_seconds:
+            return False
+        with self._lock:
+            slowest = self._slow.get(query_name)
+            return slowest is None or duration > slowest["seconds"]
+
+    def observe_plan(self, query_name, duration, plan):
+        with self._lock:
+            slowest = self._slow.get(query_name)
+            if slowest is None or duration > slowest["seconds"]:
+                self._slow[query_name] = {"seconds": duration, "plan": plan}
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "queries": {
+                    name: {
+                        "calls": calls,
+                        "errors": self._errors.get(name, 0),
+                        "rows": self._rows.get(name, 0),
+                        "latency": self._latencies[name].snapshot(),
+                    }
+                    for name, calls in sorted(self._calls.items())
+                },
+                "slow": {name: dict(slow) for name, slow in sorted(self._slow.items())},
+            }
+
+
+def _rows(op_type, result):
+    if op_type == SQLOperationType.SELECT_ONE_ROW:
+        return 0 if result is None else 1
+    elif isinstance(result, list):
+        return len(result)
+    return None
+
+
+def _instrument_sync(fn, query_name, op_type, sql, explain, metrics):
+    if op_type == SQLOperationType.SELECT_STREAM:
+
+        def stream(gen):
+            start, rows, error = perf_counter(), 0, False
+            try:
+                for row in gen:
+                    rows += 1
+                    yield row
+            except Exception:
+                error = True
+                raise
+            finally:
+                metrics.observe(query_name, perf_counter() - start, rows, error)
+
+        @wraps(fn)
+        def instrumented(conn, *args, **kwargs):
+            return stream(fn(conn, *args, **kwargs))
+
+        return instrumented
+
+    @wraps(fn)
+    def instrumented(conn, *args, **kwargs):
+        start = perf_counter()
+        try:
+            result = fn(conn, *args, **kwargs)
+        except Exception:
+            metrics.observe(query_name, perf_counter() - start, None, True)
+            raise
+
+        duration = perf_counter() - start
+        metrics.observe(query_name, duration, _rows(op_type, result), False)
+        if explain and metrics.wants_plan(query_name, duration):
+            try:
+                plan = explain(conn, query_name, sql, kwargs or args)
+            except Exception:
+                log.warning("Failed to explain %s", query_name, exc_info=True)
+            else:
+                metrics.observe_plan(query_name, duration, plan)
+        return result
+
+    return instrumented
+
+
+def _instrument_async(fn, query_name, op_type, sql, explain, metrics):
+    if op_type == SQLOperationType.SELECT_STREAM:
+
+        async def stream(gen):
+            start, rows, error = perf_counter(), 0, False
+            try:
+                async for row in gen:
+                    rows += 1
+                    yield row
+            except Exception:
+                error = True
+                raise
+            finally:
+                metrics.observe(query_name, perf_counter() - start, rows, error)
+
+        @wraps(fn)
+        def instrumented(conn, *args, **kwargs):
+            return stream(fn(conn, *args, **kwargs))
+
+        return instrumented
+
+    @wraps(fn)
+    async def instrumented(conn, *args, **kwargs):
+        start = perf_counter()
+        try:
+            result = await fn(conn, *args, **kwargs)
+        except Exception:
+            metrics.observe(query_name, perf_counter() - start, None, True)
+            raise
+
+        duration = perf_counter() - start
+        metrics.observe(query_name, duration, _rows(op_type, result), False)
+        if explain and metrics.wants_plan(query_name, duration):
+            try:
+                plan = await explain(conn, query_name, sql, kwargs or args)
+            except Exception:
+                log.warning("Failed to explain %s", query_name, exc_info=True)
+            else:
+                metrics.observe_plan(query_name, duration, plan)
+        return result
+
+    return instrumented
+
+
+def instrument(fn, query_name, op_type, sql, driver_adapter, metrics):
+    """Wrap a loaded query function, reporting each call to metrics."""
+
+    explain = None
+    if op_type in EXPLAINABLE:
+        explain = getattr(driver_adapter, "explain", None)
+
+    if getattr(driver_adapter, "is_aio_driver", False):
+        return _instrument_async(fn, query_name, op_type, sql, explain, metrics)
+    return _instrument_sync(fn, query_name, op_type, sql, explain, metrics)
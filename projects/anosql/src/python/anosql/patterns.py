@@ -20,12 +20,3 @@ doc_comment_pattern = re.compile(r"\s*--\s*(.*)$")
 """
 Pattern: Identifies SQL comments.
 """
-
-var_pattern = re.compile(
-    r'(?P<dblquote>"[^"]+")|'
-    r"(?P<quote>\'[^\']+\')|"
-    r"(?P<lead>[^:]):(?P<var_name>[\w-]+)(?P<trail>[^:]?)"
-)
-"""
-Pattern: Identifies variable definitions in SQL code.
-"""
@@ -0,0 +1,63 @@
+"""
+Row factories, and batched iteration over query results.
+
+A row factory is called with a cursor which has executed a query, and returns a function which
+converts each of the cursor's rows. Factories are called once per query, so that per-query work
+such as building a namedtuple type isn't repeated per row.
+"""
+
+from collections import namedtuple
+
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def _columns(cursor):
+    return [column[0] for column in cursor.description]
+
+
+def namedtuple_row(cursor):
+    """Make rows namedtuples, with a field per column."""
+
+    return namedtuple("Row", _columns(cursor), rename=True)._make
+
+
+def dict_row(cursor):
+    """Make rows dicts, keyed by column name."""
+
+    columns = _columns(cursor)
+    return lambda row: dict(zip(columns, row))
+
+
+def iter_rows(cursor, batch_size=DEFAULT_BATCH_SIZE, row_factory=None):
+    """Iterate over a cursor's rows, fetching batch_size rows at a time.
+
+    The row factory is called after the first fetch, as some cursors (such as psycopg2's
+    server-side cursors) have no description until then.
+    """
+
+    make_row = None
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        if row_factory and not make_row:
+            make_row = row_factory(cursor)
+        if make_row:
+            yield from map(make_row, rows)
+        else:
+            yield from rows
+
+
+async def aiter_rows(cursor, batch_size=DEFAULT_BATCH_SIZE, row_factory=None):
+    """As `iter_rows`, for cursors whose fetchmany is a coroutine."""
+
+    make_row = None
+    while True:
+        rows = await cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        if row_factory and not make_row:
+            make_row = row_factory(cursor)
+        for row in rows:
+            yield make_row(row) if make_row else row
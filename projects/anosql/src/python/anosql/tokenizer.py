@@ -0,0 +1,108 @@
+"""
+A single-pass SQL tokenizer, shared by the driver adapters.
+
+Regex substitutions over whole queries can't tell a ``-- comment``, a ``:parameter`` or a run of
+whitespace from the same characters inside a string literal or quoted identifier. Tokenizing
+first lets the adapters normalize whitespace, strip comments and rewrite parameters while
+leaving quoted text exactly as written, in time linear in the length of the query.
+"""
+
+import re
+
+
+COMMENT = "comment"
+WHITESPACE = "whitespace"
+QUOTED = "quoted"
+CAST = "cast"
+PARAMETER = "parameter"
+PLACEHOLDER = "placeholder"
+OTHER = "other"
+
+_token_pattern = re.compile(
+    r"(?P<comment>--[^\n]*\n?|/\*.*?\*/)"
+    r"|(?P<whitespace>\s+)"
+    r"|(?P<quoted>'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`(?:[^`]|``)*`"
+    r"|\$(?P<tag>(?:[A-Za-z_]\w*)?)\$.*?\$(?P=tag)\$)"
+    r"|(?P<cast>::)"
+    r"|(?P<parameter>:[A-Za-z_]\w*)"
+    r"|(?P<placeholder>%(?:\(\w+\))?s|%%)"
+    r"|(?P<other>\w[\w$]*|[^-/\s'\"`:%$\w]+|.)",
+    re.DOTALL,
+)
+"""
+Pattern: A single token. Alternatives are tried in order, and ``other`` matches anything else, so
+every character of a query belongs to exactly one token.
+
+Quoted text includes Postgres' ``$$...$$`` and ``$tag$...$tag$`` dollar-quoted strings, such as
+function bodies. Identifiers may contain ``$``, so a dollar quote only starts where a token does,
+as in Postgres. Parameter names start with a letter or underscore, so slices like ``a[1:2]``
+aren't parameters.
+"""
+
+_percent_pattern = re.compile(r"%%?")
+
+
+def tokenize(sql):
+    """Split SQL into (kind, text) tokens, which concatenate back to the original SQL.
+
+    Kinds are comments, whitespace, quoted strings (including dollar-quoted strings) and
+    identifiers, ``::`` casts, ``:name`` parameters, psycopg2 style ``%(name)s``, ``%s`` and
+    ``%%`` placeholders, and other text.
+    """
+
+    for match in _token_pattern.finditer(sql):
+        yield match.lastgroup, match.group()
+
+
+def parameter_names(sql):
+    """The names of the ``:name`` parameters in SQL, in order of first use."""
+
+    names = {}
+    for kind, text in tokenize(sql):
+        if kind == PARAMETER:
+            names.setdefault(text[1:])
+    return list(names)
+
+
+def normalize(sql):
+    """Strip comments, and collapse whitespace.
+
+    Runs of whitespace and comments become a single space, or nothing after ``(`` or before
+    ``)``, ``,`` and ``;``. Quoted strings and identifiers are left as written.
+    """
+
+    out = []
+    space = False
+    for kind, text in tokenize(sql):
+        if kind == WHITESPACE or kind == COMMENT:
+            space = True
+            continue
+
+        if space and out and not out[-1].endswith("(") and text[0] not in "),;":
+            out.append(" ")
+        space = False
+        out.append(text)
+    return "".join(out)
+
+
+def rewrite_parameters(sql, replace, escape=None):
+    """Rewrite each ``:name`` parameter in SQL as replace(name).
+
+    If given, other text and quoted text are passed through escape, as for drivers which treat
+    some characters specially throughout queries.
+    """
+
+    out = []
+    for kind, text in tokenize(sql):
+        if kind == PARAMETER:
+            text = replace(text[1:])
+        elif escape and kind in (OTHER, QUOTED, COMMENT):
+            text = escape(text)
+        out.append(text)
+    return "".join(out)
+
+
+def escape_percent(text):
+    """Escape ``%`` as ``%%`` for psycopg2, leaving already escaped ``%%`` as is."""
+
+    return _percent_pattern.sub("%%", text)
@@ -0,0 +1,88 @@
+import asyncio
+import os
+
+import anosql
+import pytest
+
+
+aiosqlite = pytest.importorskip("aiosqlite")
+
+
+@pytest.fixture()
+def queries():
+    dir_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "blogdb", "sql")
+    return anosql.from_path(dir_path, "aiosqlite")
+
+
+def run(sqlite3_db_path, test):
+    async def _run():
+        async with aiosqlite.connect(sqlite3_db_path) as conn:
+            await test(conn)
+
+    asyncio.run(_run())
+
+
+def test_parameterized_query(sqlite3_db_path, queries):
+    async def test(conn):
+        actual = await queries.blogs.get_user_blogs(conn, userid=1)
+        assert actual == [
+            ("How to make a pie.", "2018-11-23"),
+            ("What I did Today", "2017-07-28"),
+        ]
+
+    run(sqlite3_db_path, test)
+
+
+def test_select_cursor_context_manager(sqlite3_db_path, queries):
+    async def test(conn):
+        async with queries.blogs.get_user_blogs_cursor(conn, userid=1) as cursor:
+            assert await cursor.fetchall() == [
+                ("How to make a pie.", "2018-11-23"),
+                ("What I did Today", "2017-07-28"),
+            ]
+
+    run(sqlite3_db_path, test)
+
+
+def test_insert_returning_and_one_row(sqlite3_db_path):
+    q = anosql.from_str(
+        "-- name: publish-blog<!\n"
+        "INSERT INTO blogs (userid, title, content, published)\n"
+        "VALUES (:userid, :title, :content, :published);\n\n"
+        "-- name: get-blog?\n"
+        "SELECT title FROM blogs WHERE blogid = :blogid;\n",
+        "aiosqlite",
+    )
+
+    async def test(conn):
+        blogid = await q.publish_blog(
+            conn, userid=2, title="Async", content="...", published="2018-12-04"
+        )
+        assert await q.get_blog(conn, blogid=blogid) == ("Async",)
+        assert await q.get_blog(conn, blogid=-1) is None
+
+    run(sqlite3_db_path, test)
+
+
+def test_insert_many_and_stream(sqlite3_db_path, queries):
+    q = anosql.from_str(
+        "-- name: get-blogs*\n"
+        "SELECT title FROM blogs WHERE userid = :userid ORDER BY published;\n",
+        "aiosqlite",
+    )
+    blogs = [
+        (2, "Blog Part 1", "content - 1", "2018-12-04"),
+        (2, "Blog Part 2", "content - 2", "2018-12-05"),
+    ]
+
+    async def test(conn):
+        await queries.blogs.sqlite_bulk_publish(conn, blogs)
+        rows = [
+            row.title
+            async for row in q.get_blogs(
+                conn, userid=2, batch_size=1, row_factory=anosql.namedtuple_row
+            )
+        ]
+        assert rows == ["Blog Part 1", "Blog Part 2"]
+
+    run(sqlite3_db_path, test)
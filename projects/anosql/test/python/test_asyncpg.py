@@ -0,0 +1,86 @@
+import asyncio
+from datetime import date
+import os
+
+import anosql
+import pytest
+
+
+asyncpg = pytest.importorskip("asyncpg")
+
+
+@pytest.fixture()
+def queries():
+    dir_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "blogdb", "sql")
+    return anosql.from_path(dir_path, "asyncpg")
+
+
+def run(pg_dsn, test):
+    async def _run():
+        conn = await asyncpg.connect(pg_dsn)
+        try:
+            await test(conn)
+        finally:
+            await conn.close()
+
+    asyncio.run(_run())
+
+
+def test_parameterized_query(pg_dsn, queries):
+    async def test(conn):
+        actual = await queries.blogs.get_user_blogs(conn, userid=1)
+        assert [tuple(r) for r in actual] == [
+            ("How to make a pie.", date(2018, 11, 23)),
+            ("What I did Today", date(2017, 7, 28)),
+        ]
+
+    run(pg_dsn, test)
+
+
+def test_insert_returning(pg_dsn, queries):
+    async def test(conn):
+        blogid, title = await queries.blogs.pg_publish_blog(
+            conn,
+            userid=2,
+            title="My first blog",
+            content="Hello, World!",
+            published=date(2018, 12, 4),
+        )
+        assert title == "My first blog"
+
+        row = await conn.fetchrow(
+            "select blogid, title from blogs where blogid = $1", blogid
+        )
+        assert tuple(row) == (blogid, title)
+
+    run(pg_dsn, test)
+
+
+def test_select_stream(pg_dsn):
+    q = anosql.from_str(
+        "-- name: get-blogs*\n"
+        "SELECT blogid, title FROM blogs WHERE userid = :userid ORDER BY blogid;\n",
+        "asyncpg",
+    )
+
+    async def test(conn):
+        rows = [tuple(r) async for r in q.get_blogs(conn, userid=1)]
+        assert rows == [(1, "What I did Today"), (3, "How to make a pie.")]
+
+        rows = [
+            r
+            async for r in q.get_blogs(
+                conn, userid=1, batch_size=1, row_factory=anosql.namedtuple_row
+            )
+        ]
+        assert [(r.blogid, r.title) for r in rows] == [
+            (1, "What I did Today"),
+            (3, "How to make a pie."),
+        ]
+
+        rows = [
+            r async for r in q.get_blogs(conn, userid=3, row_factory=anosql.dict_row)
+        ]
+        assert rows == [{"blogid": 2, "title": "Testing"}]
+
+    run(pg_dsn, test)
@@ -130,3 +130,29 @@ def test_insert_many(pg_conn, queries):
             ("Blog Part 2", date(2018, 12, 5)),
             ("Blog Part 1", date(2018, 12, 4)),
         ]
+
+
+def test_select_stream(pg_conn):
+    q = anosql.from_str(
+        "-- name: get-blogs*\n"
+        "SELECT blogid, title FROM blogs WHERE userid = :userid ORDER BY blogid;\n",
+        "psycopg2",
+    )
+
+    rows = q.get_blogs(pg_conn, userid=1)
+    assert not isinstance(rows, list)
+    assert list(rows) == [(1, "What I did Today"), (3, "How to make a pie.")]
+
+    # Server-side cursors have no description until the first fetch
+    rows = list(
+        q.get_blogs(pg_conn, userid=1, batch_size=1, row_factory=anosql.namedtuple_row)
+    )
+    assert [(r.blogid, r.title) for r in rows] == [
+        (1, "What I did Today"),
+        (3, "How to make a pie."),
+    ]
+
+    rows = list(q.get_blogs(pg_conn, userid=3, row_factory=anosql.dict_row))
+    assert rows == [{"blogid": 2, "title": "Testing"}]
+
+    assert list(q.get_blogs(pg_conn, userid=42, row_factory=anosql.dict_row)) == []
@@ -236,3 +236,18 @@ def test_without_trailing_semi_colon_pg():
     _queries = "-- name: get-by-a\n" "SELECT a, b, c FROM foo WHERE a = :a\n"
     q = anosql.from_str(_queries, "psycopg2")
     assert q.get_by_a.sql == "SELECT a, b, c FROM foo WHERE a = %(a)s"
+
+
+def test_asyncpg_positional_parameters():
+    from anosql.adapters.asyncpg import (
+        _positional,
+    )
+
+    q = anosql.from_str(
+        "-- name: get-by-a\n"
+        "SELECT a::text, ':b' FROM foo WHERE a = :a AND (b = :b OR c = :a)\n",
+        "asyncpg",
+    )
+    sql, names = _positional(q.get_by_a.sql)
+    assert sql == "SELECT a::text, ':b' FROM foo WHERE a = $1 AND (b = $2 OR c = $1)"
+    assert names == ["a", "b"]
@@ -1,4 +1,5 @@
 import os
+import sqlite3
 
 import anosql
 import pytest
@@ -112,3 +113,192 @@ def test_insert_many(sqlite3_conn, queries):
             ("Blog Part 2", "2018-12-05"),
             ("Blog Part 1", "2018-12-04"),
         ]
+
+
+def test_insert_returning_clause(sqlite3_conn):
+    q = anosql.from_str(
+        "-- name: publish-blog<!\n"
+        "INSERT INTO blogs (userid, title, content, published)\n"
+        "VALUES (:userid, :title, :content, :published)\n"
+        "RETURNING blogid, title;\n",
+        "sqlite3",
+    )
+
+    with sqlite3_conn:
+        for n in range(3):
+            ((blogid, title),) = q.publish_blog(
+                sqlite3_conn,
+                userid=2,
+                title=f"Blog {n}",
+                content="...",
+                published="2018-12-04",
+            )
+            assert title == f"Blog {n}"
+
+
+def test_unknown_op_type():
+    from anosql.core import _create_fns
+
+    with pytest.raises(ValueError):
+        adapter = anosql.core.get_driver_adapter("sqlite3")
+        _create_fns("foo", "", -1, "SELECT 1;", adapter)
+
+
+def test_cached_queries(sqlite3_conn, tmp_path, monkeypatch):
+    dir_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "blogdb", "sql")
+    cache_dir = str(tmp_path / "cache")
+
+    queries = anosql.from_path(dir_path, "sqlite3", cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 4
+
+    # Subsequent loads come from the cache, without re-parsing
+    def parse_query(*args):
+        raise AssertionError("parsed a cached query")
+
+    monkeypatch.setattr(anosql.core, "parse_query", parse_query)
+    cached = anosql.from_path(dir_path, "sqlite3", cache_dir=cache_dir)
+
+    assert cached.available_queries == queries.available_queries
+    assert cached.blogs.get_user_blogs.sql == queries.blogs.get_user_blogs.sql
+    assert cached.blogs.get_user_blogs.parameters == ("userid",)
+    assert cached.blogs.get_user_blogs(sqlite3_conn, userid=1) == [
+        ("How to make a pie.", "2018-11-23"),
+        ("What I did Today", "2017-07-28"),
+    ]
+
+
+def test_lazy_queries(sqlite3_conn, queries):
+    dir_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "blogdb", "sql")
+    lazy = anosql.from_path(dir_path, "sqlite3", lazy=True)
+
+    assert "blogs" not in vars(lazy)
+    assert len(lazy.blogs.get_user_blogs(sqlite3_conn, userid=1)) == 2
+    assert "blogs" in vars(lazy)
+    assert lazy.available_queries == queries.available_queries
+
+    with pytest.raises(AttributeError):
+        lazy.nonexistent
+
+
+def test_select_stream(sqlite3_conn):
+    q = anosql.from_str(
+        "-- name: get-blogs*\n"
+        "SELECT blogid, title FROM blogs WHERE userid = :userid ORDER BY blogid;\n",
+        "sqlite3",
+    )
+
+    rows = q.get_blogs(sqlite3_conn, userid=1)
+    assert not isinstance(rows, list)
+    assert list(rows) == [(1, "What I did Today"), (3, "How to make a pie.")]
+
+    rows = list(
+        q.get_blogs(
+            sqlite3_conn, userid=1, batch_size=1, row_factory=anosql.namedtuple_row
+        )
+    )
+    assert [(r.blogid, r.title) for r in rows] == [
+        (1, "What I did Today"),
+        (3, "How to make a pie."),
+    ]
+
+    rows = list(q.get_blogs(sqlite3_conn, userid=3, row_factory=anosql.dict_row))
+    assert rows == [{"blogid": 2, "title": "Testing"}]
+
+
+def test_bulk_load(sqlite3_conn, queries):
+    blogs = ((2, f"Blog {n}", "...", "2018-12-04") for n in range(25))
+    seen = []
+
+    stats = anosql.bulk_load(
+        sqlite3_conn,
+        queries.blogs.sqlite_bulk_publish,
+        blogs,
+        chunk_size=10,
+        progress=seen.append,
+    )
+
+    assert (stats.rows, stats.chunks) == (25, 3)
+    assert [(s.rows, s.chunks) for s in seen] == [(10, 1), (20, 2), (25, 3)]
+    assert stats.rows_per_second > 0
+    assert not sqlite3_conn.in_transaction
+    assert len(queries.blogs.get_user_blogs(sqlite3_conn, userid=2)) == 25
+
+
+def test_bulk_load_rollback(sqlite3_conn, queries):
+    blogs = [(2, "Blog", "...", "2018-12-04")] * 3 + [(2, None, "...", "2018-12-04")]
+
+    with pytest.raises(sqlite3.IntegrityError):
+        anosql.bulk_load(
+            sqlite3_conn, queries.blogs.sqlite_bulk_publish, blogs, chunk_size=2
+        )
+
+    # The first chunk was committed, and the failed one rolled back
+    assert len(queries.blogs.get_user_blogs(sqlite3_conn, userid=2)) == 2
+
+    with pytest.raises(ValueError):
+        anosql.bulk_load(sqlite3_conn, queries.blogs.get_user_blogs, blogs)
+
+
+def test_query_metrics(sqlite3_conn):
+    dir_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "blogdb", "sql")
+    metrics = anosql.QueryMetrics(slow_query_seconds=0)
+    queries = anosql.from_path(dir_path, "sqlite3", metrics=metrics)
+    assert queries.metrics is metrics
+
+    queries.blogs.get_user_blogs(sqlite3_conn, userid=1)
+    queries.blogs.get_user_blogs(sqlite3_conn, userid=3)
+    with pytest.raises(sqlite3.Error):
+        queries.blogs.get_user_blogs(sqlite3_conn)
+
+    snapshot = metrics.snapshot()
+    stats = snapshot["queries"]["blogs.get_user_blogs"]
+    assert (stats["calls"], stats["errors"], stats["rows"]) == (3, 1, 3)
+    assert stats["latency"]["count"] == 3
+
+    # With a threshold of 0 every query is slow, so the slowest call's plan is kept
+    slow = snapshot["slow"]["blogs.get_user_blogs"]
+    assert slow["seconds"] > 0
+    assert any("blogs" in str(row) for row in slow["plan"])
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_query_metrics_children(sqlite3_conn, tmp_path, lazy):
+    for child, table in [("users", "users"), ("blogs", "blogs")]:
+        (tmp_path / child / "nested").mkdir(parents=True)
+        (tmp_path / child / "queries.sql").write_text(
+            "-- name: get-all\nSELECT * FROM {};\n".format(table)
+        )
+    (tmp_path / "blogs" / "nested" / "queries.sql").write_text(
+        "-- name: get-all\nSELECT * FROM blogs;\n"
+    )
+
+    metrics = anosql.QueryMetrics()
+    queries = anosql.from_path(str(tmp_path), "sqlite3", lazy=lazy, metrics=metrics)
+    queries.users.get_all(sqlite3_conn)
+    queries.blogs.get_all(sqlite3_conn)
+    queries.blogs.get_all(sqlite3_conn)
+    queries.blogs.nested.get_all(sqlite3_conn)
+
+    stats = metrics.snapshot()["queries"]
+    assert {name: s["calls"] for name, s in stats.items()} == {
+        "blogs.get_all": 2,
+        "blogs.nested.get_all": 1,
+        "users.get_all": 1,
+    }
+    assert stats["users.get_all"]["rows"] == 3
+    assert stats["blogs.get_all"]["rows"] == 6
+
+
+def test_query_metrics_stream(sqlite3_conn):
+    metrics = anosql.QueryMetrics()
+    q = anosql.from_str(
+        "-- name: get-blogs*\nSELECT title FROM blogs;\n", "sqlite3", metrics=metrics
+    )
+
+    for _ in q.get_blogs(sqlite3_conn, batch_size=1):
+        break
+    assert len(list(q.get_blogs(sqlite3_conn))) == 3
+
+    stats = metrics.snapshot()["queries"]["get_blogs"]
+    assert (stats["calls"], stats["errors"], stats["rows"]) == (2, 0, 4)
+    assert metrics.snapshot()["slow"] == {}
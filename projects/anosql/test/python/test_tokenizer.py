@@ -0,0 +1,83 @@
+import anosql
+from anosql.tokenizer import (
+    normalize,
+    parameter_names,
+    rewrite_parameters,
+    tokenize,
+)
+
+
+def test_tokenize_roundtrip():
+    sql = "SELECT a::text, ':b', \"c  d\" -- comment\nFROM `t` /* x */ WHERE e = :e;"
+    assert "".join(text for _, text in tokenize(sql)) == sql
+
+
+def test_normalize():
+    assert (
+        normalize("SELECT a ,\n  b -- the b\nFROM foo\n WHERE c IN ( 1 , 2 )\n;")
+        == "SELECT a, b FROM foo WHERE c IN (1, 2);"
+    )
+    # Quoted strings and identifiers are left alone
+    assert (
+        normalize("SELECT '--  not a comment ,', \"a  ( b\" FROM /* gone */ foo")
+        == "SELECT '--  not a comment ,', \"a  ( b\" FROM foo"
+    )
+
+
+def test_parameter_names():
+    assert parameter_names(
+        "SELECT a::int, ':b' FROM foo WHERE a = :a AND (b = :b OR c = :a)"
+    ) == ["a", "b"]
+
+    q = anosql.from_str(
+        "-- name: get-foo\nSELECT * FROM foo WHERE a = :a AND b = :b\n", "sqlite3"
+    )
+    assert q.get_foo.parameters == ("a", "b")
+    assert q.get_foo_cursor.parameters == ("a", "b")
+
+
+def test_slices_not_parameters():
+    sql = "SELECT arr[1:2], arr[:n], a$b FROM foo WHERE a = :a AND b = $1"
+    assert parameter_names(sql) == ["n", "a"]
+    assert rewrite_parameters(sql, lambda name: "%({})s".format(name)) == (
+        "SELECT arr[1:2], arr[%(n)s], a$b FROM foo WHERE a = %(a)s AND b = $1"
+    )
+
+
+def test_dollar_quotes():
+    sql = (
+        "CREATE FUNCTION f(a int) RETURNS int AS $$\n"
+        "  SELECT :a  -- not a parameter\n"
+        "$$ LANGUAGE sql; SELECT $body$ :b $$ :c $body$, :d"
+    )
+    assert "".join(text for _, text in tokenize(sql)) == sql
+    assert parameter_names(sql) == ["d"]
+    # Dollar-quoted bodies are left as written
+    assert normalize(sql) == (
+        "CREATE FUNCTION f(a int) RETURNS int AS $$\n"
+        "  SELECT :a  -- not a parameter\n"
+        "$$ LANGUAGE sql; SELECT $body$ :b $$ :c $body$, :d"
+    )
+
+
+def test_psycopg2_parameters():
+    q = anosql.from_str(
+        "-- name: get-foo\n"
+        "SELECT a::text, ':c' FROM foo WHERE (a, b) = (:a,:b) AND d LIKE 'x%'\n\n"
+        "-- name: get-bar\n"
+        "SELECT * FROM bar WHERE a = %(a)s AND b = %s AND c LIKE 'y%%'\n\n"
+        "-- name: create-foo#\n"
+        "CREATE TABLE foo (a text DEFAULT '%')\n",
+        "psycopg2",
+    )
+
+    assert q.get_foo.sql == (
+        "SELECT a::text, ':c' FROM foo WHERE (a, b) = (%(a)s,%(b)s) AND d LIKE 'x%%'"
+    )
+    # Native placeholders, and already escaped percents, pass through
+    assert (
+        q.get_bar.sql
+        == "SELECT * FROM bar WHERE a = %(a)s AND b = %s AND c LIKE 'y%%'"
+    )
+    # Scripts are run without parameters, so aren't escaped
+    assert q.create_foo.sql == "CREATE TABLE foo (a text DEFAULT '%')"
@@ -1,18 +1,48 @@
 """
 Benchmarking the jobq.
+
+With no arguments, runs single-threaded micro-benchmarks of each operation. The `load` command
+instead runs M producer and N consumer processes against a single queue file, measuring
+throughput, latency percentiles and SQLITE_BUSY contention per operation. Calls which found
+nothing, such as empty polls, are reported separately as misses.
 """
 
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 from contextlib import contextmanager
 import json
 import logging
 import os
+import platform
 from random import choice, randint
+import sqlite3
 from statistics import mean, median, stdev
 import string
+import sys
 import tempfile
-from time import perf_counter_ns
+from time import perf_counter_ns, sleep, time
+
+from jobq import JobQueue, PROFILES
+from jobq.codec import CODECS, get_codec
+
 
-from jobq import JobQueue
+parser = argparse.ArgumentParser(description=__doc__)
+subparsers = parser.add_subparsers(dest="command")
+
+load_parser = subparsers.add_parser("load", help="Run a multi-process load test")
+load_parser.add_argument("--path", default="/tmp/jobq-load.sqlite3")
+load_parser.add_argument("--profile", default="durable", choices=sorted(PROFILES))
+load_parser.add_argument("--codec", default="json", choices=sorted(CODECS))
+load_parser.add_argument(
+    "--busy-timeout", type=int, default=None, help="ms; overrides the profile"
+)
+load_parser.add_argument("--producers", type=int, default=2)
+load_parser.add_argument("--consumers", type=int, default=2)
+load_parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+load_parser.add_argument("--payload-size", type=int, default=256)
+load_parser.add_argument(
+    "--json", dest="json_path", help="Write results as JSON here ('-' for stdout)"
+)
 
 
 def randstr(len):
@@ -53,6 +83,21 @@ def timer(val: float) -> str:
             return f"{scaled_val} {unit}"
 
 
+def percentiles(timings) -> dict:
+    """Nearest-rank p50/p95/p99/p999 of the given timings."""
+
+    timings = sorted(timings)
+    return {
+        name: timings[min(len(timings) - 1, int(len(timings) * q))]
+        for name, q in [
+            ("p50", 0.50),
+            ("p95", 0.95),
+            ("p99", 0.99),
+            ("p999", 0.999),
+        ]
+    }
+
+
 def bench(callable, reps):
     timings = []
     with timing() as run_t:
@@ -60,11 +105,13 @@ def bench(callable, reps):
             with timing() as t:
                 callable()
             timings.append(t.duration)
+    ps = percentiles(timings)
     print(
         f"""Ran {callable.__name__!r} {reps} times, total time {timer(run_t.duration)}
   mean: {timer(mean(timings))}
   median: {timer(median(timings))}
   stddev: {timer(stdev(timings))}
+  p95: {timer(ps["p95"])}, p99: {timer(ps["p99"])}, p999: {timer(ps["p999"])}
   test overhead: {timer((run_t.duration - sum(timings)) / reps)}
 """
     )
@@ -130,7 +177,181 @@ def test_append(q, reps):
     bench(append_event, reps)
 
 
-if __name__ == "__main__":
+def _is_busy(e: sqlite3.OperationalError) -> bool:
+    msg = str(e).lower()
+    return "locked" in msg or "busy" in msg
+
+
+class Recorder(object):
+    """Per-process latency, miss and SQLITE_BUSY records for each operation.
+
+    Calls which found nothing (e.g. empty polls) are counted as misses, not timed as operations.
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self.busy = {}
+        self.misses = {}
+        self.started = None
+        self.finished = None
+
+    def record(self, op, fn, *args, **kwargs):
+        start = perf_counter_ns()
+        try:
+            result = fn(*args, **kwargs)
+        except sqlite3.OperationalError as e:
+            if not _is_busy(e):
+                raise
+            self.busy[op] = self.busy.get(op, 0) + 1
+            return None
+        if result is None:
+            self.misses[op] = self.misses.get(op, 0) + 1
+        else:
+            self.timings.setdefault(op, []).append(perf_counter_ns() - start)
+        return result
+
+    def run(self, start, deadline, step):
+        """Wait for the shared start time, then call step until the deadline."""
+
+        sleep(max(0.0, start - time()))
+        self.started = time()
+        while time() < deadline:
+            step()
+        self.finished = time()
+
+
+def _open(opts) -> JobQueue:
+    profile = dict(PROFILES[opts.profile])
+    if opts.busy_timeout is not None:
+        profile["busy_timeout"] = opts.busy_timeout
+    return JobQueue(opts.path, profile=profile, codec=opts.codec, migrate=False)
+
+
+def producer(opts, start, deadline):
+    """From the start time, create jobs (and append an event to each) until the deadline."""
+
+    logging.getLogger().setLevel(logging.WARN)
+    q, r = _open(opts), Recorder()
+
+    def step():
+        job = r.record(
+            "create",
+            q.create,
+            {"user_id": randint(0, 1 << 32), "msg": randstr(opts.payload_size)},
+            new_state=["CREATED"],
+        )
+        if job:
+            r.record("append_event", q.append_event, job.id, {"foo": "bar"})
+
+    r.run(start, deadline, step)
+    q.close()
+    return r.__dict__
+
+
+def consumer(opts, start, deadline):
+    """From the start time, poll jobs and mark them done until the deadline."""
+
+    logging.getLogger().setLevel(logging.WARN)
+    q, r = _open(opts), Recorder()
+
+    def step():
+        job = r.record(
+            "poll",
+            q.poll,
+            "json_extract(j.state, '$[0]') = 'CREATED'",
+            ["POLLED", os.getpid()],
+        )
+        if job:
+            r.record("cas_state", q.cas_state, job.id, job.state, ["DONE"])
+
+    r.run(start, deadline, step)
+    q.close()
+    return r.__dict__
+
+
+def load(opts):
+    """Run producers and consumers against one queue, returning machine-readable results."""
+
+    for suffix in ["", "-wal", "-shm"]:
+        if os.path.exists(opts.path + suffix):
+            os.remove(opts.path + suffix)
+
+    # Create and migrate the queue once, up front
+    JobQueue(opts.path, profile=opts.profile, codec=opts.codec).close()
+
+    workers = opts.producers + opts.consumers
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Leave a moment for the workers to start, all of which wait for the shared start time
+        start = time() + 1.0
+        deadline = start + opts.duration
+        futures = [
+            pool.submit(producer, opts, start, deadline) for _ in range(opts.producers)
+        ]
+        futures += [
+            pool.submit(consumer, opts, start, deadline) for _ in range(opts.consumers)
+        ]
+        records = [f.result() for f in futures]
+
+    # Throughput is over the time the workers actually ran, start to finish
+    elapsed = max(r["finished"] for r in records) - min(r["started"] for r in records)
+
+    ops = {}
+    for record in records:
+        for op, timings in record["timings"].items():
+            ops.setdefault(op, {"timings": [], "busy": 0, "misses": 0})["timings"] += timings
+        for key in ["busy", "misses"]:
+            for op, count in record[key].items():
+                ops.setdefault(op, {"timings": [], "busy": 0, "misses": 0})[key] += count
+
+    results = {}
+    for op, data in sorted(ops.items()):
+        timings = data["timings"]
+        results[op] = {
+            "count": len(timings),
+            "throughput": len(timings) / elapsed,
+            "misses": data["misses"],
+            "miss_rate": data["misses"] / elapsed,
+            "busy": data["busy"],
+            **({"mean": mean(timings), **percentiles(timings)} if timings else {}),
+        }
+
+    return {
+        "config": {
+            k: v for k, v in vars(opts).items() if k not in ["command", "json_path"]
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+        },
+        "timestamp": int(time()),
+        "elapsed": elapsed,
+        "latency_unit": "ns",
+        "results": results,
+    }
+
+
+def print_load(results):
+    config = results["config"]
+    print(
+        f"Ran {config['producers']} producers and {config['consumers']} consumers "
+        f"against {config['path']} ({config['profile']}) for {results['elapsed']:.2f} s"
+    )
+    for op, r in results["results"].items():
+        print(f"{op}: {r['count']} ops, {r['throughput']:.1f} ops/s")
+        if r["count"]:
+            print(
+                f"  mean: {timer(r['mean'])}, p50: {timer(r['p50'])}, p95: {timer(r['p95'])}, "
+                f"p99: {timer(r['p99'])}, p999: {timer(r['p999'])}"
+            )
+        print(
+            f"  misses: {r['misses']} ({r['miss_rate']:.1f}/s), SQLITE_BUSY: {r['busy']}"
+        )
+
+
+def micro():
+    """Single-threaded benchmarks of each operation, against each profile and codec."""
+
     # No logs
     logging.getLogger().setLevel(logging.WARN)
 
@@ -138,23 +359,51 @@ if __name__ == "__main__":
     reps = 10000
     path = "/tmp/jobq-bench.sqlite3"
 
-    # Ensuring a clean-ish run env.
-    if os.path.exists(path):
-        os.remove(path)
-
     print("Getting a baseline")
     test_reference_json(reps)
     test_reference_fsync(reps)
 
-    # And the tests
-    print(f"Testing with {path}")
-    q = JobQueue(path)
-    test_insert(q, reps)
-    test_poll(q, reps)
-    test_append(q, reps)
-
-    print("Testing with :memory:")
-    q = JobQueue(":memory:")
-    test_insert(q, reps)
-    test_poll(q, reps)
-    test_append(q, reps)
+    # And the tests, comparing each durability profile
+    for profile in PROFILES:
+        for suffix in ["", "-wal", "-shm"]:
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+        print(f"Testing with {path} ({profile})")
+        q = JobQueue(path, profile=profile)
+        test_insert(q, reps)
+        test_poll(q, reps)
+        test_append(q, reps)
+        q.close()
+
+    # In memory, where serialization costs aren't hidden behind I/O, comparing each codec
+    for codec in CODECS:
+        try:
+            get_codec(codec)
+        except ImportError as e:
+            print(f"Skipping codec {codec}: {e}")
+            continue
+
+        print(f"Testing with :memory: ({codec})")
+        q = JobQueue(":memory:", codec=codec)
+        test_insert(q, reps)
+        test_poll(q, reps)
+        test_append(q, reps)
+
+
+if __name__ == "__main__":
+    opts = parser.parse_args()
+
+    if opts.command == "load":
+        # No logs
+        logging.getLogger().setLevel(logging.WARN)
+        results = load(opts)
+        print_load(results)
+        if opts.json_path == "-":
+            json.dump(results, sys.stdout, indent=2)
+        elif opts.json_path:
+            with open(opts.json_path, "w") as fp:
+                json.dump(results, fp, indent=2)
+
+    else:
+        micro()
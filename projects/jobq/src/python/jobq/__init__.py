@@ -2,17 +2,28 @@
 A job queue library teetering atop sqlite3.
 """
 
-from datetime import datetime
-import json
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from functools import wraps
 import logging
+import re
 import sqlite3
-from typing import NamedTuple, Optional as Maybe
+from time import monotonic, perf_counter, sleep
+from typing import (
+    Iterator,
+    List,
+    Optional as Maybe,
+)
+import zlib
 
 import anosql
 from anosql_migrations import (
     run_migrations,
     with_migrations,
 )
+from jobq.codec import get_codec
+from jobq.metrics import NULL_METRICS
+from jobq.notify import Notifier
 
 
 _GET_JOB_FIELDS = """\
@@ -21,6 +32,18 @@ _GET_JOB_FIELDS = """\
 ,   `events`
 ,   `state`
 ,   `modified`
+,   `priority`
+,   `run_after`
+"""
+
+_ARCHIVE_FIELDS = """\
+    `id`
+,   `payload`
+,   `events`
+,   `state`
+,   `modified`
+,   `priority`
+,   `run_after`
 """
 
 _GET_JOB_ORDER = """\
@@ -28,6 +51,25 @@ _GET_JOB_ORDER = """\
 ,   `rowid` ASC
 """
 
+# Polls take the highest priority job first, and the longest-untouched job within a priority.
+_POLL_ORDER = """\
+    `priority` DESC
+,   `modified` ASC
+,   `id` ASC
+"""
+
+_ARCHIVE_COLUMNS = """\
+    `id` INTEGER PRIMARY KEY                -- the ID the job had in the `job` table
+,   `payload` BLOB                          -- JSON payload, or zlib compressed JSON payload
+,   `events` BLOB                           -- JSON events, or zlib compressed JSON events
+,   `state` TEXT                            -- JSON state of the job when archived
+,   `modified` INTEGER                      -- last modified
+,   `priority` INTEGER NOT NULL DEFAULT 0   -- the job's priority
+,   `run_after` INTEGER NOT NULL DEFAULT 0  -- the job's run_after
+,   `archived` INTEGER                      -- when the job was archived
+,   `compressed` INTEGER                    -- whether the payload and events are compressed
+"""
+
 _SQL = f"""\
 -- name: migration-0000-create-jobq
 CREATE TABLE `job` (
@@ -43,17 +85,54 @@ CREATE TABLE `job` (
 CREATE INDEX IF NOT EXISTS `job_modified` ON `job` (
     `modified`
 );
+-- name: migration-0002-add-lease-expires
+-- The time at which a poll's lease (visibility timeout) lapses, if any
+ALTER TABLE `job` ADD COLUMN `lease_expires` INTEGER DEFAULT NULL;
+-- name: migration-0003-add-lease-state
+-- The JSON state a job held before it was leased, to which the reaper returns it
+ALTER TABLE `job` ADD COLUMN `lease_state` TEXT DEFAULT NULL;
+-- name: migration-0004-index-lease-expires
+-- Enable efficient reaping of expired leases without scanning unleased jobs
+CREATE INDEX IF NOT EXISTS `job_lease_expires` ON `job` (
+    `lease_expires`
+) WHERE `lease_expires` IS NOT NULL;
+-- name: migration-0005-create-job-archive
+-- Finished jobs may be archived here, out of the way of pollers
+CREATE TABLE IF NOT EXISTS `job_archive` (
+{_ARCHIVE_COLUMNS}
+);
+-- name: migration-0006-add-priority
+-- Jobs with a higher priority are polled first
+ALTER TABLE `job` ADD COLUMN `priority` INTEGER NOT NULL DEFAULT 0;
+-- name: migration-0007-add-run-after
+-- Jobs may not be polled until after this time
+ALTER TABLE `job` ADD COLUMN `run_after` INTEGER NOT NULL DEFAULT 0;
+-- name: migration-0008-index-ready
+-- Enable polling the highest priority, longest-untouched undelayed job by walking a single index
+CREATE INDEX IF NOT EXISTS `job_ready` ON `job` (
+    `priority` DESC
+,   `modified` ASC
+) WHERE `run_after` = 0;
+-- name: migration-0009-index-delayed
+-- Enable finding delayed jobs which have come due, without walking those which haven't
+CREATE INDEX IF NOT EXISTS `job_delayed` ON `job` (
+    `run_after`
+) WHERE `run_after` > 0;
 -- name: job-create<!
 INSERT INTO `job` (
     `payload`
 ,   `state`
 ,   `events`
 ,   `modified`
+,   `priority`
+,   `run_after`
 ) VALUES (
     :payload
 ,   json(:state)
 ,   json_array(json_array('job_created', json_object('timestamp', strftime('%s', 'now'))))
 ,   strftime('%s','now')
+,   :priority
+,   :run_after
 )
 RETURNING
 {_GET_JOB_FIELDS}
@@ -96,12 +175,52 @@ SET
     `events` = json_insert(events, '$[#]', json_array('job_state_advanced', json_object('old', json(:old_state), 'new', json(:new_state), 'timestamp', strftime('%s', 'now'))))
 ,   `state` = json(:new_state)
 ,   `modified` = strftime('%s', 'now')
+,   `lease_expires` = NULL
+,   `lease_state` = NULL
+,   `priority` = coalesce(:priority, `priority`)
+,   `run_after` = coalesce(:run_after, `run_after`)
 WHERE
     `id` = :id
 AND `state` = json(:old_state)
 RETURNING
 {_GET_JOB_FIELDS}
 ;
+-- name: job-heartbeat<!
+UPDATE
+    `job`
+SET
+    `lease_expires` = CAST(strftime('%s', 'now') AS INTEGER) + :lease
+WHERE
+    `id` = :id
+AND `state` = json(:state)
+AND `lease_expires` IS NOT NULL
+RETURNING
+{_GET_JOB_FIELDS}
+;
+-- name: job-reap<!
+UPDATE
+    `job`
+SET
+    `events` = json_insert(events, '$[#]', json_array('job_lease_expired', json_object('old', json(state), 'new', json(lease_state), 'timestamp', strftime('%s', 'now'))))
+,   `state` = `lease_state`
+,   `modified` = strftime('%s', 'now')
+,   `lease_expires` = NULL
+,   `lease_state` = NULL
+WHERE
+    `id` IN (
+SELECT
+    `id`
+FROM
+    `job`
+WHERE
+    `lease_expires` <= CAST(strftime('%s', 'now') AS INTEGER)
+ORDER BY
+    `lease_expires` ASC
+LIMIT :limit
+)
+RETURNING
+{_GET_JOB_FIELDS}
+;
 """
 
 # Anosql even as forked doesn't quite support inserting formatted sub-queries.
@@ -114,37 +233,262 @@ SELECT
 FROM
     `job` AS `j`
 WHERE
-    {{}}
+    ({{query}})
+{{keyset}}
 ORDER BY
 {_GET_JOB_ORDER}
+LIMIT :limit
+;
+"""
+
+_DEPTH_SQL = """\
+SELECT
+    `state`
+,   count(*)
+FROM
+    `job`
+GROUP BY
+    `state`
+;
+"""
+
+_COUNT_SQL = """\
+SELECT
+    count(*)
+FROM
+    `job` AS `j`
+WHERE
+    ({query})
 ;
 """
 
+# A range scan of the `job_delayed` index, so only delayed jobs are visited.
+_NEXT_DUE_SQL = """\
+SELECT
+    min(`j`.`run_after`)
+FROM
+    `job` AS `j`
+WHERE
+    ({query})
+AND `j`.`run_after` > 0
+;
+"""
+
+# Keyset pagination over _GET_JOB_ORDER, resuming after a given (modified, id).
+# Phrased so that the leading term is a range scan of the `job_modified` index.
+_KEYSET_SQL = """\
+AND `j`.`modified` >= :after_modified
+AND (`j`.`modified` > :after_modified OR `j`.`id` > :after_id)
+"""
+
+# Polls take the best of the best undelayed jobs (walking the `job_ready` index in order) and the
+# best of the delayed jobs which have come due (a range scan of the `job_delayed` index), so jobs
+# which aren't yet due are never visited. Polling a job clears its run_after, so that polled jobs
+# don't accumulate in the delayed index.
 _POLL_SQL = f"""\
 UPDATE `job`
 SET
     `events` = json_insert(events, '$[#]', json_array('job_state_advanced', json_object('old', json(state), 'new', json(:state), 'timestamp', strftime('%s', 'now'))))
+,   `lease_state` = CASE WHEN :lease IS NULL THEN NULL ELSE `state` END
+,   `lease_expires` = CASE WHEN :lease IS NULL THEN NULL ELSE CAST(strftime('%s', 'now') AS INTEGER) + :lease END
 ,   `state` = json(:state)
 ,   `modified` = strftime('%s', 'now')
+,   `run_after` = 0
 WHERE
     `id` IN (
 SELECT
     `id`
-FROM
-    `job` AS `j`
-WHERE
-    {{}}
+FROM (
+    SELECT * FROM (
+        SELECT
+            `id`
+        ,   `priority`
+        ,   `modified`
+        FROM
+            `job` AS `j`
+        WHERE
+            ({{0}})
+        AND `j`.`run_after` = 0
+        ORDER BY
+{_POLL_ORDER}
+        LIMIT :limit
+    )
+    UNION ALL
+    SELECT * FROM (
+        SELECT
+            `id`
+        ,   `priority`
+        ,   `modified`
+        FROM
+            `job` AS `j`
+        WHERE
+            ({{0}})
+        AND `j`.`run_after` > 0
+        AND `j`.`run_after` <= CAST(strftime('%s', 'now') AS INTEGER)
+        ORDER BY
+{_POLL_ORDER}
+        LIMIT :limit
+    )
+)
 ORDER BY
-{_GET_JOB_ORDER}
-LIMIT 1
+{_POLL_ORDER}
+LIMIT :limit
 )
 RETURNING
 {_GET_JOB_FIELDS}
 ;
 """
 
+# Archival moves jobs in batches from the `job` table to an archive table, which may be in an
+# attached file.
+_ARCHIVE_TABLE_SQL = f"""\
+CREATE TABLE IF NOT EXISTS `{{schema}}`.`job_archive` (
+{_ARCHIVE_COLUMNS}
+);
+"""
+
+_ARCHIVE_SELECT_SQL = f"""\
+SELECT
+{_ARCHIVE_FIELDS}
+FROM
+    `job` AS `j`
+WHERE
+    ({{query}})
+AND `j`.`id` > :after_id
+ORDER BY
+    `id` ASC
+LIMIT :limit
+;
+"""
+
+_ARCHIVE_INSERT_SQL = """\
+INSERT OR REPLACE INTO `{schema}`.`job_archive` (
+    `id`
+,   `payload`
+,   `events`
+,   `state`
+,   `modified`
+,   `priority`
+,   `run_after`
+,   `archived`
+,   `compressed`
+) VALUES (
+    :id
+,   :payload
+,   :events
+,   :state
+,   :modified
+,   :priority
+,   :run_after
+,   strftime('%s', 'now')
+,   :compressed
+);
+"""
+
+_ARCHIVE_GET_SQL = f"""\
+SELECT
+{_ARCHIVE_FIELDS}
+,   `compressed`
+FROM
+    `{{schema}}`.`job_archive`
+WHERE
+    `id` = :id
+;
+"""
+
+# Durability profiles, trading durability for throughput.
+#
+# All profiles use WAL so that readers don't block the writer (nor the writer readers), and a busy
+# timeout so that concurrent writers wait on each other rather than failing with SQLITE_BUSY.
+# - `durable` fsyncs the WAL on every commit. No committed job is ever lost.
+# - `balanced` fsyncs only at checkpoints. Committed jobs may be lost on power failure, but the
+#   database cannot be corrupted.
+# - `fast` never fsyncs. An OS crash or power failure may lose jobs or corrupt the database.
+# - `rollback` is SQLite's default rollback journal, for reference.
+#
+# Incremental auto-vacuum (which lets archival return space without a full VACUUM) can only be
+# enabled when a database is created, so it has no effect on existing queues.
+PROFILES = {
+    "durable": {
+        "auto_vacuum": "INCREMENTAL",
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "busy_timeout": 5000,
+        "mmap_size": 0,
+        "cache_size": -2000,
+    },
+    "balanced": {
+        "auto_vacuum": "INCREMENTAL",
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -16000,
+    },
+    "fast": {
+        "auto_vacuum": "INCREMENTAL",
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "busy_timeout": 5000,
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64000,
+    },
+    "rollback": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "busy_timeout": 5000,
+    },
+}
+
+# The pragmas a profile may set, in the order they are applied.
+_PRAGMAS = [
+    "auto_vacuum",
+    "journal_mode",
+    "synchronous",
+    "busy_timeout",
+    "mmap_size",
+    "cache_size",
+]
+
 log = logging.getLogger(__name__)
-logging.basicConfig(level=logging.DEBUG)
+
+
+def configure(db: sqlite3.Connection, profile) -> dict:
+    """Apply a durability profile (by name, or a dict of pragmas) to a connection.
+
+    Returns the effective settings as reported back by SQLite.
+    """
+
+    if isinstance(profile, str):
+        try:
+            profile = PROFILES[profile]
+        except KeyError:
+            raise ValueError(
+                f"Unknown profile {profile!r}, expected one of {sorted(PROFILES)}"
+            )
+
+    unknown = set(profile) - set(_PRAGMAS)
+    if unknown:
+        raise ValueError(f"Unsupported pragmas {sorted(unknown)}")
+
+    effective = {}
+    for pragma in _PRAGMAS:
+        if pragma not in profile:
+            continue
+
+        value = profile[pragma]
+        # Pragma values can't be bound as parameters, so only allow integers and keywords.
+        if not isinstance(value, int) and not re.fullmatch(r"\w+", str(value)):
+            raise ValueError(f"Invalid value {value!r} for pragma {pragma}")
+
+        db.execute(f"PRAGMA {pragma} = {value}").fetchall()
+        # Some pragmas (eg. mmap_size on :memory:) report nothing back.
+        row = db.execute(f"PRAGMA {pragma}").fetchone()
+        if row:
+            effective[pragma] = row[0]
+
+    log.debug({"profile": effective})
+    return effective
 
 
 def compile_query(query):
@@ -155,7 +499,7 @@ def compile_query(query):
      - `<`, `>`, `<=`, `>=`, `=`
      - `LIKE`
 
-    Query ops join under `AND`
+    Query ops join under `AND`, each parenthesized so that a term's own `OR`s stay within it
     """
 
     if isinstance(query, list):
@@ -163,28 +507,204 @@ def compile_query(query):
     elif isinstance(query, str):
         terms = [query]
 
+    query = " AND ".join(f"({term})" for term in terms)
     assert not any(
         keyword in query.lower() for keyword in ["select", "update", "delete", ";"]
     )
-    return " AND ".join(terms)
+    return query
+
+
+_UNDECODED = object()
+
 
+def _timestamp(when) -> Maybe[int]:
+    """Coerce a datetime, a timedelta from now or a UNIX timestamp to a UNIX timestamp."""
 
-class Job(NamedTuple):
-    id: int
-    payload: object
-    events: object
-    state: object
-    modified: datetime
+    if when is None:
+        return None
+    elif isinstance(when, datetime):
+        return int(when.timestamp())
+    elif isinstance(when, timedelta):
+        return int((datetime.now() + when).timestamp())
+    else:
+        return int(when)
+
+
+class Job(object):
+    """A job, as read from the queue.
+
+    Jobs read from the queue decode their payload, events and state lazily on first access, so
+    callers only pay for the fields they use.
+    """
+
+    __slots__ = (
+        "id",
+        "modified",
+        "priority",
+        "run_after",
+        "_payload",
+        "_events",
+        "_state",
+        "_raw",
+        "_codec",
+    )
+
+    _fields = ("id", "payload", "events", "state", "modified", "priority", "run_after")
+
+    def __init__(
+        self,
+        id: int,
+        payload,
+        events,
+        state,
+        modified: datetime,
+        priority: int = 0,
+        run_after: Maybe[datetime] = None,
+    ):
+        self.id = id
+        self.modified = modified
+        self.priority = priority
+        self.run_after = run_after
+        self._payload = payload
+        self._events = events
+        self._state = state
+        self._raw = None
+        self._codec = None
+
+    @classmethod
+    def _from_row(
+        cls, codec, id, payload, events, state, modified, priority=0, run_after=0
+    ) -> "Job":
+        job = cls.__new__(cls)
+        job.id = int(id)
+        job.modified = datetime.fromtimestamp(int(modified))
+        job.priority = int(priority)
+        # Jobs which were runnable as soon as they were created have no run_after
+        job.run_after = datetime.fromtimestamp(int(run_after)) if run_after else None
+        job._payload = job._events = job._state = _UNDECODED
+        job._raw = (payload, events, state)
+        job._codec = codec
+        return job
+
+    @property
+    def payload(self):
+        if self._payload is _UNDECODED:
+            self._payload = self._codec.loads(self._raw[0])
+        return self._payload
+
+    @property
+    def events(self):
+        if self._events is _UNDECODED:
+            self._events = self._codec.json_loads(self._raw[1])
+        return self._events
+
+    @property
+    def state(self):
+        if self._state is _UNDECODED:
+            self._state = self._codec.json_loads(self._raw[2])
+        return self._state
+
+    def __iter__(self):
+        return iter(
+            (
+                self.id,
+                self.payload,
+                self.events,
+                self.state,
+                self.modified,
+                self.priority,
+                self.run_after,
+            )
+        )
+
+    def __eq__(self, other):
+        if not isinstance(other, Job):
+            return NotImplemented
+        return tuple(self) == tuple(other)
+
+    def __repr__(self):
+        return "Job({})".format(
+            ", ".join(f"{k}={v!r}" for k, v in zip(self._fields, self))
+        )
+
+    def _asdict(self) -> dict:
+        return dict(zip(self._fields, self))
+
+    def _replace(self, **kwargs) -> "Job":
+        fields = self._asdict()
+        fields.update(kwargs)
+        return Job(**fields)
+
+
+def _instrumented(op, miss_on_none=False):
+    """Decorator. Report calls of a JobQueue method as the given op to the queue's metrics.
+
+    If miss_on_none is set, a None result is reported as a miss (nothing matched) not success.
+    """
+
+    def _decorator(fn):
+        @wraps(fn)
+        def _wrapper(self, *args, **kwargs):
+            metrics = self.metrics
+            if metrics is NULL_METRICS:
+                return fn(self, *args, **kwargs)
+
+            self._lock_wait = 0.0
+            outcome = "error"
+            start = perf_counter()
+            try:
+                result = fn(self, *args, **kwargs)
+                outcome = "miss" if miss_on_none and result is None else "ok"
+                return result
+            finally:
+                metrics.observe(op, perf_counter() - start, self._lock_wait, outcome)
+
+        return _wrapper
+
+    return _decorator
 
 
 class JobQueue(object):
-    def __init__(self, path):
-        self._db = sqlite3.connect(path)
+    def __init__(
+        self,
+        path,
+        profile="durable",
+        codec="json",
+        metrics=None,
+        migrate=True,
+        check_same_thread=True,
+        notifier=None,
+    ):
+        """Connect to (and by default migrate) the job queue at path.
+
+        The profile is the name of one of `PROFILES`, or a dict of pragmas to apply.
+
+        The codec is the name of one of `jobq.codec.CODECS`, or a codec instance, and determines
+        how payloads are stored.
+
+        Operations are reported to metrics (see `jobq.metrics`), by default `NULL_METRICS`.
+
+        Additional connections to an already migrated queue may pass `migrate=False` to skip the
+        migration machinery, and `check_same_thread=False` to be handed between threads.
+
+        Queues sharing a `jobq.notify.Notifier` wake each other's waiting polls as soon as they
+        write. By default, a notifier is created the first time one is needed.
+        """
+
+        self._path = path
+        self._notifier = notifier
+        self._owns_notifier = False
+        self._db = sqlite3.connect(path, check_same_thread=check_same_thread)
+        self.profile = configure(self._db, profile)
+        self._codec = get_codec(codec)
+        self.metrics = metrics or NULL_METRICS
+        self._lock_wait = 0.0
         self._queries = anosql.from_str(_SQL, "sqlite3")
 
-        with self._db as db:
-            self._queries = with_migrations("sqlite3", self._queries, db)
-            run_migrations(self._queries, db)
+        if migrate:
+            with self._db as db:
+                self._queries = with_migrations("sqlite3", self._queries, db)
+                run_migrations(self._queries, db)
 
     def __enter__(self, *args, **kwargs):
         pass
@@ -194,14 +714,7 @@ class JobQueue(object):
 
     def _from_tuple(self, result) -> Job:
         assert isinstance(result, tuple)
-        id, payload, events, state, modified = result
-        return Job(
-            int(id),
-            json.loads(payload),
-            json.loads(events),
-            json.loads(state),
-            datetime.fromtimestamp(int(modified)),
-        )
+        return Job._from_row(self._codec, *result)
 
     def _from_result(self, result) -> Job:
         assert isinstance(result, list)
@@ -211,91 +724,451 @@ class JobQueue(object):
     def _from_results(self, results):
         return [self._from_tuple(t) for t in results]
 
+    @contextmanager
+    def _write(self):
+        """A write transaction, taking (and timing the wait for) the write lock up front."""
+
+        with self._db as db:
+            start = perf_counter()
+            db.execute("BEGIN IMMEDIATE")
+            self._lock_wait += perf_counter() - start
+            changes = db.total_changes
+            yield db
+            changed = db.total_changes != changes
+
+        # Only once committed, and only if something actually changed
+        if changed and self._notifier is not None:
+            self._notifier.notify()
+
+    @property
+    def notifier(self) -> Notifier:
+        """The notifier woken by writes to this queue."""
+
+        if self._notifier is None:
+            self._notifier = Notifier(self._path)
+            self._owns_notifier = True
+        return self._notifier
+
     def close(self):
         if self._db:
             self._db.commit()
             self._db.close()
             self._db = None
+        if self._owns_notifier:
+            self._notifier.close()
+            self._owns_notifier = False
 
-    def query(self, query, limit=None):
-        with self._db as db:
-            query = compile_query(query)
+    def _iter_results(self, cur: sqlite3.Cursor, batch_size, start) -> Iterator[Job]:
+        # Time only executing, fetching and decoding, not the consumer's work between batches
+        elapsed, outcome = perf_counter() - start, "error"
+        try:
+            while True:
+                start = perf_counter()
+                jobs = [self._from_tuple(r) for r in cur.fetchmany(batch_size)]
+                elapsed += perf_counter() - start
+                if not jobs:
+                    break
+                yield from jobs
+            outcome = "ok"
+        except GeneratorExit:
+            # Closed early, which is fine
+            outcome = "ok"
+            raise
+        finally:
+            cur.close()
+            if self.metrics is not NULL_METRICS:
+                self.metrics.observe("query", elapsed, 0.0, outcome)
 
-            def qf():
-                cur = db.cursor()
-                cur.execute(_QUERY_SQL.format(query))
-                yield from cur.fetchall()
-                cur.close()
+    def query(self, query, limit=None, after=None, batch_size=256) -> Iterator[Job]:
+        """Query for jobs, lazily producing the matches in `modified` order.
 
-            jobs = qf()
+        Results are fetched from SQLite `batch_size` rows at a time, and decoded a batch at a time
+        as they are consumed, so arbitrarily large result sets can be iterated in constant memory.
 
-            if limit:
-                limit = int(limit)
+        The `limit` is applied in SQL. To fetch the next page of results, pass the last job of the
+        previous page (or its `(modified, id)`) as `after`.
 
-                def lf(iterable):
-                    iterable = iter(iterable)
-                    for i in range(limit):
-                        try:
-                            yield next(iterable)
-                        except StopIteration:
-                            break
+        The iterator reads through this queue's connection, so:
+        - it isn't a snapshot; jobs modified through this queue while iterating (eg. by a poll)
+          may be skipped or produced again
+        - until it is exhausted or closed, it holds a read open, which in WAL mode stops
+          checkpoints from completing
 
-                jobs = lf(jobs)
+        So consume it promptly, or `list()` it. It is reported to metrics as a `query` once
+        exhausted or closed, timing its fetching and decoding.
+        """
 
-            return self._from_results(jobs)
+        params = {"limit": int(limit) if limit else -1}
+        keyset = ""
+        if after is not None:
+            if isinstance(after, Job):
+                after = (after.modified, after.id)
+            modified, id = after
+            if isinstance(modified, datetime):
+                modified = int(modified.timestamp())
+            params.update({"after_modified": int(modified), "after_id": int(id)})
+            keyset = _KEYSET_SQL
 
-    def create(self, job, new_state=None) -> Job:
-        """Create a new job on the queue, optionally specifying its state."""
+        start = perf_counter()
+        cur = self._db.cursor()
+        try:
+            cur.execute(
+                _QUERY_SQL.format(query=compile_query(query), keyset=keyset),
+                params,
+            )
+        except Exception:
+            cur.close()
+            self.metrics.observe("query", perf_counter() - start, 0.0, "error")
+            raise
+        return self._iter_results(cur, batch_size, start)
 
-        with self._db as db:
-            return self._from_result(
-                self._queries.job_create(
-                    db,
-                    payload=json.dumps(job),
-                    state=json.dumps(new_state),
-                )
+    @_instrumented("count")
+    def count(self, query) -> int:
+        """Count the jobs matching a query."""
+
+        (count,) = self._db.execute(
+            _COUNT_SQL.format(query=compile_query(query))
+        ).fetchone()
+        return count
+
+    @_instrumented("next_due")
+    def next_due(self, query) -> Maybe[int]:
+        """When (as a UNIX timestamp) the next delayed job matching a query comes due, if any.
+
+        Jobs which have already come due but not yet been polled count, so the result may be past.
+        """
+
+        (due,) = self._db.execute(
+            _NEXT_DUE_SQL.format(query=compile_query(query))
+        ).fetchone()
+        return due
+
+    @_instrumented("depth")
+    def depth(self) -> dict:
+        """Count the jobs in each (JSON encoded) state, reporting the counts to metrics.
+
+        This scans the whole queue, so should be called periodically rather than per-operation.
+        """
+
+        depths = dict(self._db.execute(_DEPTH_SQL).fetchall())
+        self.metrics.depth(depths)
+        return depths
+
+    @_instrumented("create")
+    def create(self, job, new_state=None, priority=0, run_after=None) -> Job:
+        """Create a new job on the queue, optionally specifying its state.
+
+        Jobs with a higher priority are polled first. If run_after (a datetime, a timedelta from
+        now or a UNIX timestamp) is given, the job will not be polled until after that time.
+        """
+
+        with self._write() as db:
+            return self._create(db, job, new_state, priority, run_after)
+
+    def _create(self, db, job, new_state=None, priority=0, run_after=None) -> Job:
+        return self._from_result(
+            self._queries.job_create(
+                db,
+                payload=self._codec.dumps(job),
+                state=self._codec.json_dumps(new_state),
+                priority=int(priority),
+                run_after=_timestamp(run_after) or 0,
             )
+        )
 
-    def poll(self, query, new_state) -> Maybe[Job]:
-        """Query for the longest-untouched job matching, advancing it to new_state."""
+    @_instrumented("create_many")
+    def create_many(self, jobs) -> List[Job]:
+        """Create many jobs in a single transaction, returning them in order.
 
-        with self._db as db:
+        Each job is a dict of keyword arguments to `create`, e.g.
+        `{"job": payload, "new_state": state, "priority": 10}`.
+        """
+
+        with self._write() as db:
+            return [self._create(db, **kwargs) for kwargs in jobs]
+
+    def _poll(self, query, new_state, lease, limit) -> List[Job]:
+        with self._write() as db:
             cur = db.cursor()
             statement = _POLL_SQL.format(compile_query(query))
-            cur.execute(statement, {"state": json.dumps(new_state)})
-            results = cur.fetchall()
-            if results:
-                return self._from_result(results)
+            cur.execute(
+                statement,
+                {
+                    "state": self._codec.json_dumps(new_state),
+                    "lease": int(lease) if lease is not None else None,
+                    "limit": int(limit),
+                },
+            )
+            return self._from_results(cur.fetchall())
 
-    def get(self, job_id):
-        """Fetch all available data about a given job by ID."""
+    @_instrumented("poll", miss_on_none=True)
+    def _poll_one(self, query, new_state, lease) -> Maybe[Job]:
+        results = self._poll(query, new_state, lease, 1)
+        if results:
+            return results[0]
 
-        with self._db as db:
-            return self._from_result(self._queries.job_get(db, id=job_id))
+    def poll(self, query, new_state, lease=None, wait=None) -> Maybe[Job]:
+        """Query for the highest priority, longest-untouched runnable job matching, advancing it to new_state.
+
+        If a lease (in seconds) is given, the job must be heartbeated or advanced before the lease
+        lapses, otherwise `reap()` will return it to the state it held before it was polled.
+
+        Polling a delayed job clears its run_after.
+
+        If wait (in seconds) is given and no job matches, block until one does or wait lapses.
+        Rather than re-polling in a loop, the queue is re-polled only when notified of a write, or
+        every second for the sake of delayed jobs becoming runnable.
+
+        Each attempt is reported to metrics as a `poll`, and the whole of a waiting poll as a
+        `poll_wait`, so that long waits don't skew poll latencies.
+        """
+
+        if not wait:
+            return self._poll_one(query, new_state, lease)
+
+        start = perf_counter()
+        deadline = monotonic() + wait
+        while True:
+            version = self.notifier.version
+            job = self._poll_one(query, new_state, lease)
+            remaining = deadline - monotonic()
+            if job or remaining <= 0:
+                break
+            self.notifier.wait(version, min(remaining, 1.0))
+
+        if self.metrics is not NULL_METRICS:
+            outcome = "ok" if job else "miss"
+            self.metrics.observe("poll_wait", perf_counter() - start, 0.0, outcome)
+        return job
+
+    @_instrumented("poll_many")
+    def poll_many(self, query, new_state, limit, lease=None) -> List[Job]:
+        """As `poll`, but advance up to limit matching jobs to new_state in a single transaction.
+
+        The polled jobs are returned in no particular order.
+        """
+
+        return self._poll(query, new_state, lease, limit)
 
-    def cas_state(self, job_id, old_state, new_state):
-        """CAS update a job's state, returning the updated job or indicating a conflict."""
+    @_instrumented("get", miss_on_none=True)
+    def get(self, job_id) -> Maybe[Job]:
+        """Fetch all available data about a given job by ID, or None if there's no such job."""
 
         with self._db as db:
-            result = self._queries.job_cas_state(
+            result = self._queries.job_get(db, id=job_id)
+            if result:
+                return self._from_result(result)
+
+    @_instrumented("cas_state", miss_on_none=True)
+    def cas_state(self, job_id, old_state, new_state, priority=None, run_after=None):
+        """CAS update a job's state, returning the updated job or indicating a conflict.
+
+        The job's priority and run_after may be changed at the same time, for instance to retry
+        a failed job after a delay.
+        """
+
+        with self._write() as db:
+            return self._cas_state(
+                db, job_id, old_state, new_state, priority, run_after
+            )
+
+    def _cas_state(
+        self, db, job_id, old_state, new_state, priority=None, run_after=None
+    ) -> Maybe[Job]:
+        result = self._queries.job_cas_state(
+            db,
+            id=job_id,
+            old_state=self._codec.json_dumps(old_state),
+            new_state=self._codec.json_dumps(new_state),
+            priority=int(priority) if priority is not None else None,
+            run_after=_timestamp(run_after),
+        )
+        if result:
+            return self._from_result(result)
+
+    @_instrumented("cas_state_many")
+    def cas_state_many(self, updates) -> List[Maybe[Job]]:
+        """CAS update many jobs' states in a single transaction.
+
+        Each update is a dict of keyword arguments to `cas_state`, e.g.
+        `{"job_id": 1, "old_state": old, "new_state": new}`. Returns, in order, each updated job
+        or None where the update conflicted.
+        """
+
+        with self._write() as db:
+            return [self._cas_state(db, **kwargs) for kwargs in updates]
+
+    @_instrumented("heartbeat", miss_on_none=True)
+    def heartbeat(self, job_id, state, lease) -> Maybe[Job]:
+        """Extend the lease on a polled job still in the given state by lease seconds from now.
+
+        Returns the job, or None if the job is no longer in that state or holds no lease.
+        """
+
+        with self._write() as db:
+            result = self._queries.job_heartbeat(
                 db,
                 id=job_id,
-                old_state=json.dumps(old_state),
-                new_state=json.dumps(new_state),
+                state=self._codec.json_dumps(state),
+                lease=int(lease),
             )
             if result:
                 return self._from_result(result)
 
-    def append_event(self, job_id, event):
-        """Append a user-defined event to the job's log."""
+    @_instrumented("reap")
+    def reap(self, limit=None):
+        """Return jobs whose leases have lapsed to their pre-poll state, returning the reaped jobs.
 
-        with self._db as db:
-            return self._from_result(
-                self._queries.job_append_event(db, id=job_id, event=json.dumps(event))
+        Expired leases are found via an index on lease expiry, so reaping is cheap regardless of
+        how many jobs are in the queue.
+        """
+
+        with self._write() as db:
+            return self._from_results(
+                self._queries.job_reap(db, limit=int(limit) if limit else -1)
             )
 
+    @_instrumented("append_event", miss_on_none=True)
+    def append_event(self, job_id, event) -> Maybe[Job]:
+        """Append a user-defined event to the job's log, returning None if there's no such job."""
+
+        with self._write() as db:
+            return self._append_event(db, job_id, event)
+
+    def _append_event(self, db, job_id, event) -> Maybe[Job]:
+        result = self._queries.job_append_event(
+            db, id=job_id, event=self._codec.json_dumps(event)
+        )
+        if result:
+            return self._from_result(result)
+
+    @_instrumented("append_event_many")
+    def append_event_many(self, events) -> List[Maybe[Job]]:
+        """Append many user-defined events to jobs' logs in a single transaction.
+
+        Each event is a dict of keyword arguments to `append_event`, e.g.
+        `{"job_id": 1, "event": event}`. Returns, in order, each updated job or None where there
+        was no such job.
+        """
+
+        with self._write() as db:
+            return [self._append_event(db, **kwargs) for kwargs in events]
+
+    @_instrumented("archive")
+    def archive(
+        self,
+        query,
+        path=None,
+        batch_size=500,
+        compress=False,
+        vacuum=True,
+        pause=0,
+    ) -> int:
+        """Move jobs matching the query out of the `job` table and into the archive, returning the count.
+
+        Jobs are archived to the `job_archive` table, or to that table in the SQLite file at path.
+        Each batch of jobs is moved in its own short transaction so pollers are never blocked for
+        long, optionally sleeping `pause` seconds between batches. Batches are taken in ID order,
+        each resuming after the last, so unmatched jobs are scanned only once. If compress is set,
+        payloads and event logs are zlib compressed. If vacuum is set, the space freed by each
+        batch is returned to the filesystem after the batch.
+        """
+
+        schema = "main"
+        if path:
+            schema = "archive"
+            self._db.execute(f"ATTACH DATABASE ? AS `{schema}`", (path,))
+            self._db.execute(_ARCHIVE_TABLE_SQL.format(schema=schema))
+
+        select = _ARCHIVE_SELECT_SQL.format(query=compile_query(query))
+        insert = _ARCHIVE_INSERT_SQL.format(schema=schema)
+
+        def _compress(val):
+            if isinstance(val, str):
+                val = val.encode("utf-8")
+            return zlib.compress(val)
+
+        def _row(id, payload, events, state, modified, priority, run_after):
+            return {
+                "id": id,
+                "payload": _compress(payload) if compress else payload,
+                "events": _compress(events) if compress else events,
+                "state": state,
+                "modified": modified,
+                "priority": priority,
+                "run_after": run_after,
+                "compressed": int(compress),
+            }
+
+        count = 0
+        after_id = 0
+        try:
+            while True:
+                # Taking the write lock up front so the batch can't change under us
+                with self._write() as db:
+                    results = db.execute(
+                        select, {"limit": int(batch_size), "after_id": after_id}
+                    ).fetchall()
+                    if not results:
+                        break
+
+                    db.executemany(insert, [_row(*result) for result in results])
+                    db.executemany(
+                        "DELETE FROM `job` WHERE `id` = ?",
+                        [(result[0],) for result in results],
+                    )
+
+                after_id = results[-1][0]
+                count += len(results)
+                log.debug({"archived": len(results), "total": count})
+                if vacuum:
+                    self.vacuum()
+                if pause:
+                    sleep(pause)
+
+        finally:
+            if path:
+                self._db.execute(f"DETACH DATABASE `{schema}`")
+
+        return count
+
+    def get_archived(self, job_id, path=None) -> Maybe[Job]:
+        """Fetch an archived job by ID, from the archive table or the archive file at path."""
+
+        schema = "main"
+        if path:
+            schema = "archive"
+            self._db.execute(f"ATTACH DATABASE ? AS `{schema}`", (path,))
+
+        try:
+            result = self._db.execute(
+                _ARCHIVE_GET_SQL.format(schema=schema), {"id": job_id}
+            ).fetchone()
+        finally:
+            if path:
+                self._db.execute(f"DETACH DATABASE `{schema}`")
+
+        if result:
+            *result, compressed = result
+            if compressed:
+                result[1] = zlib.decompress(result[1])
+                result[2] = zlib.decompress(result[2])
+            return self._from_tuple(tuple(result))
+
+    def vacuum(self, pages=None):
+        """Return (at most pages) free pages to the filesystem.
+
+        This requires incremental auto-vacuum, which the built-in profiles enable when creating a
+        queue. On other queues it does nothing.
+        """
+
+        # The pragma frees a page per step, but being columnless the sqlite3 module would only
+        # step it once. executescript() runs it to completion.
+        self._db.executescript(f"PRAGMA incremental_vacuum({int(pages or 0)});")
+
+    @_instrumented("delete_job")
     def delete_job(self, job_id):
         """Delete a job by ID, regardless of state."""
 
-        with self._db as db:
+        with self._write() as db:
             return self._queries.job_delete(db, id=job_id)
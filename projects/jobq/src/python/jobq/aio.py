@@ -0,0 +1,378 @@
+"""
+An asyncio front-end to the job queue.
+
+SQLite connections are blocking and bound to a thread, so rather than running queries on the event
+loop all writes are funneled through a request queue to a single dedicated writer thread which
+owns the migrated connection. Reads (`get` and `query`) are served by a pool of reader threads each
+with its own connection, so reads don't queue up behind writes.
+"""
+
+import asyncio
+from collections import deque
+from concurrent.futures import (
+    Future,
+    ThreadPoolExecutor,
+)
+import json
+import queue
+import threading
+from time import monotonic, perf_counter, time
+from typing import List, Optional as Maybe
+
+from jobq import Job, JobQueue
+from jobq.notify import Notifier
+
+
+class _Waiters(object):
+    """The polls waiting on one query, served in order by a single poll loop."""
+
+    def __init__(self):
+        # Pairs of (deadline, future), in order of arrival
+        self.queue = deque()
+        self.loop = None
+        self.sleep = None
+
+    def put(self, deadline, fut):
+        self.queue.append((deadline, fut))
+        # The loop may be sleeping past the new deadline, so have it reconsider
+        if self.sleep:
+            self.sleep.cancel()
+
+    def expire(self, now):
+        """Drop cancelled waiters, and resolve those whose deadline has lapsed as misses."""
+
+        live = deque()
+        for deadline, fut in self.queue:
+            if fut.done():
+                continue
+            elif deadline <= now:
+                fut.set_result(None)
+            else:
+                live.append((deadline, fut))
+        self.queue = live
+
+    def hand(self, job) -> bool:
+        """Resolve the longest-waiting live waiter with job, returning whether there was one."""
+
+        while self.queue:
+            _, fut = self.queue.popleft()
+            if not fut.done():
+                fut.set_result(job)
+                return True
+        return False
+
+
+class AsyncJobQueue(object):
+    def __init__(
+        self,
+        path,
+        profile="durable",
+        codec="json",
+        metrics=None,
+        readers=4,
+        migrate=True,
+    ):
+        """Open (and migrate) the job queue at path, starting the writer thread and reader pool.
+
+        In-memory databases can't be shared between connections, so for `:memory:` (or if
+        `readers=0`) reads are served by the writer thread as well.
+
+        Pass `migrate=False` if the queue is known to already be migrated, for instance because
+        it's shared by several processes one of which migrated it on startup.
+        """
+
+        self._path = path
+        self._migrate = migrate
+        self._profile = profile
+        self._codec = codec
+        self._metrics = metrics
+        self._requests = queue.SimpleQueue()
+        self._waiters = {}
+        self.notifier = Notifier(path)
+
+        ready = Future()
+        self._writer = threading.Thread(
+            target=self._write_loop,
+            args=(self._requests, ready),
+            name="jobq-writer",
+            daemon=True,
+        )
+        self._writer.start()
+        # Propagate any connection or migration errors to the caller
+        ready.result()
+
+        self._local = threading.local()
+        self._reader_conns = []
+        self._reader_lock = threading.Lock()
+        if readers and path != ":memory:":
+            self._readers = ThreadPoolExecutor(
+                max_workers=readers,
+                thread_name_prefix="jobq-reader",
+            )
+        else:
+            self._readers = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args, **kwargs):
+        await self.close()
+
+    def _write_loop(self, requests: queue.SimpleQueue, ready: Future):
+        try:
+            q = JobQueue(
+                self._path,
+                profile=self._profile,
+                codec=self._codec,
+                metrics=self._metrics,
+                migrate=self._migrate,
+                notifier=self.notifier,
+            )
+        except BaseException as e:
+            ready.set_exception(e)
+            return
+
+        ready.set_result(None)
+        try:
+            while True:
+                request = requests.get()
+                if request is None:
+                    break
+
+                fut, fn, args, kwargs = request
+                if not fut.set_running_or_notify_cancel():
+                    continue
+
+                try:
+                    fut.set_result(fn(q, *args, **kwargs))
+                except BaseException as e:
+                    fut.set_exception(e)
+        finally:
+            q.close()
+
+    def _reader(self) -> JobQueue:
+        """Get the calling reader thread's connection, opening it if need be."""
+
+        q = getattr(self._local, "q", None)
+        if q is None:
+            q = JobQueue(
+                self._path,
+                profile=self._profile,
+                codec=self._codec,
+                metrics=self._metrics,
+                migrate=False,
+                check_same_thread=False,
+                notifier=self.notifier,
+            )
+            self._local.q = q
+            with self._reader_lock:
+                self._reader_conns.append(q)
+        return q
+
+    async def _write(self, fn, *args, **kwargs):
+        if self._requests is None:
+            raise RuntimeError("The queue is closed")
+
+        fut = Future()
+        self._requests.put((fut, fn, args, kwargs))
+        return await asyncio.wrap_future(fut)
+
+    async def _read(self, fn, *args, **kwargs):
+        if self._readers is None:
+            return await self._write(fn, *args, **kwargs)
+
+        def _run():
+            return fn(self._reader(), *args, **kwargs)
+
+        return await asyncio.get_running_loop().run_in_executor(self._readers, _run)
+
+    async def close(self):
+        """Drain and stop the writer thread, and close all connections."""
+
+        if self._requests is None:
+            return
+
+        for waiters in list(self._waiters.values()):
+            waiters.loop.cancel()
+
+        requests, self._requests = self._requests, None
+        requests.put(None)
+        await asyncio.get_running_loop().run_in_executor(None, self._writer.join)
+
+        if self._readers:
+            self._readers.shutdown(wait=True)
+            self._readers = None
+
+        with self._reader_lock:
+            for q in self._reader_conns:
+                q.close()
+            self._reader_conns = []
+
+        self.notifier.close()
+
+    async def query(self, query, limit=None, after=None):
+        """Query for jobs, returning a list of matches."""
+
+        return await self._read(
+            lambda q: list(q.query(query, limit=limit, after=after))
+        )
+
+    async def depth(self) -> dict:
+        """Count the jobs in each (JSON encoded) state, reporting the counts to metrics."""
+
+        return await self._read(JobQueue.depth)
+
+    async def get(self, job_id) -> Maybe[Job]:
+        """Fetch all available data about a given job by ID, or None if there's no such job."""
+
+        return await self._read(JobQueue.get, job_id)
+
+    async def create(self, job, new_state=None, priority=0, run_after=None) -> Job:
+        """Create a new job on the queue, optionally specifying its state and schedule."""
+
+        return await self._write(
+            JobQueue.create, job, new_state, priority=priority, run_after=run_after
+        )
+
+    async def create_many(self, jobs) -> List[Job]:
+        """Create many jobs in a single transaction, returning them in order."""
+
+        return await self._write(JobQueue.create_many, jobs)
+
+    async def poll(self, query, new_state, lease=None, wait=None) -> Maybe[Job]:
+        """Query for the highest priority, longest-untouched runnable job matching, advancing it to new_state.
+
+        If wait (in seconds) is given and no job matches, wait until one does or wait lapses,
+        without tying up the writer thread in the meantime. Waiting polls for the same query,
+        state and lease are served first come, first served by a single poll loop, which polls
+        once per change to the queue (or delayed job coming due) and hands each job it polls to
+        exactly one of them. As with `JobQueue.poll`, the whole of a waiting poll is reported to
+        metrics as a `poll_wait`.
+        """
+
+        if not wait:
+            return await self._write(JobQueue.poll, query, new_state, lease=lease)
+
+        start = perf_counter()
+        key = (query, json.dumps(new_state), lease)
+        waiters = self._waiters.get(key)
+        if waiters is None:
+            waiters = self._waiters[key] = _Waiters()
+            waiters.loop = asyncio.ensure_future(
+                self._poll_loop(key, waiters, query, new_state, lease)
+            )
+
+        fut = asyncio.get_running_loop().create_future()
+        waiters.put(monotonic() + wait, fut)
+        job = await fut
+
+        if self._metrics:
+            outcome = "ok" if job else "miss"
+            self._metrics.observe("poll_wait", perf_counter() - start, 0.0, outcome)
+        return job
+
+    async def _poll_loop(self, key, waiters: _Waiters, query, new_state, lease):
+        """Serve waiting polls until there are none left."""
+
+        # The notifier's version as of the last poll to miss, and when the next delayed job which
+        # might match comes due. Until either moves on, polling again would miss too.
+        missed, due = None, None
+        error = None
+        try:
+            while True:
+                waiters.expire(monotonic())
+                if not waiters.queue:
+                    break
+
+                if (
+                    missed is None
+                    or self.notifier.version != missed
+                    or (due is not None and time() >= due)
+                ):
+                    version = self.notifier.version
+                    job = await self._write(
+                        JobQueue.poll, query, new_state, lease=lease
+                    )
+                    if job:
+                        # Every waiter may have been cancelled while polling, in which case
+                        # the job is left polled, to be reaped if it was leased
+                        waiters.hand(job)
+                        missed = None
+                        continue
+
+                    missed = version
+                    due = await self._read(JobQueue.next_due, query)
+
+                timeout = min(deadline for deadline, _ in waiters.queue) - monotonic()
+                if due is not None:
+                    timeout = min(timeout, due - time())
+
+                waiters.sleep = asyncio.ensure_future(
+                    self.notifier.wait_async(missed, max(timeout, 0.0))
+                )
+                await asyncio.wait([waiters.sleep])
+                waiters.sleep = None
+
+        except asyncio.CancelledError:
+            error = RuntimeError("The queue is closed")
+        except Exception as e:
+            error = e
+        finally:
+            del self._waiters[key]
+            if waiters.sleep:
+                waiters.sleep.cancel()
+
+        for _, fut in waiters.queue:
+            if not fut.done():
+                fut.set_exception(error)
+
+    async def poll_many(self, query, new_state, limit, lease=None) -> List[Job]:
+        """As `poll`, but advance up to limit matching jobs to new_state in a single transaction."""
+
+        return await self._write(
+            JobQueue.poll_many, query, new_state, limit, lease=lease
+        )
+
+    async def cas_state(
+        self, job_id, old_state, new_state, priority=None, run_after=None
+    ) -> Maybe[Job]:
+        """CAS update a job's state, returning the updated job or indicating a conflict."""
+
+        return await self._write(
+            JobQueue.cas_state,
+            job_id,
+            old_state,
+            new_state,
+            priority=priority,
+            run_after=run_after,
+        )
+
+    async def cas_state_many(self, updates) -> List[Maybe[Job]]:
+        """CAS update many jobs' states in a single transaction."""
+
+        return await self._write(JobQueue.cas_state_many, updates)
+
+    async def heartbeat(self, job_id, state, lease) -> Maybe[Job]:
+        """Extend the lease on a polled job still in the given state."""
+
+        return await self._write(JobQueue.heartbeat, job_id, state, lease)
+
+    async def reap(self, limit=None):
+        """Return jobs whose leases have lapsed to their pre-poll state."""
+
+        return await self._write(JobQueue.reap, limit=limit)
+
+    async def append_event(self, job_id, event) -> Maybe[Job]:
+        """Append a user-defined event to the job's log."""
+
+        return await self._write(JobQueue.append_event, job_id, event)
+
+    async def append_event_many(self, events) -> List[Maybe[Job]]:
+        """Append many user-defined events to jobs' logs in a single transaction."""
+
+        return await self._write(JobQueue.append_event_many, events)
+
+    async def delete_job(self, job_id):
+        """Delete a job by ID, regardless of state."""
+
+        return await self._write(JobQueue.delete_job, job_id)
@@ -0,0 +1,107 @@
+"""
+Pluggable serialization for job payloads and state.
+
+A codec has two halves. Payloads are opaque to the queue itself, so `dumps`/`loads` may produce
+any text or binary encoding. States and events on the other hand are manipulated and queried with
+SQLite's JSON functions, so `json_dumps`/`json_loads` must always speak JSON text, although a codec
+may use a faster JSON implementation to do so.
+
+Queries over payloads (e.g. `json_extract(j.payload, '$.user_id')`) only work with codecs which
+store payloads as JSON text, such as `json` and `orjson`, and not with binary codecs like
+`msgpack`.
+
+Note that a queue's codec determines how its payloads are stored, so all clients of a given
+queue must agree on a codec.
+"""
+
+import json
+
+
+class JsonCodec(object):
+    """The standard library's JSON, for everything."""
+
+    name = "json"
+
+    def dumps(self, obj):
+        return json.dumps(obj)
+
+    def loads(self, raw):
+        return json.loads(raw)
+
+    def json_dumps(self, obj) -> str:
+        return json.dumps(obj)
+
+    def json_loads(self, raw):
+        return json.loads(raw)
+
+
+class OrjsonCodec(object):
+    """orjson for everything, which is typically several times faster than the stdlib."""
+
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+
+        self._orjson = orjson
+
+    def dumps(self, obj) -> str:
+        # Bytes would be stored as a BLOB, which SQLite's JSON functions won't accept.
+        return self._orjson.dumps(obj).decode("utf-8")
+
+    def loads(self, raw):
+        return self._orjson.loads(raw)
+
+    def json_dumps(self, obj) -> str:
+        # SQLite's json() won't accept BLOBs, so this half must produce text.
+        return self._orjson.dumps(obj).decode("utf-8")
+
+    def json_loads(self, raw):
+        return self._orjson.loads(raw)
+
+
+class MsgpackCodec(JsonCodec):
+    """Compact binary msgpack payloads, and stdlib JSON states and events."""
+
+    name = "msgpack"
+
+    def __init__(self):
+        import msgpack
+
+        self._msgpack = msgpack
+
+    def dumps(self, obj):
+        return self._msgpack.packb(obj, use_bin_type=True)
+
+    def loads(self, raw):
+        return self._msgpack.unpackb(raw, raw=False)
+
+
+CODECS = {
+    JsonCodec.name: JsonCodec,
+    OrjsonCodec.name: OrjsonCodec,
+    MsgpackCodec.name: MsgpackCodec,
+}
+
+
+def register_codec(name, codec):
+    """Register a codec class (or factory) under the given name."""
+
+    CODECS[name] = codec
+
+
+def get_codec(codec):
+    """Get a codec instance, given either a codec instance or the name of a registered codec.
+
+    Raises ImportError if the named codec's implementation isn't installed.
+    """
+
+    if not isinstance(codec, str):
+        return codec
+
+    try:
+        codec_cls = CODECS[codec]
+    except KeyError:
+        raise ValueError(f"Unknown codec {codec!r}, expected one of {sorted(CODECS)}")
+
+    return codec_cls()
@@ -0,0 +1,180 @@
+"""
+Operational metrics for the job queue.
+
+A `JobQueue` reports each operation it performs to its metrics object, along with how long the
+operation took, how much of that time was spent waiting for SQLite's write lock, and its outcome.
+The default `NULL_METRICS` discards everything, at the cost of a single identity check per
+operation. `Metrics` instead keeps counters and latency histograms in memory, and hands snapshots
+of them to pluggable exporters.
+"""
+
+import logging
+import os
+import tempfile
+import threading
+import typing as t
+
+from anosql.instrument import (
+    DEFAULT_BUCKETS,
+    Histogram,
+)
+
+
+log = logging.getLogger(__name__)
+
+
+class NullMetrics(object):
+    """Metrics which go nowhere. Queues skip instrumenting operations entirely for these."""
+
+    def observe(self, op, duration, lock_wait, outcome):
+        pass
+
+    def depth(self, depths):
+        pass
+
+
+NULL_METRICS = NullMetrics()
+
+
+class Metrics(object):
+    """Thread-safe in-memory metrics, exportable to any number of exporters.
+
+    Tracks, per operation:
+    - counts by outcome (`ok`, `miss` where nothing matched, or `error`)
+    - a latency histogram
+    - a write lock wait histogram
+
+    And the most recently counted queue depth by state.
+    """
+
+    def __init__(self, exporters=None, buckets=DEFAULT_BUCKETS):
+        self._lock = threading.Lock()
+        self._buckets = buckets
+        self._counters = {}
+        self._latencies = {}
+        self._lock_waits = {}
+        self._depths = {}
+        self.exporters = list(exporters or [])
+
+    def observe(self, op, duration, lock_wait, outcome):
+        with self._lock:
+            key = (op, outcome)
+            self._counters[key] = self._counters.get(key, 0) + 1
+
+            if op not in self._latencies:
+                self._latencies[op] = Histogram(self._buckets)
+                self._lock_waits[op] = Histogram(self._buckets)
+            self._latencies[op].observe(duration)
+            self._lock_waits[op].observe(lock_wait)
+
+    def depth(self, depths):
+        with self._lock:
+            self._depths = dict(depths)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "operations": {
+                    f"{op}:{outcome}": count
+                    for (op, outcome), count in sorted(self._counters.items())
+                },
+                "latency": {op: h.snapshot() for op, h in sorted(self._latencies.items())},
+                "lock_wait": {
+                    op: h.snapshot() for op, h in sorted(self._lock_waits.items())
+                },
+                "depth": dict(self._depths),
+            }
+
+    def export(self):
+        """Hand a snapshot to each exporter."""
+
+        snapshot = self.snapshot()
+        for exporter in self.exporters:
+            try:
+                exporter.export(snapshot)
+            except Exception:
+                log.exception(f"Exporter {exporter!r} failed")
+
+
+def _label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_float(value) -> str:
+    return "+Inf" if value == float("inf") else repr(float(value))
+
+
+def format_labels(labels: dict) -> str:
+    """Render a dict of labels as a Prometheus label set, escaping values."""
+
+    return ",".join(f'{k}="{_label(v)}"' for k, v in labels.items())
+
+
+def histogram_lines(metric, help, histograms) -> t.List[str]:
+    """Render (labels, histogram snapshot) pairs as a Prometheus histogram named metric."""
+
+    lines = [f"# HELP {metric} {help}.", f"# TYPE {metric} histogram"]
+    for labels, h in histograms:
+        for le, count in h["buckets"]:
+            bucket_labels = format_labels(dict(labels, le=_format_float(le)))
+            lines.append(f"{metric}_bucket{{{bucket_labels}}} {count}")
+        lines.append(f'{metric}_sum{{{format_labels(labels)}}} {h["sum"]!r}')
+        lines.append(f'{metric}_count{{{format_labels(labels)}}} {h["count"]}')
+    return lines
+
+
+def prometheus_text(snapshot: dict, prefix="jobq") -> str:
+    """Render a metrics snapshot in the Prometheus text exposition format."""
+
+    lines = [
+        f"# HELP {prefix}_operations_total Operations performed, by outcome.",
+        f"# TYPE {prefix}_operations_total counter",
+    ]
+    for key, count in snapshot["operations"].items():
+        op, outcome = key.rsplit(":", 1)
+        labels = format_labels({"op": op, "outcome": outcome})
+        lines.append(f"{prefix}_operations_total{{{labels}}} {count}")
+
+    for name, help in [
+        ("latency", "Operation latency"),
+        ("lock_wait", "Time spent waiting for the write lock"),
+    ]:
+        lines += histogram_lines(
+            f"{prefix}_{name}_seconds",
+            help,
+            [({"op": op}, h) for op, h in snapshot[name].items()],
+        )
+
+    lines += [
+        f"# HELP {prefix}_depth Jobs in the queue, by state.",
+        f"# TYPE {prefix}_depth gauge",
+    ]
+    for state, count in snapshot["depth"].items():
+        lines.append(f"{prefix}_depth{{{format_labels({'state': state})}}} {count}")
+
+    return "\n".join(lines) + "\n"
+
+
+class LoggingExporter(object):
+    """Log each snapshot."""
+
+    def __init__(self, logger: t.Optional[logging.Logger] = None, level=logging.INFO):
+        self._log = logger or log
+        self._level = level
+
+    def export(self, snapshot):
+        self._log.log(self._level, snapshot)
+
+
+class PrometheusTextfileExporter(object):
+    """Atomically write each snapshot to a file, as for node_exporter's textfile collector."""
+
+    def __init__(self, path, prefix="jobq"):
+        self._path = path
+        self._prefix = prefix
+
+    def export(self, snapshot):
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self._path)))
+        with os.fdopen(fd, "w") as fp:
+            fp.write(prometheus_text(snapshot, self._prefix))
+        os.replace(tmp, self._path)
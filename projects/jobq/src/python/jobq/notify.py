@@ -0,0 +1,142 @@
+"""
+Change notification for the job queue.
+
+Waiting for a job (or for changes to jobs) by re-querying in a loop burns CPU and SQLite reads
+while nothing is happening. Instead, waiters block on a `Notifier`, which wakes them when the
+queue may have changed. Writes made through a `JobQueue` sharing the notifier wake waiters
+immediately. Writes made from other processes (or through queues not sharing the notifier) are
+noticed by a watcher thread, which cheaply checks SQLite's `PRAGMA data_version` at an interval.
+"""
+
+import asyncio
+import sqlite3
+import threading
+from time import time
+
+
+class Notifier(object):
+    def __init__(self, path=None, interval=0.05):
+        """Create a notifier, which watches the database at path for changes by other connections.
+
+        Without a path, or for `:memory:` databases, only explicit notifications wake waiters.
+        """
+
+        self._cond = threading.Condition()
+        self._callbacks = set()
+        self._stop = threading.Event()
+        self.version = 0
+
+        self._watcher = None
+        if path and path != ":memory:":
+            self._watcher = threading.Thread(
+                target=self._watch,
+                args=(path, interval),
+                name="jobq-notifier",
+                daemon=True,
+            )
+            self._watcher.start()
+
+    def _watch(self, path, interval):
+        db = sqlite3.connect(path, check_same_thread=False)
+        try:
+            (last,) = db.execute("PRAGMA data_version").fetchone()
+            while not self._stop.wait(interval):
+                (version,) = db.execute("PRAGMA data_version").fetchone()
+                if version != last:
+                    last = version
+                    self.notify()
+        finally:
+            db.close()
+
+    def close(self):
+        """Stop the watcher thread, if any."""
+
+        self._stop.set()
+        if self._watcher:
+            self._watcher.join()
+            self._watcher = None
+
+    def notify(self):
+        """Record a change, waking all waiters."""
+
+        with self._cond:
+            self.version += 1
+            self._cond.notify_all()
+            callbacks = list(self._callbacks)
+
+        for callback in callbacks:
+            callback()
+
+    def wait(self, version, timeout=None) -> bool:
+        """Block until there have been changes since version, or the timeout (seconds) lapses.
+
+        Returns whether there were changes. Read `version` before checking the queue, so that no
+        change between checking and waiting can be missed.
+        """
+
+        with self._cond:
+            return self._cond.wait_for(lambda: self.version != version, timeout)
+
+    async def wait_async(self, version, timeout=None) -> bool:
+        """As `wait`, but without blocking the event loop."""
+
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+
+        def _wake():
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # The loop has closed
+                pass
+
+        with self._cond:
+            if self.version != version:
+                return True
+            self._callbacks.add(_wake)
+
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._cond:
+                self._callbacks.discard(_wake)
+
+
+class ChangeFeed(object):
+    """Tracks which of the jobs matching a query have changed since they were last seen.
+
+    Job modification times have one second resolution, so each read re-reads the jobs modified in
+    the latest second seen, and tells whether one has changed again since by the length of its
+    (append-only) event log.
+    """
+
+    def __init__(self, query, since=None):
+        self._query = query if isinstance(query, list) else [query]
+        self._watermark = int(since if since is not None else time())
+        self._seen = {}
+
+    @property
+    def query(self) -> list:
+        """The query to read changes with; jobs modified no earlier than the latest seen."""
+
+        return self._query + [f"j.modified >= {self._watermark}"]
+
+    def update(self, jobs) -> list:
+        """Given the results of `query` in modified order, return the jobs not yet seen."""
+
+        changed, seen = [], {}
+        for job in jobs:
+            modified = int(job.modified.timestamp())
+            signature = (modified, len(job._raw[1]))
+            if self._seen.get(job.id) != signature:
+                changed.append(job)
+            if modified > self._watermark:
+                self._watermark, seen = modified, {}
+            seen[job.id] = signature
+
+        if seen:
+            self._seen = seen
+        return changed
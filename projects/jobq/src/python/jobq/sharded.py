@@ -0,0 +1,283 @@
+"""
+A job queue spread over many SQLite files.
+
+SQLite allows only one writer per file, so a single queue's write throughput is bounded by one
+file (and one disk). A sharded queue spreads jobs over N files, each a complete job queue, so
+that write throughput scales with the number of shards.
+
+Jobs are routed to a shard by hashing a key (by default the payload). Passing a queue name as the
+key keeps each named queue on a single shard. Job IDs encode the shard holding the job, so that
+operations on a job go straight to its shard. Consequently the set of shards (and their order)
+must not change over the life of a queue.
+"""
+
+from heapq import merge
+from itertools import islice
+from time import monotonic
+from typing import (
+    Iterator,
+    List,
+    Optional as Maybe,
+    Tuple,
+)
+import zlib
+
+from jobq import Job, JobQueue
+from jobq.notify import Notifier
+
+
+class ShardedJobQueue(object):
+    def __init__(self, paths, polling="round-robin", depth_ttl=1.0, **kwargs):
+        """Open (and migrate) a job queue shard at each of the given paths.
+
+        Polls visit shards either `round-robin`, or by `depth`, deepest shard first. Shard depths
+        are counted per poll query, and re-counted at most every `depth_ttl` seconds.
+
+        Other arguments are passed to each shard's `JobQueue`. Unless a notifier is given, the
+        shards share a new one, so that a write through any shard wakes waiting polls.
+        """
+
+        if polling not in ["round-robin", "depth"]:
+            raise ValueError(f"Unknown polling strategy {polling!r}")
+
+        self._owns_notifier = "notifier" not in kwargs
+        if self._owns_notifier:
+            kwargs["notifier"] = Notifier()
+        self.notifier = kwargs["notifier"]
+
+        self._shards = [JobQueue(path, **kwargs) for path in paths]
+        if not self._shards:
+            raise ValueError("At least one shard is required")
+
+        self._polling = polling
+        self._next_shard = 0
+        self._depth_ttl = depth_ttl
+        self._depths = {}
+
+    def __enter__(self, *args, **kwargs):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+    def close(self):
+        for shard in self._shards:
+            shard.close()
+        if self._owns_notifier:
+            self.notifier.close()
+
+    def _encode(self, shard: int, job: Maybe[Job]) -> Maybe[Job]:
+        """Rewrite a shard's job to carry its global ID."""
+
+        if job:
+            job.id = job.id * len(self._shards) + shard
+        return job
+
+    def _encode_all(self, shard: int, jobs: Iterator[Job]) -> Iterator[Job]:
+        for job in jobs:
+            yield self._encode(shard, job)
+
+    def _decode(self, job_id) -> Tuple[int, int]:
+        """Decode a global job ID to a shard index and the shard's job ID."""
+
+        local_id, shard = divmod(int(job_id), len(self._shards))
+        return shard, local_id
+
+    def _shard_for(self, key) -> int:
+        if isinstance(key, str):
+            key = key.encode("utf-8")
+        return zlib.crc32(key) % len(self._shards)
+
+    def _poll_order(self, query) -> list:
+        n = len(self._shards)
+        if self._polling == "round-robin":
+            start, self._next_shard = self._next_shard, (self._next_shard + 1) % n
+            return [(start + i) % n for i in range(n)]
+
+        key = str(query)
+        counted_at, depths = self._depths.get(key, (None, None))
+        if counted_at is None or monotonic() - counted_at > self._depth_ttl:
+            depths = [shard.count(query) for shard in self._shards]
+            self._depths[key] = (monotonic(), depths)
+        return sorted(range(n), key=lambda i: depths[i], reverse=True)
+
+    def query(self, query, limit=None, after=None, batch_size=256) -> Iterator[Job]:
+        """Query for jobs across all shards, lazily producing the matches in `modified` order.
+
+        As with `JobQueue.query`, pass the last job of a page (or its `(modified, id)`) as
+        `after` to fetch the next page.
+        """
+
+        if isinstance(after, Job):
+            after = (after.modified, after.id)
+
+        n = len(self._shards)
+        streams = []
+        for i, shard in enumerate(self._shards):
+            shard_after = None
+            if after is not None:
+                modified, id = after
+                # The greatest local ID whose global ID is no greater than `id`
+                shard_after = (modified, (int(id) - i) // n)
+
+            streams.append(
+                self._encode_all(
+                    i,
+                    shard.query(
+                        query, limit=limit, after=shard_after, batch_size=batch_size
+                    ),
+                )
+            )
+
+        jobs = merge(*streams, key=lambda job: (job.modified, job.id))
+        if limit:
+            jobs = islice(jobs, int(limit))
+        return jobs
+
+    def count(self, query) -> int:
+        """Count the jobs matching a query across all shards."""
+
+        return sum(shard.count(query) for shard in self._shards)
+
+    def create(self, job, new_state=None, key=None, **kwargs) -> Job:
+        """Create a new job on the shard chosen by hashing the key (by default the payload)."""
+
+        if key is None:
+            key = self._shards[0]._codec.dumps(job)
+
+        shard = self._shard_for(key)
+        return self._encode(shard, self._shards[shard].create(job, new_state, **kwargs))
+
+    def create_many(self, jobs) -> List[Job]:
+        """Create many jobs, in one transaction per shard, returning them in order.
+
+        Each job is a dict of keyword arguments to `create`, which may include a `key`.
+        """
+
+        by_shard = {}
+        for i, kwargs in enumerate(jobs):
+            kwargs = dict(kwargs)
+            key = kwargs.pop("key", None)
+            if key is None:
+                key = self._shards[0]._codec.dumps(kwargs["job"])
+            by_shard.setdefault(self._shard_for(key), []).append((i, kwargs))
+
+        results = {}
+        for shard, batch in by_shard.items():
+            created = self._shards[shard].create_many([kwargs for _, kwargs in batch])
+            for (i, _), job in zip(batch, created):
+                results[i] = self._encode(shard, job)
+
+        return [results[i] for i in range(len(results))]
+
+    def poll(self, query, new_state, lease=None, wait=None) -> Maybe[Job]:
+        """Poll the shards in turn, advancing the first matching job found to new_state.
+
+        As with `JobQueue.poll`, if wait (in seconds) is given and no shard has a matching job,
+        block until one does or wait lapses. The shards are re-polled when written to through
+        this queue, and otherwise every second.
+        """
+
+        deadline = monotonic() + wait if wait else None
+        while True:
+            version = self.notifier.version
+            for shard in self._poll_order(query):
+                job = self._shards[shard].poll(query, new_state, lease=lease)
+                if job:
+                    return self._encode(shard, job)
+
+            remaining = deadline - monotonic() if deadline else 0
+            if remaining <= 0:
+                return None
+            self.notifier.wait(version, min(remaining, 1.0))
+
+    def poll_many(self, query, new_state, limit, lease=None) -> List[Job]:
+        """Poll the shards in turn, advancing up to limit matching jobs to new_state."""
+
+        jobs = []
+        for shard in self._poll_order(query):
+            if len(jobs) >= limit:
+                break
+            jobs.extend(
+                self._encode_all(
+                    shard,
+                    self._shards[shard].poll_many(
+                        query, new_state, limit - len(jobs), lease=lease
+                    ),
+                )
+            )
+        return jobs
+
+    def get(self, job_id) -> Maybe[Job]:
+        """Fetch all available data about a given job by ID, or None if there's no such job."""
+
+        shard, local_id = self._decode(job_id)
+        return self._encode(shard, self._shards[shard].get(local_id))
+
+    def cas_state(self, job_id, old_state, new_state, **kwargs) -> Maybe[Job]:
+        """CAS update a job's state, returning the updated job or indicating a conflict."""
+
+        shard, local_id = self._decode(job_id)
+        return self._encode(
+            shard,
+            self._shards[shard].cas_state(local_id, old_state, new_state, **kwargs),
+        )
+
+    def cas_state_many(self, updates) -> List[Maybe[Job]]:
+        """CAS update many jobs' states, in one transaction per shard.
+
+        Returns, in order, each updated job or None where the update conflicted.
+        """
+
+        return self._by_shard(updates, "cas_state_many")
+
+    def _by_shard(self, batch, method) -> list:
+        """Apply a batch method to the items of a batch on the shards holding their jobs."""
+
+        by_shard = {}
+        for i, kwargs in enumerate(batch):
+            kwargs = dict(kwargs)
+            shard, kwargs["job_id"] = self._decode(kwargs["job_id"])
+            by_shard.setdefault(shard, []).append((i, kwargs))
+
+        results = {}
+        for shard, items in by_shard.items():
+            jobs = getattr(self._shards[shard], method)([kwargs for _, kwargs in items])
+            for (i, _), job in zip(items, jobs):
+                results[i] = self._encode(shard, job)
+
+        return [results[i] for i in range(len(results))]
+
+    def heartbeat(self, job_id, state, lease) -> Maybe[Job]:
+        """Extend the lease on a polled job still in the given state."""
+
+        shard, local_id = self._decode(job_id)
+        return self._encode(shard, self._shards[shard].heartbeat(local_id, state, lease))
+
+    def reap(self, limit=None):
+        """Return (up to limit) jobs whose leases have lapsed on any shard to their pre-poll state."""
+
+        jobs = []
+        for i, shard in enumerate(self._shards):
+            remaining = int(limit) - len(jobs) if limit else None
+            if remaining is not None and remaining <= 0:
+                break
+            jobs.extend(self._encode_all(i, shard.reap(limit=remaining)))
+        return jobs
+
+    def append_event(self, job_id, event) -> Maybe[Job]:
+        """Append a user-defined event to the job's log."""
+
+        shard, local_id = self._decode(job_id)
+        return self._encode(shard, self._shards[shard].append_event(local_id, event))
+
+    def append_event_many(self, events) -> List[Maybe[Job]]:
+        """Append many user-defined events to jobs' logs, in one transaction per shard."""
+
+        return self._by_shard(events, "append_event_many")
+
+    def delete_job(self, job_id):
+        """Delete a job by ID, regardless of state."""
+
+        shard, local_id = self._decode(job_id)
+        return self._shards[shard].delete_job(local_id)
@@ -0,0 +1,147 @@
+"""
+Tests covering the asyncio jobq API
+"""
+
+import asyncio
+from time import time
+
+from jobq import Job
+from jobq.aio import AsyncJobQueue
+from jobq.metrics import Metrics
+import pytest
+
+
+@pytest.fixture(params=["memory", "file"])
+def path(request, tmp_path):
+    if request.param == "memory":
+        return ":memory:"
+    else:
+        return str(tmp_path / "jobq.sqlite3")
+
+
+def test_create_get(path):
+    """Assert that get-after-create returns the same value, via the writer and a reader."""
+
+    async def run():
+        async with AsyncJobQueue(path) as q:
+            j = await q.create("payload", ["CREATED"])
+            assert isinstance(j, Job)
+            assert j == await q.get(j.id)
+
+    asyncio.run(run())
+
+
+def test_concurrent_ops(path):
+    """Assert that many concurrent operations all complete."""
+
+    async def run():
+        async with AsyncJobQueue(path, readers=2) as q:
+            jobs = await asyncio.gather(*[q.create(i, ["CREATED"]) for i in range(50)])
+            assert len({j.id for j in jobs}) == 50
+
+            polled = await asyncio.gather(
+                *[
+                    q.poll("json_extract(j.state, '$[0]') = 'CREATED'", ["POLLED"])
+                    for _ in range(60)
+                ]
+            )
+            assert len({j.id for j in polled if j}) == 50
+            assert sum(1 for j in polled if j is None) == 10
+
+            j = await q.cas_state(jobs[0].id, ["POLLED"], ["DONE"])
+            assert j.state == ["DONE"]
+            j = await q.append_event(j.id, "an event")
+            assert j.events[-1][0] == "user_event"
+
+            assert len(await q.query("true")) == 50
+
+    asyncio.run(run())
+
+
+def test_closed():
+    """Assert that a closed queue refuses further work."""
+
+    async def run():
+        q = AsyncJobQueue(":memory:")
+        await q.close()
+        with pytest.raises(RuntimeError):
+            await q.create("payload")
+
+    asyncio.run(run())
+
+
+def test_poll_wait(path):
+    """Assert that a waiting poll is woken by a create, without blocking other operations."""
+
+    async def run():
+        async with AsyncJobQueue(path) as q:
+            query = "json_extract(j.state, '$[0]') = 'CREATED'"
+            poll = asyncio.ensure_future(q.poll(query, ["POLLED"], wait=10))
+            await asyncio.sleep(0.1)
+            assert not poll.done()
+
+            j = await q.create("payload", ["CREATED"])
+            polled = await asyncio.wait_for(poll, 2)
+            assert polled.id == j.id
+
+            assert await q.poll(query, ["POLLED"], wait=0.1) is None
+
+    asyncio.run(run())
+
+
+def test_poll_wait_many(path):
+    """Assert that many waiting polls are served in order, without each re-polling per write."""
+
+    async def run():
+        metrics = Metrics()
+        async with AsyncJobQueue(path, metrics=metrics) as q:
+            query = "json_extract(j.state, '$[0]') = 'CREATED'"
+            polls = []
+            for _ in range(200):
+                polls.append(asyncio.ensure_future(q.poll(query, ["POLLED"], wait=1.0)))
+                await asyncio.sleep(0)
+
+            jobs = []
+            for i in range(5):
+                jobs.append(await q.create(i, ["CREATED"]))
+                await asyncio.wait_for(polls[i], 2)
+
+            results = await asyncio.gather(*polls)
+            assert [j.id for j in results[:5]] == [j.id for j in jobs]
+            assert results[5:] == [None] * 195
+
+        ops = metrics.snapshot()["operations"]
+        assert ops["poll:ok"] == 5
+        assert ops.get("poll:miss", 0) < 50
+        assert ops["poll_wait:miss"] == 195
+
+    asyncio.run(run())
+
+
+def test_poll_wait_delayed(path):
+    """Assert that a waiting poll wakes when a delayed job comes due."""
+
+    async def run():
+        metrics = Metrics()
+        async with AsyncJobQueue(path, metrics=metrics) as q:
+            j = await q.create("payload", ["CREATED"], run_after=int(time()) + 1)
+            polled = await q.poll("true", ["POLLED"], wait=5)
+            assert polled.id == j.id
+
+        assert metrics.snapshot()["operations"].get("poll:miss", 0) <= 3
+
+    asyncio.run(run())
+
+
+def test_poll_wait_closed(path):
+    """Assert that closing the queue fails waiting polls, rather than leaving them hanging."""
+
+    async def run():
+        q = AsyncJobQueue(path)
+        poll = asyncio.ensure_future(q.poll("true", ["POLLED"], wait=10))
+        await asyncio.sleep(0.1)
+        await q.close()
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(poll, 1)
+
+    asyncio.run(run())
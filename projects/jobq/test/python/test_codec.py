@@ -0,0 +1,93 @@
+"""
+Tests covering pluggable jobq codecs and lazy decoding
+"""
+
+from jobq import JobQueue
+from jobq.codec import (
+    CODECS,
+    get_codec,
+    JsonCodec,
+)
+import pytest
+
+
+@pytest.fixture(params=sorted(CODECS))
+def codec(request):
+    try:
+        return get_codec(request.param)
+    except ImportError as e:
+        pytest.skip(str(e))
+
+
+def test_roundtrip(codec):
+    """Assert that jobs round-trip through each codec, and SQL JSON queries still work."""
+
+    q = JobQueue(":memory:", codec=codec)
+    payload = {"user_id": 1, "msg": "hello"}
+    j = q.create(payload, ["CREATED"])
+    assert j.payload == payload
+    assert q.get(j.id) == j
+
+    j = q.poll("json_extract(j.state, '$[0]') = 'CREATED'", ["POLLED"])
+    assert j.state == ["POLLED"]
+    j = q.cas_state(j.id, ["POLLED"], ["DONE"])
+    assert j.state == ["DONE"]
+    j = q.append_event(j.id, {"foo": "bar"})
+    assert j.events[-1][1]["event"] == {"foo": "bar"}
+    assert j.payload == payload
+
+
+@pytest.mark.parametrize("name", ["json", "orjson"])
+def test_payload_queries(name):
+    """Assert that payloads stored by the JSON codecs can be queried with SQL JSON functions."""
+
+    try:
+        q = JobQueue(":memory:", codec=name)
+    except ImportError as e:
+        pytest.skip(str(e))
+
+    j = q.create({"user_id": 1}, ["CREATED"])
+    q.create({"user_id": 2}, ["CREATED"])
+    assert [r.id for r in q.query("typeof(j.payload) = 'text'")] == [j.id, j.id + 1]
+    assert [r.id for r in q.query("json_extract(j.payload, '$.user_id') = 1")] == [j.id]
+
+
+def test_unknown_codec():
+    """Assert that unknown codecs are rejected."""
+
+    with pytest.raises(ValueError):
+        JobQueue(":memory:", codec="pickle")
+
+
+class CountingCodec(JsonCodec):
+    def __init__(self):
+        self.decoded = 0
+
+    def loads(self, raw):
+        self.decoded += 1
+        return super().loads(raw)
+
+    def json_loads(self, raw):
+        self.decoded += 1
+        return super().json_loads(raw)
+
+
+def test_lazy_decoding():
+    """Assert that job fields are decoded only when accessed, and only once."""
+
+    codec = CountingCodec()
+    q = JobQueue(":memory:", codec=codec)
+    q.create("payload", ["CREATED"])
+    codec.decoded = 0
+
+    j = q.get(1)
+    assert j.id == 1
+    assert codec.decoded == 0
+
+    assert j.state == ["CREATED"]
+    assert j.state == ["CREATED"]
+    assert codec.decoded == 1
+
+    j_prime = j._replace(state=["DONE"])
+    assert j_prime.state == ["DONE"]
+    assert j_prime.payload == "payload"
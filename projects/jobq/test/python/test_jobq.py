@@ -2,10 +2,16 @@
 Tests covering the jobq API
 """
 
+from datetime import datetime, timedelta
 import logging
 from time import sleep
 
-from jobq import Job, JobQueue
+from jobq import (
+    _POLL_SQL,
+    Job,
+    JobQueue,
+    PROFILES,
+)
 import pytest
 
 
@@ -41,6 +47,15 @@ def test_create_get(db, payload):
     assert j == db.get(j.id)
 
 
+def test_get_missing(db):
+    """Test that getting a job which doesn't exist returns None."""
+
+    assert db.get(1) is None
+    j = db.create("payload")
+    db.delete_job(j.id)
+    assert db.get(j.id) is None
+
+
 def test_poll(db):
     """Test that we can poll a job, and the oldest wins."""
 
@@ -104,3 +119,259 @@ def test_cas_fail(db):
     j_prime = db.cas_state(j.id, ["state", 1], ["state", 2])
 
     assert j_prime is None
+
+
+def test_poll_lease_reap(db):
+    """Test that a job whose lease lapses is reaped back to its pre-poll state."""
+
+    j = db.create("job", ["CREATED"])
+    j_prime = db.poll("true", ["POLLED"], lease=0)
+    assert j_prime.id == j.id
+    assert j_prime.state == ["POLLED"]
+
+    reaped = db.reap()
+    assert [r.id for r in reaped] == [j.id]
+    assert reaped[0].state == ["CREATED"]
+    assert reaped[0].events[-1][0] == "job_lease_expired"
+    assert db.reap() == []
+
+
+def test_heartbeat(db):
+    """Test that heartbeats extend live leases, and fail once the job has moved on."""
+
+    j = db.create("job", ["CREATED"])
+    db.poll("true", ["POLLED"], lease=0)
+    j_prime = db.heartbeat(j.id, ["POLLED"], 60)
+    assert j_prime.id == j.id
+    assert db.reap() == []
+
+    assert db.heartbeat(j.id, ["CREATED"], 60) is None
+
+
+def test_cas_releases_lease(db):
+    """Test that advancing a leased job releases the lease."""
+
+    j = db.create("job", ["CREATED"])
+    db.poll("true", ["POLLED"], lease=0)
+    assert db.cas_state(j.id, ["POLLED"], ["DONE"])
+    assert db.reap() == []
+    assert db.get(j.id).state == ["DONE"]
+    assert db.heartbeat(j.id, ["DONE"], 60) is None
+
+
+@pytest.mark.parametrize("profile", sorted(PROFILES))
+def test_profiles(tmp_path, profile):
+    """Test that durability profiles are applied to file-backed queues."""
+
+    q = JobQueue(str(tmp_path / "jobq.sqlite3"), profile=profile)
+    assert q.profile["journal_mode"] == PROFILES[profile]["journal_mode"].lower()
+    assert q.profile["busy_timeout"] == PROFILES[profile]["busy_timeout"]
+    assert q.create("payload")
+    q.close()
+
+
+def test_bad_profile():
+    """Test that unknown profiles and pragmas are rejected."""
+
+    with pytest.raises(ValueError):
+        JobQueue(":memory:", profile="yolo")
+
+    with pytest.raises(ValueError):
+        JobQueue(":memory:", profile={"locking_mode": "EXCLUSIVE"})
+
+    with pytest.raises(ValueError):
+        JobQueue(":memory:", profile={"synchronous": "OFF; DROP TABLE job"})
+
+
+def test_query_pages(db):
+    """Test that queries stream, and can be paged through with `after`."""
+
+    jobs = [db.create(f"payload {i}") for i in range(10)]
+
+    page = list(db.query("true", limit=4, batch_size=3))
+    assert [j.id for j in page] == [j.id for j in jobs[:4]]
+
+    seen = []
+    after = None
+    while True:
+        page = list(db.query("true", limit=4, after=after))
+        if not page:
+            break
+        seen.extend(page)
+        after = page[-1]
+
+    assert seen == jobs
+
+
+def test_query_lazy(db):
+    """Test that queries produce an iterator rather than a materialized list."""
+
+    db.create("payload")
+    results = db.query("true")
+    assert not isinstance(results, list)
+    assert next(results).payload == "payload"
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_archive(db, compress):
+    """Test that archival moves only matching jobs out of the job table, in batches."""
+
+    jobs = [db.create(f"payload {i}", ["DONE" if i % 2 else "CREATED"]) for i in range(7)]
+    done = [j for j in jobs if j.state == ["DONE"]]
+
+    assert db.archive("j.state = json_array('DONE')", batch_size=2, compress=compress) == 3
+    assert [j.id for j in db.query("true")] == [j.id for j in jobs if j not in done]
+    assert db.get_archived(jobs[0].id) is None
+    for j in done:
+        assert db.get_archived(j.id) == j
+
+
+def test_archive_file(tmp_path):
+    """Test that jobs can be archived to a separate file."""
+
+    q = JobQueue(str(tmp_path / "jobq.sqlite3"))
+    archive = str(tmp_path / "archive.sqlite3")
+    j = q.create("payload", ["DONE"])
+
+    assert q.archive("true", path=archive, compress=True) == 1
+    assert list(q.query("true")) == []
+    assert q.get_archived(j.id) is None
+    assert q.get_archived(j.id, path=archive) == j
+    q.close()
+
+
+@pytest.mark.parametrize("to_file", [False, True])
+def test_archive_schedule(tmp_path, to_file):
+    """Test that archived jobs keep their priority and run_after."""
+
+    q = JobQueue(str(tmp_path / "jobq.sqlite3"))
+    path = str(tmp_path / "archive.sqlite3") if to_file else None
+
+    j = q.create("payload", ["DONE"], priority=5, run_after=timedelta(hours=1))
+    assert q.archive("true", path=path) == 1
+    assert q.get_archived(j.id, path=path) == j
+    q.close()
+
+
+def test_poll_priority(db):
+    """Test that higher priority jobs poll first, oldest first within a priority."""
+
+    j1 = db.create("payload 1")
+    j2 = db.create("payload 2", priority=10)
+    j3 = db.create("payload 3", priority=10)
+
+    assert j2.priority == 10
+    assert [db.poll("j.state IS 'null'", ["assigned"]).id for _ in range(3)] == [
+        j2.id,
+        j3.id,
+        j1.id,
+    ]
+
+
+def test_poll_run_after(db):
+    """Test that delayed jobs aren't polled until runnable."""
+
+    j = db.create("payload", ["CREATED"], run_after=timedelta(hours=1))
+    assert j.run_after > datetime.now()
+    assert db.poll("true", ["POLLED"]) is None
+
+    # Re-scheduling it to run now makes it pollable
+    j = db.cas_state(j.id, ["CREATED"], ["RETRY"], run_after=datetime.now())
+    assert db.poll("true", ["POLLED"]).id == j.id
+
+    # And a delayed retry makes it unpollable again
+    db.cas_state(j.id, ["POLLED"], ["RETRY"], run_after=timedelta(seconds=30))
+    assert db.poll("true", ["POLLED"]) is None
+
+
+def test_poll_delayed_priority(db):
+    """Test that due delayed jobs and undelayed jobs poll in priority order, together."""
+
+    j1 = db.create("payload 1")
+    j2 = db.create("payload 2", priority=10, run_after=timedelta(hours=-1))
+    j3 = db.create("payload 3", priority=5)
+
+    polled = [db.poll("j.state IS 'null'", ["POLLED"]) for _ in range(3)]
+    assert [j.id for j in polled] == [j2.id, j3.id, j1.id]
+    # Polling clears run_after
+    assert polled[0].run_after is None
+
+
+def test_poll_plan(db):
+    """Test that polls walk the ready index in order, and only range scan the delayed index."""
+
+    plan = [
+        detail
+        for *_, detail in db._db.execute(
+            "EXPLAIN QUERY PLAN " + _POLL_SQL.format("j.state = json('null')"),
+            {"state": "null", "lease": None, "limit": 1},
+        )
+    ]
+    assert "SCAN j USING INDEX job_ready" in plan
+    delayed = "SEARCH j USING INDEX job_delayed (run_after>? AND run_after<?)"
+    assert any(detail.startswith(delayed) for detail in plan)
+    assert not any(detail == "SCAN j" for detail in plan)
+
+
+def test_create_many(db):
+    """Test that batch creation returns each job, in order."""
+
+    jobs = db.create_many(
+        [
+            {"job": "payload 1"},
+            {"job": "payload 2", "new_state": ["CREATED"], "priority": 10},
+        ]
+    )
+
+    assert [j.payload for j in jobs] == ["payload 1", "payload 2"]
+    assert jobs[1].state == ["CREATED"]
+    assert jobs[1].priority == 10
+    assert db.get(jobs[1].id) == jobs[1]
+
+
+def test_poll_many(db):
+    """Test that batch polling advances at most limit jobs, each only once."""
+
+    for i in range(5):
+        db.create(f"payload {i}", ["CREATED"])
+
+    polled = db.poll_many("j.state = json_array('CREATED')", ["POLLED"], 3)
+    assert len(polled) == 3
+    assert all(j.state == ["POLLED"] for j in polled)
+
+    rest = db.poll_many("j.state = json_array('CREATED')", ["POLLED"], 3)
+    assert len(rest) == 2
+    assert not {j.id for j in polled} & {j.id for j in rest}
+
+    assert db.poll_many("j.state = json_array('CREATED')", ["POLLED"], 3) == []
+
+
+def test_cas_state_many(db):
+    """Test that batch CAS reports conflicts per-update."""
+
+    j1 = db.create("payload 1", ["CREATED"])
+    j2 = db.create("payload 2", ["CREATED"])
+
+    r1, r2 = db.cas_state_many(
+        [
+            {"job_id": j1.id, "old_state": ["CREATED"], "new_state": ["DONE"]},
+            {"job_id": j2.id, "old_state": ["POLLED"], "new_state": ["DONE"]},
+        ]
+    )
+
+    assert r1.state == ["DONE"]
+    assert r2 is None
+    assert db.get(j2.id).state == ["CREATED"]
+
+
+def test_append_event_many(db):
+    """Test that batch event appends report missing jobs per-event."""
+
+    j = db.create("payload")
+    r1, r2 = db.append_event_many(
+        [{"job_id": j.id, "event": "event"}, {"job_id": j.id + 1, "event": "event"}]
+    )
+
+    assert r1.events[-1][0] == "user_event"
+    assert r2 is None
+    assert db.append_event(j.id + 1, "event") is None
@@ -0,0 +1,139 @@
+"""
+Tests covering jobq metrics
+"""
+
+from time import sleep
+
+from jobq import JobQueue
+from jobq.metrics import (
+    Histogram,
+    Metrics,
+    NULL_METRICS,
+    prometheus_text,
+    PrometheusTextfileExporter,
+)
+import pytest
+
+
+@pytest.fixture
+def metrics():
+    return Metrics()
+
+
+@pytest.fixture
+def db(metrics):
+    return JobQueue(":memory:", metrics=metrics)
+
+
+def test_default_null():
+    """Assert that queues discard metrics by default."""
+
+    assert JobQueue(":memory:").metrics is NULL_METRICS
+
+
+def test_histogram():
+    """Assert that histograms bucket cumulatively."""
+
+    h = Histogram([1, 2])
+    for v in [0.5, 1.5, 1.5, 3]:
+        h.observe(v)
+
+    assert h.snapshot() == {
+        "buckets": [(1, 1), (2, 3), (float("inf"), 4)],
+        "sum": 6.5,
+        "count": 4,
+    }
+
+
+def test_operations(db, metrics):
+    """Assert that operations are counted by outcome, and timed."""
+
+    j = db.create("payload", ["CREATED"])
+    db.poll("false", ["POLLED"])
+    db.poll("true", ["POLLED"])
+    db.cas_state(j.id, ["CREATED"], ["DONE"])
+
+    snapshot = metrics.snapshot()
+    assert snapshot["operations"] == {
+        "cas_state:miss": 1,
+        "create:ok": 1,
+        "poll:miss": 1,
+        "poll:ok": 1,
+    }
+    assert snapshot["latency"]["poll"]["count"] == 2
+    assert snapshot["lock_wait"]["create"]["count"] == 1
+
+
+def test_poll_wait(db, metrics):
+    """Assert that a waiting poll's wait is reported apart from its poll attempts."""
+
+    assert db.poll("false", ["POLLED"], wait=0.2) is None
+
+    snapshot = metrics.snapshot()
+    assert snapshot["operations"]["poll_wait:miss"] == 1
+    assert snapshot["latency"]["poll_wait"]["sum"] >= 0.2
+    # Each attempt is timed on its own, without the time spent waiting between attempts
+    assert snapshot["latency"]["poll"]["sum"] < 0.2
+
+
+def test_query(db, metrics):
+    """Assert that queries are reported once consumed, timing their fetching but not their consumer."""
+
+    for i in range(5):
+        db.create(i)
+
+    results = db.query("true", batch_size=2)
+    assert "query:ok" not in metrics.snapshot()["operations"]
+
+    for job in results:
+        sleep(0.05)
+    snapshot = metrics.snapshot()
+    assert snapshot["operations"]["query:ok"] == 1
+    assert snapshot["latency"]["query"]["sum"] < 0.05
+
+    # Closing a query early still reports it
+    results = db.query("true", batch_size=2)
+    next(results)
+    results.close()
+    assert metrics.snapshot()["operations"]["query:ok"] == 2
+
+    with pytest.raises(Exception):
+        db.query("a syntax error")
+    assert metrics.snapshot()["operations"]["query:error"] == 1
+
+
+def test_errors(db, metrics):
+    """Assert that failed operations are counted as errors."""
+
+    with pytest.raises(Exception):
+        db.poll("a syntax error", ["POLLED"])
+
+    assert metrics.snapshot()["operations"] == {"poll:error": 1}
+
+
+def test_depth(db, metrics):
+    """Assert that queue depth is counted by state."""
+
+    db.create("payload", ["CREATED"])
+    db.create("payload", ["CREATED"])
+    db.create("payload", ["DONE"])
+
+    assert db.depth() == {'["CREATED"]': 2, '["DONE"]': 1}
+    assert metrics.snapshot()["depth"] == {'["CREATED"]': 2, '["DONE"]': 1}
+
+
+def test_prometheus(db, metrics, tmp_path):
+    """Assert that snapshots render to the Prometheus text format, and export."""
+
+    db.create("payload", ["CREATED"])
+    db.depth()
+
+    text = prometheus_text(metrics.snapshot())
+    assert 'jobq_operations_total{op="create",outcome="ok"} 1' in text
+    assert 'jobq_latency_seconds_bucket{op="create",le="+Inf"} 1' in text
+    assert 'jobq_depth{state="[\\"CREATED\\"]"} 1' in text
+
+    path = tmp_path / "jobq.prom"
+    metrics.exporters.append(PrometheusTextfileExporter(str(path)))
+    metrics.export()
+    assert path.read_text().startswith("# HELP jobq_operations_total")
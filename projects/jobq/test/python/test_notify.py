@@ -0,0 +1,113 @@
+"""
+Tests covering waiting for changes to the queue
+"""
+
+import threading
+from time import monotonic
+
+from jobq import JobQueue
+from jobq.notify import ChangeFeed, Notifier
+
+
+def _later(fn, delay=0.1):
+    t = threading.Timer(delay, fn)
+    t.start()
+    return t
+
+
+def test_poll_wait_timeout():
+    """Assert that a waiting poll gives up after its wait."""
+
+    q = JobQueue(":memory:")
+    start = monotonic()
+    assert q.poll("true", ["POLLED"], wait=0.2) is None
+    assert monotonic() - start >= 0.2
+    q.close()
+
+
+def test_poll_wait_shared_notifier(tmp_path):
+    """Assert that a waiting poll is woken by a write through a queue sharing its notifier."""
+
+    path = str(tmp_path / "jobq.sqlite3")
+    notifier = Notifier()
+    waiter = JobQueue(path, notifier=notifier, check_same_thread=False)
+    writer = JobQueue(path, notifier=notifier, check_same_thread=False)
+
+    t = _later(lambda: writer.create("payload"))
+    start = monotonic()
+    j = waiter.poll("true", ["POLLED"], wait=5)
+    # Woken by the notifier, well before the once-a-second re-poll
+    assert monotonic() - start < 0.9
+    assert j.payload == "payload"
+
+    t.join()
+    waiter.close()
+    writer.close()
+    notifier.close()
+
+
+def test_poll_wait_other_connection(tmp_path):
+    """Assert that a waiting poll notices writes it wasn't notified of."""
+
+    path = str(tmp_path / "jobq.sqlite3")
+    waiter = JobQueue(path)
+    writer = JobQueue(path, migrate=False, check_same_thread=False)
+
+    t = _later(lambda: writer.create("payload"))
+    start = monotonic()
+    assert waiter.poll("true", ["POLLED"], wait=5).payload == "payload"
+    assert monotonic() - start < 0.9
+
+    t.join()
+    waiter.close()
+    writer.close()
+
+
+def test_notifier_wait():
+    """Assert that waits return as soon as the version moves on."""
+
+    notifier = Notifier()
+    version = notifier.version
+    assert not notifier.wait(version, 0.05)
+
+    _later(notifier.notify)
+    assert notifier.wait(version, 5)
+    # Changes before waiting aren't missed
+    assert notifier.wait(version, 0)
+
+
+def test_change_feed():
+    """Assert that a feed yields each change to matching jobs once."""
+
+    q = JobQueue(":memory:")
+    feed = ChangeFeed("json_extract(j.state, '$[0]') = 'CREATED'", since=0)
+    assert feed.update(q.query(feed.query)) == []
+
+    j1 = q.create(1, ["CREATED"])
+    j2 = q.create(2, ["CREATED"])
+    q.create(3, ["IGNORED"])
+    assert [j.id for j in feed.update(q.query(feed.query))] == [j1.id, j2.id]
+    assert feed.update(q.query(feed.query)) == []
+
+    # Changes within the same second are still noticed
+    q.append_event(j1.id, "event")
+    assert [j.id for j in feed.update(q.query(feed.query))] == [j1.id]
+    assert feed.update(q.query(feed.query)) == []
+    q.close()
+
+
+def test_change_feed_or():
+    """Assert that a feed only yields changes since its watermark, even for queries using OR."""
+
+    q = JobQueue(":memory:")
+    old = q.create("old", ["A"])
+    with q._db as db:
+        db.execute("UPDATE `job` SET `modified` = `modified` - 100")
+
+    feed = ChangeFeed("j.state = json_array('A') OR j.state = json_array('B')")
+    assert feed.update(q.query(feed.query)) == []
+
+    new = q.create("new", ["B"])
+    assert [j.id for j in feed.update(q.query(feed.query))] == [new.id]
+    assert old.id not in [j.id for j in q.query(feed.query)]
+    q.close()
@@ -0,0 +1,136 @@
+"""
+Tests covering the sharded jobq API
+"""
+
+import threading
+from time import monotonic
+
+from jobq import Job
+from jobq.sharded import ShardedJobQueue
+import pytest
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return [str(tmp_path / f"shard-{i}.sqlite3") for i in range(3)]
+
+
+@pytest.fixture
+def db(paths):
+    q = ShardedJobQueue(paths)
+    yield q
+    q.close()
+
+
+def test_create_get(db):
+    """Assert that jobs spread over shards, and are routed back by ID."""
+
+    jobs = [db.create({"n": i}, ["CREATED"]) for i in range(30)]
+    assert len({j.id for j in jobs}) == 30
+    assert len({db._decode(j.id)[0] for j in jobs}) == 3
+
+    for j in jobs:
+        assert isinstance(j, Job)
+        assert db.get(j.id) == j
+
+
+def test_create_key(db):
+    """Assert that jobs with the same key land on the same shard."""
+
+    jobs = [db.create(i, key="some-queue") for i in range(10)]
+    assert len({db._decode(j.id)[0] for j in jobs}) == 1
+
+
+def test_cas_event(db):
+    """Assert that state and event updates route to the right shard."""
+
+    jobs = [db.create(i, ["CREATED"]) for i in range(10)]
+    for j in jobs:
+        j_prime = db.cas_state(j.id, ["CREATED"], ["DONE"])
+        assert j_prime.id == j.id
+        assert j_prime.state == ["DONE"]
+        assert db.append_event(j.id, "event").id == j.id
+        assert db.cas_state(j.id, ["CREATED"], ["DONE"]) is None
+
+
+@pytest.mark.parametrize("polling", ["round-robin", "depth"])
+def test_poll(paths, polling):
+    """Assert that polls find jobs on every shard."""
+
+    db = ShardedJobQueue(paths, polling=polling, depth_ttl=0)
+    jobs = [db.create(i, ["CREATED"]) for i in range(20)]
+    query = "json_extract(j.state, '$[0]') = 'CREATED'"
+
+    polled = [db.poll(query, ["POLLED"]) for _ in range(21)]
+    assert polled[-1] is None
+    assert {j.id for j in polled[:-1]} == {j.id for j in jobs}
+    db.close()
+
+
+def test_poll_wait(paths):
+    """Assert that a waiting poll is woken by a job created on any shard."""
+
+    db = ShardedJobQueue(paths, check_same_thread=False)
+    assert db.poll("true", ["POLLED"], wait=0.1) is None
+
+    timer = threading.Timer(0.1, db.create, ["payload", ["CREATED"]])
+    timer.start()
+    start = monotonic()
+    j = db.poll("json_extract(j.state, '$[0]') = 'CREATED'", ["POLLED"], wait=5)
+    timer.join()
+    assert j.payload == "payload"
+    assert monotonic() - start < 1.0
+    db.close()
+
+
+def test_reap_limit(db):
+    """Assert that the reap limit applies across all shards, not per shard."""
+
+    for i in range(12):
+        db.create(i, ["CREATED"])
+    assert len(db.poll_many("true", ["POLLED"], 12, lease=0)) == 12
+
+    assert len(db.reap(limit=5)) == 5
+    assert len(db.reap()) == 7
+    assert db.reap() == []
+
+
+def test_query_pages(db):
+    """Assert that queries merge shards in order, and can be paged through."""
+
+    jobs = [db.create(i) for i in range(20)]
+    expected = sorted(jobs, key=lambda j: (j.modified, j.id))
+
+    assert list(db.query("true")) == expected
+    assert list(db.query("true", limit=5)) == expected[:5]
+
+    seen = []
+    after = None
+    while True:
+        page = list(db.query("true", limit=3, after=after))
+        if not page:
+            break
+        seen.extend(page)
+        after = page[-1]
+
+    assert seen == expected
+
+
+def test_batches(db):
+    """Assert that batch operations route across shards, and keep their order."""
+
+    jobs = db.create_many([{"job": i, "new_state": ["CREATED"]} for i in range(20)])
+    assert [j.payload for j in jobs] == list(range(20))
+    assert len({db._decode(j.id)[0] for j in jobs}) == 3
+
+    query = "json_extract(j.state, '$[0]') = 'CREATED'"
+    polled = db.poll_many(query, ["POLLED"], 15)
+    assert len(polled) == 15
+    assert len(db.poll_many(query, ["POLLED"], 15)) == 5
+
+    updated = db.cas_state_many(
+        [{"job_id": j.id, "old_state": ["POLLED"], "new_state": ["DONE"]} for j in jobs]
+        + [{"job_id": jobs[0].id, "old_state": ["POLLED"], "new_state": ["DONE"]}]
+    )
+    assert [j.id for j in updated[:-1]] == [j.id for j in jobs]
+    assert updated[-1] is None
@@ -3,17 +3,41 @@ A job queue over HTTP.
 """
 
 import argparse
+from contextlib import contextmanager
 import logging
 import os
+import queue
+import threading
+from time import monotonic, perf_counter
 
 from flask import (
     abort,
     current_app,
     Flask,
+    g,
     jsonify,
     request,
+    Response,
+)
+from jobq import JobQueue, PROFILES
+from jobq.metrics import Metrics
+from jobq.notify import ChangeFeed, Notifier
+from jobqd.metrics import (
+    HttpMetrics,
+    metrics_text,
+)
+from jobqd.util import (
+    create_many_args,
+    decode_cursor,
+    encode_cursor,
+    event_many_args,
+    job_as_json,
+    keepalive_line,
+    state_many_args,
+    stream_line,
+    wants_ndjson,
+    wants_sse,
 )
-from jobq import Job, JobQueue
 
 
 log = logging.getLogger(__name__)
@@ -25,40 +49,224 @@ parser = argparse.ArgumentParser()
 parser.add_argument("--port", type=int, default=8080)
 parser.add_argument("--host", default="localhost")
 parser.add_argument("--db", default="~/jobq.sqlite3")
+parser.add_argument("--profile", default="durable", choices=sorted(PROFILES))
+parser.add_argument("--pool-size", type=int, default=16)
+parser.add_argument(
+    "--page-size",
+    type=int,
+    default=100,
+    help="The most jobs a listing returns per page",
+)
+parser.add_argument(
+    "--depth-interval",
+    type=float,
+    default=10.0,
+    help="How often /metrics re-counts the queue's depth, in seconds",
+)
+parser.add_argument(
+    "--max-wait",
+    type=float,
+    default=30.0,
+    help="The longest a poll may wait for a job, in seconds",
+)
+parser.add_argument(
+    "--async",
+    dest="use_async",
+    action="store_true",
+    help="Serve with aiohttp rather than Flask's threaded server",
+)
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=1,
+    help="Number of --async worker processes, sharing the port",
+)
+
+
+class QueuePool(object):
+    """A process-wide pool of connections to a single job queue.
+
+    The queue is opened and migrated once, when the pool is created. Further connections are
+    opened lazily (without re-running migrations) as concurrent demand requires, up to size.
+    All connections share a notifier, so that writes through any of them wake waiters.
+    """
+
+    def __init__(self, path, size=16, **kwargs):
+        self._path = path
+        self._size = size
+        self.notifier = Notifier(path)
+        self._kwargs = dict(kwargs, notifier=self.notifier)
+        self._lock = threading.Lock()
+        self._pool = queue.LifoQueue()
+        self._all = [JobQueue(path, check_same_thread=False, **self._kwargs)]
+        self._pool.put(self._all[0])
+
+    def acquire(self, timeout=None) -> JobQueue:
+        """Check a connection out of the pool, waiting if all size connections are in use."""
+
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if len(self._all) < self._size:
+                q = JobQueue(
+                    self._path, migrate=False, check_same_thread=False, **self._kwargs
+                )
+                self._all.append(q)
+                return q
+
+        return self._pool.get(timeout=timeout)
+
+    def release(self, q: JobQueue):
+        """Return a checked out connection to the pool."""
+
+        self._pool.put(q)
+
+    @contextmanager
+    def connection(self):
+        q = self.acquire()
+        try:
+            yield q
+        finally:
+            self.release(q)
+
+    def scan(self, query, limit=None, after=None, page_size=256):
+        """Lazily iterate over (up to limit) jobs matching a query, a page at a time.
+
+        Connections are checked out per page, so slow consumers don't tie the pool up or hold a
+        read transaction open.
+        """
+
+        while limit is None or limit > 0:
+            n = page_size if limit is None else min(page_size, limit)
+            with self.connection() as q:
+                jobs = list(q.query(query, limit=n, after=after))
+            yield from jobs
+
+            if len(jobs) < n:
+                break
+            if limit is not None:
+                limit -= n
+            after = jobs[-1]
+
+    def poll(self, query, new_state, wait=0):
+        """Poll for a job, waiting up to wait seconds for one to become available.
+
+        Connections are checked out per attempt, so waiting pollers don't tie the pool up. As with
+        `JobQueue.poll`, the whole of a waiting poll is reported to metrics as a `poll_wait`.
+        """
+
+        start = perf_counter()
+        deadline = monotonic() + wait
+        while True:
+            version = self.notifier.version
+            with self.connection() as q:
+                job = q.poll(query, new_state)
+            remaining = deadline - monotonic()
+            if job or remaining <= 0:
+                break
+            self.notifier.wait(version, min(remaining, 1.0))
+
+        metrics = self._kwargs.get("metrics")
+        if wait and metrics:
+            outcome = "ok" if job else "miss"
+            metrics.observe("poll_wait", perf_counter() - start, 0.0, outcome)
+        return job
+
+    def close(self):
+        with self._lock:
+            for q in self._all:
+                q.close()
+            self._all = []
+        self.notifier.close()
 
 
 @app.before_request
-def setup_q():
-    request.q = JobQueue(current_app.config["db"])
+def start_timer():
+    current_app.config["http_metrics"].start()
+    g.start = perf_counter()
 
 
 @app.after_request
-def teardown_q():
-    request.q.close()
+def record_status(response):
+    g.status = response.status_code
+    return response
+
 
+@app.teardown_request
+def stop_timer(exc):
+    if "start" in g:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        current_app.config["http_metrics"].finish(
+            route, request.method, g.get("status", 500), perf_counter() - g.start
+        )
 
-def job_as_json(job: Job) -> dict:
-    return {
-        "id": job.id,
-        "payload": job.payload,
-        "events": job.events,
-        "state": job.state,
-        "modified": int(job.modified),
-    }
+
+# Endpoints which may block, so check connections out of the pool only as they need them
+_UNPOOLED = {"get_jobs", "poll_job", "stream_jobs"}
+
+
+@app.before_request
+def setup_q():
+    if request.endpoint not in _UNPOOLED:
+        request.q = current_app.config["pool"].acquire()
+
+
+@app.teardown_request
+def teardown_q(exc):
+    q = getattr(request, "q", None)
+    if q is not None:
+        current_app.config["pool"].release(q)
+
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """Report HTTP and queue metrics in the Prometheus text format."""
+
+    http_metrics = current_app.config["http_metrics"]
+    if http_metrics.depth_due(current_app.config["depth_interval"]):
+        request.q.depth()
+
+    return Response(
+        metrics_text(http_metrics, current_app.config["metrics"]),
+        mimetype="text/plain; version=0.0.4",
+    )
 
 
 @app.route("/api/v0/job", methods=["GET", "POST"])
 def get_jobs():
-    """Return jobs in the system."""
+    """Return a page of the jobs in the system, or stream them all as NDJSON.
+
+    Pages hold at most limit (or the server's page size) jobs, and come with a cursor to pass
+    back to fetch the next page, or null if there are no more.
+    """
 
     if request.method == "POST":
         blob = request.get_json(force=True)
     else:
-        blob = {}
+        blob = request.args
 
     query = blob.get("query", "true")
-
-    return jsonify({"jobs": [job_as_json(j) for j in request.q.query(query)]}), 200
+    limit = int(blob["limit"]) if blob.get("limit") else None
+    try:
+        after = decode_cursor(blob.get("cursor"))
+    except ValueError:
+        abort(400)
+
+    pool = current_app.config["pool"]
+    if wants_ndjson(request.headers.get("Accept"), blob.get("format")):
+        jobs = pool.scan(query, limit=limit, after=after)
+        return Response(
+            (stream_line(j) for j in jobs), mimetype="application/x-ndjson"
+        )
+
+    page_size = current_app.config["page_size"]
+    limit = min(limit or page_size, page_size)
+    jobs = list(pool.scan(query, limit=limit, after=after, page_size=limit))
+    cursor = encode_cursor(jobs[-1]) if len(jobs) == limit else None
+    return jsonify({"jobs": [job_as_json(j) for j in jobs], "cursor": cursor}), 200
 
 
 @app.route("/api/v0/job/create", methods=["POST"])
@@ -74,23 +282,100 @@ def create_job():
 
 @app.route("/api/v0/job/poll", methods=["POST"])
 def poll_job():
-    """Using a query, attempt to poll for the next job matching criteria."""
+    """Using a query, attempt to poll for the next job matching criteria.
+
+    If a wait (in seconds) is given, wait up to that long for a matching job.
+    """
 
     blob = request.get_json(force=True)
     query = blob["query"]
     state = blob["state"]
-    r = request.q.poll(query, state)
+    wait = min(float(blob.get("wait") or 0), current_app.config["max_wait"])
+    r = current_app.config["pool"].poll(query, state, wait=wait)
     if r:
         return jsonify(job_as_json(r)), 200
     else:
         abort(404)
 
 
+@app.route("/api/v0/job/stream", methods=["GET", "POST"])
+def stream_jobs():
+    """Stream changes to jobs matching a query, as NDJSON or server-sent events."""
+
+    if request.method == "POST":
+        blob = request.get_json(force=True)
+    else:
+        blob = request.args
+
+    pool = current_app.config["pool"]
+    keepalive = current_app.config["max_wait"]
+    try:
+        feed = ChangeFeed(blob.get("query", "true"), since=blob.get("since"))
+    except (TypeError, ValueError):
+        abort(400)
+    sse = wants_sse(request.headers.get("Accept"), blob.get("format"))
+
+    def _stream():
+        while True:
+            version = pool.notifier.version
+            with pool.connection() as q:
+                jobs = feed.update(q.query(feed.query))
+            for job in jobs:
+                yield stream_line(job, sse)
+
+            if not pool.notifier.wait(version, keepalive):
+                yield keepalive_line(sse)
+
+    return Response(
+        _stream(),
+        mimetype="text/event-stream" if sse else "application/x-ndjson",
+    )
+
+
+@app.route("/api/v0/job/create_many", methods=["POST"])
+def create_jobs():
+    """Create many jobs in one transaction, returning them in order."""
+
+    blob = request.get_json(force=True)
+    jobs = request.q.create_many(create_many_args(blob))
+    return jsonify({"jobs": [job_as_json(j) for j in jobs]}), 200
+
+
+@app.route("/api/v0/job/poll_many", methods=["POST"])
+def poll_jobs():
+    """Using a query, poll for up to limit jobs matching criteria."""
+
+    blob = request.get_json(force=True)
+    query = blob["query"]
+    state = blob["state"]
+    limit = int(blob["limit"])
+    jobs = request.q.poll_many(query, state, limit)
+    return jsonify({"jobs": [job_as_json(j) for j in jobs]}), 200
+
+
+@app.route("/api/v0/job/state_many", methods=["POST"])
+def update_states():
+    """CAS update many jobs' states in one transaction, returning null for each conflict."""
+
+    blob = request.get_json(force=True)
+    jobs = request.q.cas_state_many(state_many_args(blob))
+    return jsonify({"jobs": [job_as_json(j) if j else None for j in jobs]}), 200
+
+
+@app.route("/api/v0/job/event_many", methods=["POST"])
+def append_events():
+    """Append many user-defined events in one transaction, returning null for each missing job."""
+
+    blob = request.get_json(force=True)
+    jobs = request.q.append_event_many(event_many_args(blob))
+    return jsonify({"jobs": [job_as_json(j) if j else None for j in jobs]}), 200
+
+
 @app.route("/api/v0/job/<job_id>", methods=["GET"])
 def get_job(job_id):
     """Return a job by ID."""
 
-    r = request.q.get(id=job_id)
+    r = request.q.get(job_id)
     if r:
         return jsonify(job_as_json(r)), 200
     else:
@@ -126,7 +411,7 @@ def append_event(job_id):
 def delete_job(job_id):
     """Delete a given job."""
 
-    request.q.job_delete(request.db, id=job_id)
+    request.q.delete_job(job_id)
 
     return jsonify({}), 200
 
@@ -139,11 +424,44 @@ def main():
     app.config["db"] = os.path.expanduser(os.path.expandvars(opts.db))
     app.config["host"] = opts.host
     app.config["port"] = opts.port
-
-    app.run(
-        threaded=True,
+    app.config["max_wait"] = opts.max_wait
+    app.config["page_size"] = opts.page_size
+    app.config["depth_interval"] = opts.depth_interval
+
+    if opts.use_async:
+        from jobqd.aio import run
+
+        run(
+            app.config["db"],
+            opts.host,
+            opts.port,
+            workers=opts.workers,
+            profile=opts.profile,
+            max_wait=opts.max_wait,
+            page_size=opts.page_size,
+            depth_interval=opts.depth_interval,
+        )
+        return
+
+    # Connect and migrate once, up front, rather than per-request
+    app.config["metrics"] = Metrics()
+    app.config["http_metrics"] = HttpMetrics()
+    app.config["pool"] = QueuePool(
+        app.config["db"],
+        size=opts.pool_size,
+        profile=opts.profile,
+        metrics=app.config["metrics"],
     )
 
+    try:
+        app.run(
+            host=opts.host,
+            port=opts.port,
+            threaded=True,
+        )
+    finally:
+        app.config["pool"].close()
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,409 @@
+"""
+A job queue over HTTP, served from asyncio.
+
+Handlers are coroutines running against an `AsyncJobQueue`, so an idle or waiting client costs a
+coroutine rather than a thread, and one process can hold thousands of connections. Several worker
+processes may serve the same queue, sharing the listening port via SO_REUSEPORT; each has its own
+writer thread, and SQLite's busy timeout arbitrates between them.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import signal
+from time import perf_counter
+
+from aiohttp import web
+from jobq import JobQueue
+from jobq.aio import AsyncJobQueue
+from jobq.metrics import Metrics
+from jobq.notify import ChangeFeed
+from jobqd.metrics import (
+    HttpMetrics,
+    metrics_text,
+)
+from jobqd.util import (
+    create_many_args,
+    decode_cursor,
+    encode_cursor,
+    event_many_args,
+    job_as_json,
+    keepalive_line,
+    state_many_args,
+    stream_line,
+    wants_ndjson,
+    wants_sse,
+)
+
+
+log = logging.getLogger(__name__)
+
+routes = web.RouteTableDef()
+
+
+async def _scan(q: AsyncJobQueue, query, limit=None, after=None, page_size=256):
+    """Lazily iterate over (up to limit) jobs matching a query, a page at a time."""
+
+    while limit is None or limit > 0:
+        n = page_size if limit is None else min(page_size, limit)
+        jobs = await q.query(query, limit=n, after=after)
+        for job in jobs:
+            yield job
+
+        if len(jobs) < n:
+            break
+        if limit is not None:
+            limit -= n
+        after = jobs[-1]
+
+
+@routes.get("/api/v0/job")
+@routes.post("/api/v0/job")
+async def get_jobs(request):
+    """Return a page of the jobs in the system, or stream them all as NDJSON.
+
+    Pages hold at most limit (or the server's page size) jobs, and come with a cursor to pass
+    back to fetch the next page, or null if there are no more.
+    """
+
+    if request.method == "POST":
+        blob = await request.json()
+    else:
+        blob = request.query
+
+    query = blob.get("query", "true")
+    limit = int(blob["limit"]) if blob.get("limit") else None
+    try:
+        after = decode_cursor(blob.get("cursor"))
+    except ValueError:
+        raise web.HTTPBadRequest()
+
+    q = request.app["q"]
+    if wants_ndjson(request.headers.get("Accept"), blob.get("format")):
+        response = web.StreamResponse()
+        response.content_type = "application/x-ndjson"
+        await response.prepare(request)
+        async for job in _scan(q, query, limit=limit, after=after):
+            await response.write(stream_line(job).encode("utf-8"))
+        await response.write_eof()
+        return response
+
+    page_size = request.app["page_size"]
+    limit = min(limit or page_size, page_size)
+    jobs = await q.query(query, limit=limit, after=after)
+    cursor = encode_cursor(jobs[-1]) if len(jobs) == limit else None
+    return web.json_response({"jobs": [job_as_json(j) for j in jobs], "cursor": cursor})
+
+
+@routes.post("/api/v0/job/create")
+async def create_job(request):
+    """Create a job."""
+
+    blob = await request.json()
+    payload = blob["payload"]
+    state = blob.get("state", None)
+    job = await request.app["q"].create(payload, state)
+    return web.json_response(job_as_json(job))
+
+
+@routes.post("/api/v0/job/poll")
+async def poll_job(request):
+    """Using a query, attempt to poll for the next job matching criteria.
+
+    If a wait (in seconds) is given, wait up to that long for a matching job.
+    """
+
+    blob = await request.json()
+    query = blob["query"]
+    state = blob["state"]
+    wait = min(float(blob.get("wait") or 0), request.app["max_wait"])
+    r = await request.app["q"].poll(query, state, wait=wait)
+    if r:
+        return web.json_response(job_as_json(r))
+    else:
+        raise web.HTTPNotFound()
+
+
+@routes.get("/api/v0/job/stream")
+@routes.post("/api/v0/job/stream")
+async def stream_jobs(request):
+    """Stream changes to jobs matching a query, as NDJSON or server-sent events."""
+
+    if request.method == "POST":
+        blob = await request.json()
+    else:
+        blob = request.query
+
+    q = request.app["q"]
+    try:
+        feed = ChangeFeed(blob.get("query", "true"), since=blob.get("since"))
+    except (TypeError, ValueError):
+        raise web.HTTPBadRequest()
+    sse = wants_sse(request.headers.get("Accept"), blob.get("format"))
+
+    response = web.StreamResponse()
+    response.content_type = "text/event-stream" if sse else "application/x-ndjson"
+    await response.prepare(request)
+
+    while not request.app["stopping"].is_set():
+        version = q.notifier.version
+        jobs = feed.update(await q.query(feed.query))
+        for job in jobs:
+            await response.write(stream_line(job, sse).encode("utf-8"))
+
+        if not await q.notifier.wait_async(version, request.app["max_wait"]):
+            await response.write(keepalive_line(sse).encode("utf-8"))
+
+    return response
+
+
+@routes.post("/api/v0/job/create_many")
+async def create_jobs(request):
+    """Create many jobs in one transaction, returning them in order."""
+
+    blob = await request.json()
+    jobs = await request.app["q"].create_many(create_many_args(blob))
+    return web.json_response({"jobs": [job_as_json(j) for j in jobs]})
+
+
+@routes.post("/api/v0/job/poll_many")
+async def poll_jobs(request):
+    """Using a query, poll for up to limit jobs matching criteria."""
+
+    blob = await request.json()
+    query = blob["query"]
+    state = blob["state"]
+    limit = int(blob["limit"])
+    jobs = await request.app["q"].poll_many(query, state, limit)
+    return web.json_response({"jobs": [job_as_json(j) for j in jobs]})
+
+
+@routes.post("/api/v0/job/state_many")
+async def update_states(request):
+    """CAS update many jobs' states in one transaction, returning null for each conflict."""
+
+    blob = await request.json()
+    jobs = await request.app["q"].cas_state_many(state_many_args(blob))
+    return web.json_response({"jobs": [job_as_json(j) if j else None for j in jobs]})
+
+
+@routes.post("/api/v0/job/event_many")
+async def append_events(request):
+    """Append many user-defined events in one transaction, returning null for each missing job."""
+
+    blob = await request.json()
+    jobs = await request.app["q"].append_event_many(event_many_args(blob))
+    return web.json_response({"jobs": [job_as_json(j) if j else None for j in jobs]})
+
+
+@routes.get("/api/v0/job/{job_id}")
+async def get_job(request):
+    """Return a job by ID."""
+
+    r = await request.app["q"].get(request.match_info["job_id"])
+    if r:
+        return web.json_response(job_as_json(r))
+    else:
+        raise web.HTTPNotFound()
+
+
+@routes.post("/api/v0/job/{job_id}/state")
+async def update_state(request):
+    """CAS update a job's state, returning the updated job or indicating a conflict."""
+
+    document = await request.json()
+    old = document["old"]
+    new = document["new"]
+    r = await request.app["q"].cas_state(request.match_info["job_id"], old, new)
+    if r:
+        return web.json_response(job_as_json(r))
+    else:
+        raise web.HTTPConflict()
+
+
+@routes.post("/api/v0/job/{job_id}/event")
+async def append_event(request):
+    """Append a user-defined event to the job's log."""
+
+    r = await request.app["q"].append_event(
+        request.match_info["job_id"], await request.json()
+    )
+    if r:
+        return web.json_response(job_as_json(r))
+    else:
+        raise web.HTTPNotFound()
+
+
+@routes.delete("/api/v0/job/{job_id}")
+async def delete_job(request):
+    """Delete a given job."""
+
+    await request.app["q"].delete_job(request.match_info["job_id"])
+
+    return web.json_response({})
+
+
+@web.middleware
+async def timing(request, handler):
+    """Start timing each request, for `finish_timing` to report once its response is prepared.
+
+    Streamed responses are prepared before their first byte is written, so as with the Flask
+    server they're timed (and counted in flight) to their first byte, not for their lifetime.
+    """
+
+    resource = request.match_info.route.resource
+    route = resource.canonical if resource else "unmatched"
+    request["timing"] = (route, perf_counter())
+    request.app["http_metrics"].start()
+    try:
+        return await handler(request)
+    except asyncio.CancelledError:
+        # Cancelled, say by the client disconnecting, before a response was prepared
+        await finish_timing(request, None)
+        raise
+
+
+async def finish_timing(request, response):
+    """Report a request's latency and status to the app's HTTP metrics, once."""
+
+    timing = request.pop("timing", None)
+    if timing:
+        route, start = timing
+        status = response.status if response is not None else 500
+        request.app["http_metrics"].finish(
+            route, request.method, status, perf_counter() - start
+        )
+
+
+@routes.get("/metrics")
+async def get_metrics(request):
+    """Report HTTP and queue metrics in the Prometheus text format."""
+
+    http_metrics = request.app["http_metrics"]
+    if http_metrics.depth_due(request.app["depth_interval"]):
+        await request.app["q"].depth()
+
+    return web.Response(
+        body=metrics_text(http_metrics, request.app["metrics"]).encode("utf-8"),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+def make_app(
+    q: AsyncJobQueue,
+    metrics: Metrics,
+    max_wait=30.0,
+    page_size=100,
+    depth_interval=10.0,
+) -> web.Application:
+    """Build the application, serving the given queue and closing it on cleanup.
+
+    The queue should report to the given metrics, which are served along with HTTP metrics.
+    """
+
+    async def _end_streams(app):
+        # Wake streams so that they notice the shutdown and end
+        app["stopping"].set()
+        app["q"].notifier.notify()
+
+    async def _close_q(app):
+        await app["q"].close()
+
+    app = web.Application(middlewares=[timing])
+    app["q"] = q
+    app["metrics"] = metrics
+    app["http_metrics"] = HttpMetrics()
+    app["max_wait"] = max_wait
+    app["page_size"] = page_size
+    app["depth_interval"] = depth_interval
+    app["stopping"] = asyncio.Event()
+    app.add_routes(routes)
+    app.on_response_prepare.append(finish_timing)
+    app.on_shutdown.append(_end_streams)
+    app.on_cleanup.append(_close_q)
+    return app
+
+
+async def serve(
+    path,
+    host,
+    port,
+    profile="durable",
+    migrate=True,
+    reuse_port=False,
+    shutdown_timeout=60.0,
+    **kwargs,
+):
+    """Serve the queue at path until SIGINT or SIGTERM.
+
+    On a signal, stop accepting connections, end streams, give in-flight requests up to
+    `shutdown_timeout` seconds to finish, then drain outstanding writes and close the queue.
+
+    Other arguments are passed to `make_app`.
+    """
+
+    metrics = Metrics()
+    q = AsyncJobQueue(path, profile=profile, migrate=migrate, metrics=metrics)
+    runner = web.AppRunner(make_app(q, metrics, **kwargs))
+    await runner.setup()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in [signal.SIGINT, signal.SIGTERM]:
+        loop.add_signal_handler(sig, stop.set)
+
+    try:
+        site = web.TCPSite(
+            runner,
+            host,
+            port,
+            reuse_port=reuse_port,
+            shutdown_timeout=shutdown_timeout,
+        )
+        await site.start()
+        log.info(f"Serving {path} on {host}:{port}")
+        await stop.wait()
+    finally:
+        log.info("Shutting down")
+        await runner.cleanup()
+
+
+def _worker(path, host, port, kwargs):
+    asyncio.run(serve(path, host, port, migrate=False, reuse_port=True, **kwargs))
+
+
+def run(path, host, port, workers=1, **kwargs):
+    """Serve the queue from the given number of worker processes, all sharing one port.
+
+    Other arguments are passed to `serve`.
+    """
+
+    if workers <= 1:
+        asyncio.run(serve(path, host, port, **kwargs))
+        return
+
+    # Migrate once, up front, rather than racing the workers to do so
+    JobQueue(path, profile=kwargs.get("profile", "durable")).close()
+
+    procs = [
+        multiprocessing.Process(
+            target=_worker,
+            args=(path, host, port, kwargs),
+            name=f"jobqd-worker-{i}",
+        )
+        for i in range(workers)
+    ]
+    for p in procs:
+        p.start()
+
+    def _stop(signum, frame):
+        # Workers shut down gracefully on SIGTERM
+        for p in procs:
+            if p.is_alive():
+                p.terminate()
+
+    signal.signal(signal.SIGINT, _stop)
+    signal.signal(signal.SIGTERM, _stop)
+
+    for p in procs:
+        p.join()
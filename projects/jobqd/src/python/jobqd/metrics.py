@@ -0,0 +1,103 @@
+"""
+HTTP metrics for jobqd.
+
+The queue reports its own operations (and so SQLite latency, write lock contention, poll hits and
+misses and queue depth) to a `jobq.metrics.Metrics`. This adds what the HTTP layer sees: requests
+by route and status, per-route latency, and requests in flight.
+"""
+
+import threading
+from time import monotonic
+
+from jobq.metrics import (
+    DEFAULT_BUCKETS,
+    format_labels,
+    Histogram,
+    histogram_lines,
+    prometheus_text as jobq_prometheus_text,
+)
+
+
+class HttpMetrics(object):
+    """Thread-safe in-memory request metrics."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self._lock = threading.Lock()
+        self._buckets = buckets
+        self._in_flight = 0
+        self._requests = {}
+        self._latencies = {}
+        self._depth_counted_at = None
+
+    def start(self):
+        """Record the start of a request."""
+
+        with self._lock:
+            self._in_flight += 1
+
+    def finish(self, route, method, status, duration):
+        """Record the end of a request to a route, by pattern rather than path."""
+
+        with self._lock:
+            self._in_flight -= 1
+            key = (route, method, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            if (route, method) not in self._latencies:
+                self._latencies[(route, method)] = Histogram(self._buckets)
+            self._latencies[(route, method)].observe(duration)
+
+    def depth_due(self, interval) -> bool:
+        """Whether the queue depth should be re-counted, being more than interval seconds old.
+
+        Counting scans the queue, so scrapes re-count only periodically.
+        """
+
+        with self._lock:
+            now = monotonic()
+            if (
+                self._depth_counted_at is None
+                or now - self._depth_counted_at > interval
+            ):
+                self._depth_counted_at = now
+                return True
+            return False
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "requests": dict(self._requests),
+                "latency": {k: h.snapshot() for k, h in self._latencies.items()},
+            }
+
+
+def prometheus_text(snapshot: dict, prefix="jobqd") -> str:
+    """Render an HTTP metrics snapshot in the Prometheus text exposition format."""
+
+    lines = [
+        f"# HELP {prefix}_requests_in_flight Requests being served.",
+        f"# TYPE {prefix}_requests_in_flight gauge",
+        f"{prefix}_requests_in_flight {snapshot['in_flight']}",
+        f"# HELP {prefix}_requests_total Requests served, by route and status.",
+        f"# TYPE {prefix}_requests_total counter",
+    ]
+    for (route, method, status), count in sorted(snapshot["requests"].items()):
+        labels = format_labels({"route": route, "method": method, "status": status})
+        lines.append(f"{prefix}_requests_total{{{labels}}} {count}")
+
+    lines += histogram_lines(
+        f"{prefix}_request_latency_seconds",
+        "Request latency, to the first byte of streamed responses",
+        [
+            ({"route": route, "method": method}, h)
+            for (route, method), h in sorted(snapshot["latency"].items())
+        ],
+    )
+
+    return "\n".join(lines) + "\n"
+
+
+def metrics_text(http: HttpMetrics, queue) -> str:
+    """Render both HTTP and queue metrics."""
+
+    return prometheus_text(http.snapshot()) + jobq_prometheus_text(queue.snapshot())
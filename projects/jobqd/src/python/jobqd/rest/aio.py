@@ -0,0 +1,315 @@
+"""An asyncio driver for the jobqd API."""
+
+import asyncio
+import json
+import typing as t
+
+import aiohttp
+from jobqd.rest.api import (
+    Job,
+    RETRY_METHODS,
+    RETRY_STATUSES,
+)
+
+
+class AsyncBatcher(object):
+    """Coalesces calls made within a short window of each other into batch requests.
+
+    As `jobqd.rest.api.Batcher`, but for coroutines on a single event loop.
+    """
+
+    def __init__(self, send, window=0.005, size=100):
+        self._send = send
+        self._window = window
+        self._size = size
+        self._items = []
+        self._timer = None
+
+    async def __call__(self, item):
+        fut = asyncio.get_running_loop().create_future()
+        self._items.append((item, fut))
+        if len(self._items) >= self._size:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(
+                self._window, lambda: asyncio.ensure_future(self.flush())
+            )
+        return await fut
+
+    async def flush(self):
+        """Send the pending batch, if any."""
+
+        batch, self._items = self._items, []
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not batch:
+            return
+
+        try:
+            results = await self._send([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(
+                    f"A batch of {len(batch)} items got {len(results)} results"
+                )
+        except Exception as e:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+        else:
+            for (_, fut), result in zip(batch, results):
+                if not fut.done():
+                    fut.set_result(result)
+        finally:
+            # Should the send be cancelled or interrupted, don't leave anyone awaiting the batch
+            for _, fut in batch:
+                if not fut.done():
+                    fut.cancel()
+
+
+class AsyncJobqClient(object):
+    def __init__(
+        self,
+        url,
+        session=None,
+        pool_size=100,
+        retries=3,
+        backoff=0.1,
+        batch_window=None,
+        batch_size=100,
+    ):
+        """An asyncio client for the jobqd at url.
+
+        Requests are made over a pool of at most pool_size keep-alive connections. Failures to
+        connect, and `RETRY_METHODS` requests answered with one of `RETRY_STATUSES`, are retried
+        up to retries times with exponential backoff. Polls, creates and updates aren't
+        idempotent, so are only retried if they couldn't be sent.
+
+        If batch_window (in seconds) is given, `create` and `event` calls made within that window
+        of each other are sent as a single batch request of up to batch_size items.
+
+        Unless one is given, the session is created on entry or first request, as it must be
+        within a running event loop.
+        """
+
+        self._url = url
+        self._session = session
+        self._pool_size = pool_size
+        self._retries = retries
+        self._backoff = backoff
+
+        self._creates = self._events = None
+        if batch_window:
+            self._creates = AsyncBatcher(self._send_creates, batch_window, batch_size)
+            self._events = AsyncBatcher(self._send_events, batch_window, batch_size)
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self._pool_size),
+                raise_for_status=False,
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    async def __aenter__(self):
+        self._get_session()
+        return self
+
+    async def __aexit__(self, *args, **kwargs):
+        await self.close()
+
+    async def _request(self, method, path, body=None, ok=(200,), params=None):
+        """Make a request, returning its status and JSON body (or None if the status isn't ok).
+
+        Failures to connect are always retried, as the request can't have been sent. Retryable
+        statuses are only retried for `RETRY_METHODS`, as for the threaded client.
+        """
+
+        if params:
+            params = {k: v for k, v in params.items() if v is not None}
+
+        for attempt in range(self._retries + 1):
+            if attempt:
+                await asyncio.sleep(self._backoff * (2 ** (attempt - 1)))
+
+            try:
+                async with self._get_session().request(
+                    method, self._url + path, json=body, params=params
+                ) as r:
+                    if (
+                        r.status in RETRY_STATUSES
+                        and method in RETRY_METHODS
+                        and attempt < self._retries
+                    ):
+                        continue
+                    if r.status not in ok:
+                        r.raise_for_status()
+                    if r.status != 200:
+                        return r.status, None
+                    return r.status, await r.json()
+            except aiohttp.ClientConnectorError:
+                if attempt >= self._retries:
+                    raise
+
+    async def _get(self, path, params) -> dict:
+        _, doc = await self._request("GET", path, params=params)
+        return doc
+
+    async def _post(self, path, body) -> dict:
+        _, doc = await self._request("POST", path, body)
+        return doc
+
+    async def jobs(self, query=None, limit=10) -> t.AsyncIterator[Job]:
+        """Enumerate (up to limit, or with limit=None all) jobs on the queue, following the server's page cursors."""
+
+        cursor = None
+        while limit is None or limit > 0:
+            page = await self._get(
+                "/api/v0/job",
+                {"query": query or "true", "limit": limit, "cursor": cursor},
+            )
+            for job in page.get("jobs"):
+                yield Job.from_json(job)
+
+            cursor = page.get("cursor")
+            if not cursor:
+                break
+            if limit is not None:
+                limit -= len(page.get("jobs"))
+
+    async def _stream(self, path, params) -> t.AsyncIterator[Job]:
+        params = {k: v for k, v in params.items() if v is not None}
+        async with self._get_session().get(self._url + path, params=params) as r:
+            r.raise_for_status()
+            async for line in r.content:
+                line = line.strip()
+                if line:
+                    yield Job.from_json(json.loads(line))
+
+    def stream_jobs(self, query=None, limit=None) -> t.AsyncIterator[Job]:
+        """Enumerate (up to limit) jobs on the queue, as a single streamed NDJSON response."""
+
+        return self._stream(
+            "/api/v0/job",
+            {"query": query or "true", "limit": limit, "format": "ndjson"},
+        )
+
+    def changes(self, query=None, since=None) -> t.AsyncIterator[Job]:
+        """Stream jobs matching the given query as they change, indefinitely."""
+
+        return self._stream(
+            "/api/v0/job/stream",
+            {"query": query or "true", "since": since, "format": "ndjson"},
+        )
+
+    async def poll(self, query, state, wait=None) -> t.Optional[Job]:
+        """Poll the job queue for the first job matching the given query, atomically advancing it to the given state.
+
+        If wait (in seconds) is given, the server holds the request for up to that long waiting for a matching job. Returns None if there was no such job.
+        """
+
+        _, doc = await self._request(
+            "POST",
+            "/api/v0/job/poll",
+            {"query": query, "state": state, "wait": wait},
+            ok=(200, 404),
+        )
+        return Job.maybe_from_json(doc)
+
+    async def poll_many(self, query, state, limit) -> t.List[Job]:
+        """Poll the job queue for up to limit jobs matching the given query, atomically advancing them all to the given state."""
+
+        doc = await self._post(
+            "/api/v0/job/poll_many",
+            {"query": query, "state": state, "limit": limit},
+        )
+        return [Job.from_json(job) for job in doc.get("jobs")]
+
+    async def create(self, payload: object, state=None) -> Job:
+        """Create a new job in the system."""
+
+        if self._creates:
+            return await self._creates({"payload": payload, "state": state})
+
+        return Job.from_json(
+            await self._post("/api/v0/job/create", {"payload": payload, "state": state})
+        )
+
+    async def _send_creates(self, items: list) -> t.List[Job]:
+        doc = await self._post("/api/v0/job/create_many", {"jobs": items})
+        return [Job.from_json(job) for job in doc.get("jobs")]
+
+    async def create_many(
+        self, payloads: t.Iterable[object], state=None
+    ) -> t.List[Job]:
+        """Create many new jobs in the system, all in the given state."""
+
+        return await self._send_creates(
+            [{"payload": p, "state": state} for p in payloads]
+        )
+
+    async def fetch(self, job: Job) -> t.Optional[Job]:
+        """Fetch the current state of a job, or None if it no longer exists."""
+
+        _, doc = await self._request("GET", f"/api/v0/job/{job.id}", ok=(200, 404))
+        return Job.maybe_from_json(doc)
+
+    async def advance(self, job: Job, state: object) -> t.Optional[Job]:
+        """Attempt to advance a job to a subsequent state, returning None on conflict."""
+
+        _, doc = await self._request(
+            "POST",
+            f"/api/v0/job/{job.id}/state",
+            {"old": job.state, "new": state},
+            ok=(200, 409),
+        )
+        return Job.maybe_from_json(doc)
+
+    async def advance_many(
+        self, advances: t.Iterable[t.Tuple[Job, object]]
+    ) -> t.List[t.Optional[Job]]:
+        """Attempt to advance many jobs, each to its paired state, returning None for each conflict."""
+
+        doc = await self._post(
+            "/api/v0/job/state_many",
+            {
+                "updates": [
+                    {"id": job.id, "old": job.state, "new": state}
+                    for job, state in advances
+                ]
+            },
+        )
+        return [Job.maybe_from_json(job) for job in doc.get("jobs")]
+
+    async def event(self, job: Job, event: object) -> t.Optional[Job]:
+        """Attempt to record an event against a job, returning None if it no longer exists."""
+
+        if self._events:
+            return await self._events({"id": job.id, "event": event})
+
+        _, doc = await self._request(
+            "POST", f"/api/v0/job/{job.id}/event", event, ok=(200, 404)
+        )
+        return Job.maybe_from_json(doc)
+
+    async def _send_events(self, items: list) -> t.List[t.Optional[Job]]:
+        doc = await self._post("/api/v0/job/event_many", {"events": items})
+        return [Job.maybe_from_json(job) for job in doc.get("jobs")]
+
+    async def event_many(
+        self, events: t.Iterable[t.Tuple[Job, object]]
+    ) -> t.List[t.Optional[Job]]:
+        """Record many events, each against its paired job, returning None for each missing job."""
+
+        return await self._send_events(
+            [{"id": job.id, "event": event} for job, event in events]
+        )
+
+    async def delete(self, job: Job) -> None:
+        """Delete a remote job."""
+
+        await self._request("DELETE", f"/api/v0/job/{job.id}")
@@ -1,9 +1,14 @@
 """A quick and dirty Python driver for the jobqd API."""
 
+from concurrent.futures import Future
 from datetime import datetime
+import json
+import threading
 import typing as t
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
 class Job(t.NamedTuple):
@@ -23,66 +28,307 @@ class Job(t.NamedTuple):
             modified=datetime.fromtimestamp(obj["modified"]),
         )
 
+    @classmethod
+    def maybe_from_json(cls, obj) -> t.Optional["Job"]:
+        return cls.from_json(obj) if obj else None
+
+
+# Responses worth retrying; the server was briefly unavailable or overloaded.
+RETRY_STATUSES = (429, 502, 503, 504)
+
+# Requests safe to retry once sent. Reads are GETs, while polls, creates and updates are POSTs,
+# which a retry could apply twice.
+RETRY_METHODS = ("GET", "DELETE")
+
+
+class Batcher(object):
+    """Coalesces calls made within a short window of each other into batch requests.
+
+    Each call adds an item to the pending batch, and blocks until the batch has been sent. A batch
+    is sent once it holds size items, or window seconds after its first item was added. send must
+    return one result per item, in order; otherwise every call in the batch fails.
+    """
+
+    def __init__(self, send: t.Callable[[list], list], window=0.005, size=100):
+        self._send = send
+        self._window = window
+        self._size = size
+        self._lock = threading.Lock()
+        self._items = []
+        self._timer = None
+
+    def __call__(self, item):
+        fut = Future()
+        with self._lock:
+            self._items.append((item, fut))
+            if len(self._items) >= self._size:
+                batch = self._take()
+            else:
+                batch = None
+                if self._timer is None:
+                    self._timer = threading.Timer(self._window, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+
+        if batch:
+            self._run(batch)
+        return fut.result()
+
+    def _take(self) -> list:
+        batch, self._items = self._items, []
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    def _run(self, batch):
+        try:
+            results = self._send([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(
+                    f"A batch of {len(batch)} items got {len(results)} results"
+                )
+        except BaseException as e:
+            for _, fut in batch:
+                fut.set_exception(e)
+        else:
+            for (_, fut), result in zip(batch, results):
+                fut.set_result(result)
+
+    def flush(self):
+        """Send the pending batch, if any."""
+
+        with self._lock:
+            batch = self._take()
+        if batch:
+            self._run(batch)
+
 
 class JobqClient(object):
-    def __init__(self, url, session=None):
+    def __init__(
+        self,
+        url,
+        session=None,
+        pool_size=10,
+        retries=3,
+        backoff=0.1,
+        batch_window=None,
+        batch_size=100,
+    ):
+        """A client for the jobqd at url, safe to share between threads.
+
+        Requests are made over a pool of at most pool_size keep-alive connections. Failed
+        connections, and `RETRY_METHODS` requests answered with one of `RETRY_STATUSES`, are
+        retried up to retries times with exponential backoff. Polls, creates and updates aren't
+        idempotent, so are only retried if they couldn't be sent.
+
+        If batch_window (in seconds) is given, `create` and `event` calls made by concurrent
+        threads within that window of each other are sent as a single batch request of up to
+        batch_size items.
+        """
+
         self._url = url
-        self._session = session or requests.Session()
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=pool_size,
+                pool_block=True,
+                max_retries=Retry(
+                    total=retries,
+                    backoff_factor=backoff,
+                    status_forcelist=RETRY_STATUSES,
+                    allowed_methods=RETRY_METHODS,
+                    raise_on_status=False,
+                ),
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self._session = session
+
+        self._creates = self._events = None
+        if batch_window:
+            self._creates = Batcher(self._send_creates, batch_window, batch_size)
+            self._events = Batcher(self._send_events, batch_window, batch_size)
+
+    def close(self):
+        self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+    def _get(self, path, params) -> dict:
+        r = self._session.get(self._url + path, params=params)
+        r.raise_for_status()
+        return r.json()
+
+    def _post(self, path, body) -> dict:
+        r = self._session.post(self._url + path, json=body)
+        r.raise_for_status()
+        return r.json()
 
     def jobs(self, query=None, limit=10) -> t.Iterable[Job]:
-        """Enumerate jobs on the queue."""
+        """Enumerate (up to limit, or with limit=None all) jobs on the queue, following the server's page cursors."""
 
-        for job in (
-            self._session.post(
-                self._url + "/api/v0/job", json={"query": query or [], "limit": limit}
+        cursor = None
+        while limit is None or limit > 0:
+            page = self._get(
+                "/api/v0/job",
+                {"query": query or "true", "limit": limit, "cursor": cursor},
             )
-            .json()
-            .get("jobs")
-        ):
-            yield Job.from_json(job)
+            for job in page.get("jobs"):
+                yield Job.from_json(job)
 
-    def poll(self, query, state) -> Job:
-        """Poll the job queue for the first job matching the given query, atomically advancing it to the given state and returning the advanced Job."""
+            cursor = page.get("cursor")
+            if not cursor:
+                break
+            if limit is not None:
+                limit -= len(page.get("jobs"))
 
-        return Job.from_json(
-            self._session.post(
-                self._url + "/api/v0/job/poll", json={"query": query, "state": state}
-            ).json()
+    def stream_jobs(self, query=None, limit=None) -> t.Iterator[Job]:
+        """Enumerate (up to limit) jobs on the queue, as a single streamed NDJSON response."""
+
+        with self._session.get(
+            self._url + "/api/v0/job",
+            params={"query": query or "true", "limit": limit, "format": "ndjson"},
+            stream=True,
+        ) as r:
+            r.raise_for_status()
+            for line in r.iter_lines():
+                if line:
+                    yield Job.from_json(json.loads(line))
+
+    def poll(self, query, state, wait=None) -> t.Optional[Job]:
+        """Poll the job queue for the first job matching the given query, atomically advancing it to the given state and returning the advanced Job.
+
+        If wait (in seconds) is given, the server holds the request for up to that long waiting for a matching job. Returns None if there was no such job.
+        """
+
+        r = self._session.post(
+            self._url + "/api/v0/job/poll",
+            json={"query": query, "state": state, "wait": wait},
         )
+        if r.status_code == 404:
+            return None
+        r.raise_for_status()
+        return Job.from_json(r.json())
+
+    def changes(self, query=None, since=None) -> t.Iterator[Job]:
+        """Stream jobs matching the given query as they change, indefinitely."""
+
+        with self._session.get(
+            self._url + "/api/v0/job/stream",
+            params={"query": query or "true", "since": since, "format": "ndjson"},
+            stream=True,
+        ) as r:
+            r.raise_for_status()
+            for line in r.iter_lines():
+                if line:
+                    yield Job.from_json(json.loads(line))
+
+    def poll_many(self, query, state, limit) -> t.List[Job]:
+        """Poll the job queue for up to limit jobs matching the given query, atomically advancing them all to the given state."""
+
+        return [
+            Job.from_json(job)
+            for job in self._post(
+                "/api/v0/job/poll_many",
+                {"query": query, "state": state, "limit": limit},
+            ).get("jobs")
+        ]
 
     def create(self, payload: object, state=None) -> Job:
         """Create a new job in the system."""
 
+        if self._creates:
+            return self._creates({"payload": payload, "state": state})
+
         return Job.from_json(
-            self._session.post(
-                self._url + "/api/v0/job/create",
-                json={"payload": payload, "state": state},
-            ).json()
+            self._post("/api/v0/job/create", {"payload": payload, "state": state})
         )
 
-    def fetch(self, job: Job) -> Job:
-        """Fetch the current state of a job."""
+    def _send_creates(self, items: list) -> t.List[Job]:
+        return [
+            Job.from_json(job)
+            for job in self._post("/api/v0/job/create_many", {"jobs": items}).get(
+                "jobs"
+            )
+        ]
 
-        return Job.from_json(
-            self._session.get(self._url + "/api/v0/job/" + job.id).json()
-        )
+    def create_many(self, payloads: t.Iterable[object], state=None) -> t.List[Job]:
+        """Create many new jobs in the system, all in the given state."""
 
-    def advance(self, job: Job, state: object) -> Job:
-        """Attempt to advance a job to a subsequent state."""
+        return self._send_creates([{"payload": p, "state": state} for p in payloads])
 
-        return Job.from_json(
-            self._session.post(
-                job.url + "/state", json={"old": job.state, "new": state}
-            ).json()
+    def fetch(self, job: Job) -> t.Optional[Job]:
+        """Fetch the current state of a job, or None if it no longer exists."""
+
+        r = self._session.get(self._url + f"/api/v0/job/{job.id}")
+        if r.status_code == 404:
+            return None
+        r.raise_for_status()
+        return Job.from_json(r.json())
+
+    def advance(self, job: Job, state: object) -> t.Optional[Job]:
+        """Attempt to advance a job to a subsequent state, returning None on conflict."""
+
+        r = self._session.post(
+            self._url + f"/api/v0/job/{job.id}/state",
+            json={"old": job.state, "new": state},
         )
+        if r.status_code == 409:
+            return None
+        r.raise_for_status()
+        return Job.from_json(r.json())
 
-    def event(self, job: Job, event: object) -> Job:
-        """Attempt to record an event against a job."""
+    def advance_many(
+        self, advances: t.Iterable[t.Tuple[Job, object]]
+    ) -> t.List[t.Optional[Job]]:
+        """Attempt to advance many jobs, each to its paired state, returning None for each conflict."""
 
-        return Job.from_json(
-            self._session.post(
-                self._url + f"/api/v0/job/{job.id}/event", json=event
-            ).json()
+        return [
+            Job.maybe_from_json(job)
+            for job in self._post(
+                "/api/v0/job/state_many",
+                {
+                    "updates": [
+                        {"id": job.id, "old": job.state, "new": state}
+                        for job, state in advances
+                    ]
+                },
+            ).get("jobs")
+        ]
+
+    def event(self, job: Job, event: object) -> t.Optional[Job]:
+        """Attempt to record an event against a job, returning None if it no longer exists."""
+
+        if self._events:
+            return self._events({"id": job.id, "event": event})
+
+        r = self._session.post(self._url + f"/api/v0/job/{job.id}/event", json=event)
+        if r.status_code == 404:
+            return None
+        r.raise_for_status()
+        return Job.from_json(r.json())
+
+    def _send_events(self, items: list) -> t.List[t.Optional[Job]]:
+        return [
+            Job.maybe_from_json(job)
+            for job in self._post("/api/v0/job/event_many", {"events": items}).get(
+                "jobs"
+            )
+        ]
+
+    def event_many(
+        self, events: t.Iterable[t.Tuple[Job, object]]
+    ) -> t.List[t.Optional[Job]]:
+        """Record many events, each against its paired job, returning None for each missing job."""
+
+        return self._send_events(
+            [{"id": job.id, "event": event} for job, event in events]
         )
 
     def delete(self, job: Job) -> None:
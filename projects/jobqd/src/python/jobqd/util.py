@@ -0,0 +1,95 @@
+"""
+Helpers shared by the jobqd servers.
+"""
+
+import base64
+import binascii
+import json
+from typing import Optional as Maybe, Tuple
+
+from jobq import Job
+
+
+def job_as_json(job: Job) -> dict:
+    return {
+        "id": job.id,
+        "payload": job.payload,
+        "events": job.events,
+        "state": job.state,
+        "modified": int(job.modified.timestamp()),
+    }
+
+
+def encode_cursor(job: Job) -> str:
+    """An opaque cursor, resuming a listing after the given job."""
+
+    raw = f"{int(job.modified.timestamp())}:{job.id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("utf-8")
+
+
+def decode_cursor(cursor: Maybe[str]) -> Maybe[Tuple[int, int]]:
+    """Decode a cursor to the `(modified, id)` keyset it resumes after."""
+
+    if not cursor:
+        return None
+
+    try:
+        modified, id = base64.urlsafe_b64decode(cursor.encode("utf-8")).split(b":")
+        return int(modified), int(id)
+    except (binascii.Error, ValueError):
+        raise ValueError(f"Bad cursor {cursor!r}")
+
+
+def wants_ndjson(accept: str, format=None) -> bool:
+    """Whether a listing should be streamed as NDJSON rather than returned as a page."""
+
+    if format:
+        return format == "ndjson"
+    return "application/x-ndjson" in (accept or "")
+
+
+def wants_sse(accept: str, format=None) -> bool:
+    """Whether a stream should be server-sent events rather than NDJSON."""
+
+    if format:
+        return format == "sse"
+    return "text/event-stream" in (accept or "")
+
+
+def stream_line(job: Job, sse=False) -> str:
+    """Format a job as an NDJSON line, or as a server-sent event."""
+
+    doc = json.dumps(job_as_json(job))
+    if sse:
+        return f"event: job\ndata: {doc}\n\n"
+    return doc + "\n"
+
+
+def keepalive_line(sse=False) -> str:
+    """A line which stream clients ignore, to keep idle connections open."""
+
+    return ": keepalive\n\n" if sse else "\n"
+
+
+def create_many_args(blob: dict) -> list:
+    """Translate a create_many request body to `JobQueue.create_many` arguments."""
+
+    return [
+        {"job": item["payload"], "new_state": item.get("state", None)}
+        for item in blob["jobs"]
+    ]
+
+
+def event_many_args(blob: dict) -> list:
+    """Translate an event_many request body to `JobQueue.append_event_many` arguments."""
+
+    return [{"job_id": item["id"], "event": item["event"]} for item in blob["events"]]
+
+
+def state_many_args(blob: dict) -> list:
+    """Translate a state_many request body to `JobQueue.cas_state_many` arguments."""
+
+    return [
+        {"job_id": item["id"], "old_state": item["old"], "new_state": item["new"]}
+        for item in blob["updates"]
+    ]
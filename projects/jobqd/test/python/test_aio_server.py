@@ -0,0 +1,290 @@
+"""
+Tests covering the asyncio (aiohttp) jobqd server
+"""
+
+import asyncio
+import json
+import re
+from time import monotonic
+
+from aiohttp.test_utils import (
+    TestClient,
+    TestServer,
+)
+from jobq.aio import AsyncJobQueue
+from jobq.metrics import Metrics
+from jobqd.aio import make_app
+import pytest
+
+
+@pytest.fixture
+def serve(tmp_path):
+    """Run a test against a client of a fresh server."""
+
+    def _serve(test, **kwargs):
+        async def _run():
+            metrics = Metrics()
+            q = AsyncJobQueue(str(tmp_path / "jobq.sqlite3"), metrics=metrics)
+            app = make_app(q, metrics, **kwargs)
+            async with TestClient(TestServer(app)) as client:
+                await test(client)
+
+        asyncio.run(_run())
+
+    return _serve
+
+
+async def create(client, payload, state=None):
+    r = await client.post(
+        "/api/v0/job/create", json={"payload": payload, "state": state}
+    )
+    assert r.status == 200
+    return await r.json()
+
+
+def test_create_get(serve):
+    """Assert that a created job can be fetched by ID, and that missing jobs are 404s."""
+
+    async def test(client):
+        job = await create(client, {"foo": "bar"}, ["CREATED"])
+        assert job["payload"] == {"foo": "bar"}
+
+        r = await client.get(f"/api/v0/job/{job['id']}")
+        assert r.status == 200
+        assert await r.json() == job
+
+        r = await client.delete(f"/api/v0/job/{job['id']}")
+        assert r.status == 200
+        r = await client.get(f"/api/v0/job/{job['id']}")
+        assert r.status == 404
+
+    serve(test)
+
+
+def test_cas_conflict(serve):
+    """Assert that a CAS from the wrong state is a 409, and from the right state succeeds."""
+
+    async def test(client):
+        job = await create(client, "payload", ["CREATED"])
+        url = f"/api/v0/job/{job['id']}/state"
+
+        r = await client.post(url, json={"old": ["RUNNING"], "new": ["DONE"]})
+        assert r.status == 409
+
+        r = await client.post(url, json={"old": ["CREATED"], "new": ["DONE"]})
+        assert r.status == 200
+        assert (await r.json())["state"] == ["DONE"]
+
+    serve(test)
+
+
+def test_poll(serve):
+    """Assert that polls advance matching jobs, and 404 when there are none."""
+
+    async def test(client):
+        job = await create(client, "payload", ["CREATED"])
+        body = {"query": "j.state = json_array('CREATED')", "state": ["POLLED"]}
+
+        r = await client.post("/api/v0/job/poll", json=body)
+        assert r.status == 200
+        assert (await r.json())["id"] == job["id"]
+
+        r = await client.post("/api/v0/job/poll", json=body)
+        assert r.status == 404
+
+    serve(test)
+
+
+async def _pages(client, **params):
+    """Follow the cursors through every page of a listing, returning the pages' payloads."""
+
+    pages = []
+    while True:
+        r = await client.get("/api/v0/job", params=params)
+        assert r.status == 200
+        page = await r.json()
+        pages.append([j["payload"] for j in page["jobs"]])
+        if not page["cursor"]:
+            return pages
+        params["cursor"] = page["cursor"]
+
+
+def test_paging(serve):
+    """Assert that listings page through jobs by cursor, or stream them all as NDJSON."""
+
+    async def test(client):
+        for i in range(7):
+            await create(client, i)
+
+        assert await _pages(client) == [[0, 1, 2], [3, 4, 5], [6]]
+        assert await _pages(client, limit=2) == [[0, 1], [2, 3], [4, 5], [6]]
+        assert await _pages(client, limit=10) == [[0, 1, 2], [3, 4, 5], [6]]
+
+        r = await client.get("/api/v0/job", params={"format": "ndjson"})
+        assert r.content_type == "application/x-ndjson"
+        lines = (await r.text()).splitlines()
+        assert [json.loads(line)["payload"] for line in lines] == list(range(7))
+
+        r = await client.get("/api/v0/job", params={"cursor": "bogus"})
+        assert r.status == 400
+
+    serve(test, page_size=3)
+
+
+def test_batches(serve):
+    """Assert that batch endpoints apply each item in order, with null for conflicts and misses."""
+
+    async def test(client):
+        r = await client.post(
+            "/api/v0/job/create_many",
+            json={"jobs": [{"payload": i, "state": ["CREATED"]} for i in range(3)]},
+        )
+        assert r.status == 200
+        jobs = (await r.json())["jobs"]
+        assert [j["payload"] for j in jobs] == [0, 1, 2]
+
+        r = await client.post(
+            "/api/v0/job/poll_many",
+            json={
+                "query": "j.state = json_array('CREATED')",
+                "state": ["POLLED"],
+                "limit": 2,
+            },
+        )
+        assert r.status == 200
+        polled = (await r.json())["jobs"]
+        assert len(polled) == 2
+
+        updates = [{"id": j["id"], "old": ["POLLED"], "new": ["DONE"]} for j in jobs]
+        r = await client.post("/api/v0/job/state_many", json={"updates": updates})
+        assert r.status == 200
+        states = [j and j["state"] for j in (await r.json())["jobs"]]
+        assert sorted(states, key=bool) == [None, ["DONE"], ["DONE"]]
+
+        events = [{"id": jobs[0]["id"], "event": "foo"}, {"id": -1, "event": "bar"}]
+        r = await client.post("/api/v0/job/event_many", json={"events": events})
+        assert r.status == 200
+        appended, missing = (await r.json())["jobs"]
+        assert appended["events"][-1][1]["event"] == "foo"
+        assert missing is None
+
+    serve(test)
+
+
+async def _create_later(client, payload, delay=0.2):
+    await asyncio.sleep(delay)
+    return await create(client, payload, ["CREATED"])
+
+
+def test_poll_wait(serve):
+    """Assert that a waiting poll is woken by a job created concurrently."""
+
+    async def test(client):
+        body = {"query": "j.state = json_array('CREATED')", "state": ["POLLED"]}
+        start = monotonic()
+        r, job = await asyncio.gather(
+            client.post("/api/v0/job/poll", json=dict(body, wait=4.0)),
+            _create_later(client, "payload"),
+        )
+        assert r.status == 200
+        assert (await r.json())["id"] == job["id"]
+        # Well before the 1s re-check, so the create must have woken the poll
+        assert monotonic() - start < 0.9
+
+    serve(test)
+
+
+def test_stream(serve):
+    """Assert that the stream sends matching jobs, then wakes to send jobs as they change."""
+
+    async def test(client):
+        await create(client, "first", ["CREATED"])
+        r = await client.get("/api/v0/job/stream", params={"format": "ndjson"})
+        assert r.content_type == "application/x-ndjson"
+        assert json.loads(await r.content.readline())["payload"] == "first"
+
+        start = monotonic()
+        line, _ = await asyncio.gather(
+            r.content.readline(), _create_later(client, "second")
+        )
+        assert json.loads(line)["payload"] == "second"
+        assert monotonic() - start < 2.0
+        r.close()
+
+    serve(test, max_wait=1.0)
+
+
+def test_stream_since(serve):
+    """Assert that a malformed since is a 400, not an error."""
+
+    async def test(client):
+        r = await client.get("/api/v0/job/stream", params={"since": "yesterday"})
+        assert r.status == 400
+        r = await client.post("/api/v0/job/stream", json={"since": [1]})
+        assert r.status == 400
+
+    serve(test)
+
+
+def check_metrics_text(text):
+    """Assert that text is well-formed Prometheus exposition, returning its samples by name."""
+
+    samples, types = {}, {}
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split(" ")
+            types[name] = kind
+        elif line and not line.startswith("#"):
+            label = r'[a-z_]+="(?:[^"\\]|\\.)*"'
+            match = re.fullmatch(rf"([a-z_]+)(\{{(?:{label},?)*\}})? (\S+)", line)
+            assert match, line
+            name = match.group(1)
+            samples.setdefault(name, []).append(float(match.group(3)))
+            family = re.sub("_(bucket|sum|count)$", "", name)
+            assert name in types or family in types, line
+    return samples
+
+
+def test_metrics(serve):
+    """Assert that /metrics reports requests and queue operations in the Prometheus text format."""
+
+    async def test(client):
+        await create(client, "payload", ["CREATED"])
+        await client.post(
+            "/api/v0/job/poll", json={"query": "false", "state": ["POLLED"]}
+        )
+
+        r = await client.get("/metrics")
+        assert r.status == 200
+        assert r.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+
+        text = await r.text()
+        assert "# TYPE jobqd_requests_total counter" in text
+        assert "# TYPE jobqd_request_latency_seconds histogram" in text
+        assert (
+            'jobqd_requests_total{route="/api/v0/job/poll",method="POST",status="404"} 1'
+            in text
+        )
+        assert 'jobq_operations_total{op="poll",outcome="miss"} 1' in text
+        assert 'jobq_depth{state="[\\"CREATED\\"]"} 1' in text
+        assert check_metrics_text(text)["jobqd_requests_in_flight"] == [1.0]
+
+    serve(test, depth_interval=0.0)
+
+
+def test_metrics_stream(serve):
+    """Assert that open streams are timed to their first byte, as by the Flask server."""
+
+    async def test(client):
+        r = await client.get("/api/v0/job/stream", params={"format": "ndjson"})
+        assert r.status == 200
+
+        text = await (await client.get("/metrics")).text()
+        assert (
+            'jobqd_requests_total{route="/api/v0/job/stream",method="GET",status="200"} 1'
+            in text
+        )
+        assert check_metrics_text(text)["jobqd_requests_in_flight"] == [1.0]
+        r.close()
+
+    serve(test, max_wait=1.0)
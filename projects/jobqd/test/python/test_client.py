@@ -0,0 +1,206 @@
+"""
+Tests covering the jobqd clients, and their batching of calls
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from jobq.aio import AsyncJobQueue
+from jobq.metrics import Metrics
+from jobqd.aio import make_app
+from jobqd.rest.aio import (
+    AsyncBatcher,
+    AsyncJobqClient,
+)
+from jobqd.rest.api import Batcher, JobqClient
+import pytest
+from requests import HTTPError
+
+
+def test_batcher_size():
+    """Assert that concurrent calls are sent as one batch once it is full."""
+
+    batches = []
+
+    def send(items):
+        batches.append(items)
+        return [i * 2 for i in items]
+
+    batcher = Batcher(send, window=10.0, size=3)
+    with ThreadPoolExecutor(3) as pool:
+        assert list(pool.map(batcher, [1, 2, 3])) == [2, 4, 6]
+    assert len(batches) == 1 and sorted(batches[0]) == [1, 2, 3]
+
+
+def test_batcher_window():
+    """Assert that a batch short of its size is sent once the window lapses."""
+
+    batches = []
+
+    def send(items):
+        batches.append(items)
+        return items
+
+    batcher = Batcher(send, window=0.01, size=100)
+    assert batcher("foo") == "foo"
+    assert batches == [["foo"]]
+
+
+def test_batcher_error():
+    """Assert that a failed send raises in every caller whose item was in the batch."""
+
+    def send(items):
+        raise ValueError("oops")
+
+    batcher = Batcher(send, window=10.0, size=2)
+    with ThreadPoolExecutor(2) as pool:
+        futures = [pool.submit(batcher, i) for i in range(2)]
+        for f in futures:
+            with pytest.raises(ValueError):
+                f.result(timeout=1.0)
+
+
+def test_batcher_short():
+    """Assert that a batch answered with too few results fails every call, rather than hanging."""
+
+    batcher = Batcher(lambda items: items[:1], window=10.0, size=2)
+    with ThreadPoolExecutor(2) as pool:
+        futures = [pool.submit(batcher, i) for i in range(2)]
+        for f in futures:
+            with pytest.raises(RuntimeError):
+                f.result(timeout=1.0)
+
+
+def test_async_batcher():
+    """Assert that calls within the window are sent as one batch, and errors fan out."""
+
+    async def run():
+        batches = []
+
+        async def send(items):
+            batches.append(items)
+            return [i * 2 for i in items]
+
+        batcher = AsyncBatcher(send, window=0.01, size=100)
+        assert await asyncio.gather(*[batcher(i) for i in range(5)]) == [0, 2, 4, 6, 8]
+        assert batches == [[0, 1, 2, 3, 4]]
+
+        async def fail(items):
+            raise ValueError("oops")
+
+        batcher = AsyncBatcher(fail, window=0.01, size=100)
+        results = await asyncio.gather(
+            *[batcher(i) for i in range(3)], return_exceptions=True
+        )
+        assert all(isinstance(r, ValueError) for r in results)
+
+        async def short(items):
+            return items[:1]
+
+        batcher = AsyncBatcher(short, window=0.01, size=100)
+        results = await asyncio.gather(
+            *[batcher(i) for i in range(3)], return_exceptions=True
+        )
+        assert all(isinstance(r, RuntimeError) for r in results)
+
+    asyncio.run(run())
+
+
+def test_async_batcher_cancelled():
+    """Assert that cancelling a batch's send cancels every call in it, rather than hanging."""
+
+    async def run():
+        sending = asyncio.Event()
+
+        async def send(items):
+            sending.set()
+            await asyncio.sleep(60)
+
+        batcher = AsyncBatcher(send, window=10.0, size=2)
+        first = asyncio.ensure_future(batcher(1))
+        await asyncio.sleep(0)
+        # The second call fills the batch, so sends it
+        second = asyncio.ensure_future(batcher(2))
+        await sending.wait()
+
+        second.cancel()
+        for task in [first, second]:
+            with pytest.raises(asyncio.CancelledError):
+                await asyncio.wait_for(task, 1.0)
+
+    asyncio.run(run())
+
+
+def test_async_client_lazy():
+    """Assert that the asyncio client can be created outside of an event loop."""
+
+    client = AsyncJobqClient("http://localhost")
+    assert client._session is None
+    asyncio.run(client.close())
+
+
+def test_async_client(tmp_path):
+    """Assert that the asyncio client round-trips against the asyncio server."""
+
+    async def run():
+        metrics = Metrics()
+        q = AsyncJobQueue(str(tmp_path / "jobq.sqlite3"), metrics=metrics)
+        async with TestServer(make_app(q, metrics)) as server:
+            url = str(server.make_url("")).rstrip("/")
+            async with AsyncJobqClient(url, batch_window=0.01) as client:
+                job = await client.create("payload", ["CREATED"])
+                assert (await client.fetch(job)).payload == "payload"
+                assert await client.advance(job, ["DONE"])
+                assert await client.advance(job, ["DONE"]) is None
+
+                # Batched calls
+                jobs = await asyncio.gather(*[client.create(i) for i in range(5)])
+                assert [j.payload for j in jobs] == list(range(5))
+                events = await asyncio.gather(*[client.event(j, "foo") for j in jobs])
+                assert all(j.events[-1][1]["event"] == "foo" for j in events)
+
+                await client.delete(job)
+                assert await client.fetch(job) is None
+                assert await client.event(job, "foo") is None
+
+    asyncio.run(run())
+
+
+def test_client_retries():
+    """Assert that both clients retry reads answered with a 503, but not POSTs."""
+
+    requests = []
+
+    async def unavailable(request):
+        requests.append(request.method)
+        if len(requests) % 2:
+            return web.Response(status=503)
+        return web.json_response({"jobs": [], "cursor": None})
+
+    async def run():
+        app = web.Application()
+        app.router.add_route("*", "/api/v0/job", unavailable)
+        app.router.add_route("*", "/api/v0/job/create", unavailable)
+        async with TestServer(app) as server:
+            url = str(server.make_url("")).rstrip("/")
+            async with AsyncJobqClient(url, backoff=0.0) as client:
+                assert [j async for j in client.jobs()] == []
+                assert requests == ["GET", "GET"]
+                with pytest.raises(aiohttp.ClientResponseError):
+                    await client.create("payload")
+                assert requests == ["GET", "GET", "POST"]
+
+            def sync():
+                with JobqClient(url, backoff=0.0) as client:
+                    assert list(client.jobs()) == []
+                    with pytest.raises(HTTPError):
+                        client.create("payload")
+
+            requests.clear()
+            await asyncio.get_running_loop().run_in_executor(None, sync)
+            assert requests == ["GET", "GET", "POST"]
+
+    asyncio.run(run())
@@ -0,0 +1,318 @@
+"""
+Tests covering the Flask jobqd server
+"""
+
+import json
+import queue
+import re
+import threading
+from time import monotonic
+
+from jobq.metrics import Metrics
+from jobqd.__main__ import app, QueuePool
+from jobqd.metrics import HttpMetrics
+import pytest
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = QueuePool(str(tmp_path / "jobq.sqlite3"), size=2)
+    yield pool
+    pool.close()
+
+
+@pytest.fixture
+def client(tmp_path):
+    metrics = Metrics()
+    app.config.update(
+        {
+            "metrics": metrics,
+            "http_metrics": HttpMetrics(),
+            "max_wait": 5.0,
+            "page_size": 100,
+            "depth_interval": 0.0,
+            "pool": QueuePool(str(tmp_path / "jobq.sqlite3"), size=4, metrics=metrics),
+        }
+    )
+    yield app.test_client()
+    app.config["pool"].close()
+
+
+def create(client, payload, state=None):
+    r = client.post("/api/v0/job/create", json={"payload": payload, "state": state})
+    assert r.status_code == 200
+    return r.get_json()
+
+
+def test_pool_size(pool):
+    """Assert that the pool opens connections as needed, up to its size, and reuses them."""
+
+    q1 = pool.acquire()
+    q2 = pool.acquire()
+    assert q1 is not q2
+    with pytest.raises(queue.Empty):
+        pool.acquire(timeout=0.01)
+
+    pool.release(q2)
+    assert pool.acquire() is q2
+    pool.release(q1)
+    pool.release(q2)
+
+
+def test_pool_scan(pool):
+    """Assert that scans page through all matching jobs, in order."""
+
+    with pool.connection() as q:
+        jobs = [q.create(i, ["CREATED"]) for i in range(7)]
+
+    assert [j.id for j in pool.scan("true", page_size=3)] == [j.id for j in jobs]
+    assert [j.id for j in pool.scan("true", limit=4, page_size=3)] == [
+        j.id for j in jobs[:4]
+    ]
+
+
+def test_create_get(client):
+    """Assert that a created job can be fetched by ID."""
+
+    job = create(client, {"foo": "bar"}, ["CREATED"])
+    assert job["payload"] == {"foo": "bar"}
+    assert job["state"] == ["CREATED"]
+
+    r = client.get(f"/api/v0/job/{job['id']}")
+    assert r.status_code == 200
+    assert r.get_json() == job
+
+
+def test_get_missing(client):
+    """Assert that fetching a job which doesn't exist is a 404, not an error."""
+
+    assert client.get("/api/v0/job/1").status_code == 404
+
+    job = create(client, "payload")
+    assert client.delete(f"/api/v0/job/{job['id']}").status_code == 200
+    assert client.get(f"/api/v0/job/{job['id']}").status_code == 404
+
+
+def test_cas_conflict(client):
+    """Assert that a CAS from the wrong state is a 409, and from the right state succeeds."""
+
+    job = create(client, "payload", ["CREATED"])
+    url = f"/api/v0/job/{job['id']}/state"
+
+    r = client.post(url, json={"old": ["RUNNING"], "new": ["DONE"]})
+    assert r.status_code == 409
+
+    r = client.post(url, json={"old": ["CREATED"], "new": ["DONE"]})
+    assert r.status_code == 200
+    assert r.get_json()["state"] == ["DONE"]
+
+
+def test_event_missing(client):
+    """Assert that appending an event to a job which doesn't exist is a 404."""
+
+    assert client.post("/api/v0/job/1/event", json={"foo": "bar"}).status_code == 404
+
+    job = create(client, "payload")
+    r = client.post(f"/api/v0/job/{job['id']}/event", json={"foo": "bar"})
+    assert r.status_code == 200
+    assert r.get_json()["events"][-1][1]["event"] == {"foo": "bar"}
+
+
+def _pages(client, **params):
+    """Follow the cursors through every page of a listing, returning the pages' payloads."""
+
+    pages = []
+    while True:
+        r = client.get("/api/v0/job", query_string=params)
+        assert r.status_code == 200
+        page = r.get_json()
+        pages.append([j["payload"] for j in page["jobs"]])
+        if not page["cursor"]:
+            return pages
+        params["cursor"] = page["cursor"]
+
+
+def test_paging(client):
+    """Assert that listings page through jobs by cursor, at most the page size at a time."""
+
+    client.application.config["page_size"] = 3
+    for i in range(7):
+        create(client, i)
+
+    assert _pages(client) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert _pages(client, limit=2) == [[0, 1], [2, 3], [4, 5], [6]]
+    assert _pages(client, limit=10) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert _pages(client, query="j.payload >= 5") == [[5, 6]]
+
+    r = client.post("/api/v0/job", json={"limit": 2})
+    assert [j["payload"] for j in r.get_json()["jobs"]] == [0, 1]
+
+    assert client.get("/api/v0/job?cursor=bogus").status_code == 400
+
+
+def test_paging_ndjson(client):
+    """Assert that NDJSON listings stream every job, regardless of the page size."""
+
+    client.application.config["page_size"] = 3
+    for i in range(7):
+        create(client, i)
+
+    r = client.get("/api/v0/job?format=ndjson")
+    assert r.mimetype == "application/x-ndjson"
+    assert [json.loads(line)["payload"] for line in r.data.splitlines()] == list(range(7))
+
+    r = client.get("/api/v0/job?limit=4", headers={"Accept": "application/x-ndjson"})
+    assert [json.loads(line)["payload"] for line in r.data.splitlines()] == list(range(4))
+
+
+def test_batches(client):
+    """Assert that batch endpoints apply each item in order, with null for conflicts and misses."""
+
+    r = client.post(
+        "/api/v0/job/create_many",
+        json={"jobs": [{"payload": i, "state": ["CREATED"]} for i in range(3)]},
+    )
+    assert r.status_code == 200
+    jobs = r.get_json()["jobs"]
+    assert [j["payload"] for j in jobs] == [0, 1, 2]
+
+    r = client.post(
+        "/api/v0/job/poll_many",
+        json={
+            "query": "j.state = json_array('CREATED')",
+            "state": ["POLLED"],
+            "limit": 2,
+        },
+    )
+    assert r.status_code == 200
+    polled = r.get_json()["jobs"]
+    assert len(polled) == 2
+    assert all(j["state"] == ["POLLED"] for j in polled)
+
+    updates = [{"id": j["id"], "old": ["POLLED"], "new": ["DONE"]} for j in jobs]
+    r = client.post("/api/v0/job/state_many", json={"updates": updates})
+    assert r.status_code == 200
+    states = [j and j["state"] for j in r.get_json()["jobs"]]
+    assert sorted(states, key=bool) == [None, ["DONE"], ["DONE"]]
+
+    events = [{"id": jobs[0]["id"], "event": "foo"}, {"id": -1, "event": "bar"}]
+    r = client.post("/api/v0/job/event_many", json={"events": events})
+    assert r.status_code == 200
+    appended, missing = r.get_json()["jobs"]
+    assert appended["events"][-1][1]["event"] == "foo"
+    assert missing is None
+
+
+def _create_later(client, payload, delay=0.2):
+    def _create():
+        with client.application.config["pool"].connection() as q:
+            q.create(payload, ["CREATED"])
+
+    t = threading.Timer(delay, _create)
+    t.start()
+    return t
+
+
+def test_poll_wait(client):
+    """Assert that a waiting poll is woken by a job created from another thread."""
+
+    body = {"query": "j.state = json_array('CREATED')", "state": ["POLLED"]}
+    start = monotonic()
+    assert client.post("/api/v0/job/poll", json=body).status_code == 404
+    assert monotonic() - start < 1.0
+
+    t = _create_later(client, "payload")
+    start = monotonic()
+    r = client.post("/api/v0/job/poll", json=dict(body, wait=4.0))
+    t.join()
+    assert r.status_code == 200
+    assert r.get_json()["payload"] == "payload"
+    # Well before the 1s re-check, so the create must have woken the poll
+    assert monotonic() - start < 0.9
+
+
+def test_stream(client):
+    """Assert that the stream sends matching jobs, then wakes to send jobs as they change."""
+
+    create(client, "first", ["CREATED"])
+    r = client.get("/api/v0/job/stream?format=ndjson", buffered=False)
+    assert r.mimetype == "application/x-ndjson"
+    lines = iter(r.response)
+    assert json.loads(next(lines))["payload"] == "first"
+
+    t = _create_later(client, "second")
+    start = monotonic()
+    assert json.loads(next(lines))["payload"] == "second"
+    assert monotonic() - start < 2.0
+    t.join()
+    r.close()
+
+
+def test_stream_or(client):
+    """Assert that the stream only sends jobs changed since it began, even for queries using OR."""
+
+    create(client, "old", ["A"])
+    with client.application.config["pool"].connection() as q:
+        with q._db as db:
+            db.execute("UPDATE `job` SET `modified` = `modified` - 100")
+
+    # The test client reads the first line when the stream is opened, so create the new job first
+    t = _create_later(client, "new")
+    query = "j.state = json_array('A') OR j.state = json_array('CREATED')"
+    r = client.get(
+        "/api/v0/job/stream",
+        query_string={"query": query, "format": "ndjson"},
+        buffered=False,
+    )
+    assert json.loads(next(iter(r.response)))["payload"] == "new"
+    t.join()
+    r.close()
+
+
+def test_stream_since(client):
+    """Assert that a malformed since is a 400, not an error."""
+
+    r = client.get("/api/v0/job/stream", query_string={"since": "yesterday"})
+    assert r.status_code == 400
+    assert client.post("/api/v0/job/stream", json={"since": [1]}).status_code == 400
+
+
+def check_metrics_text(text):
+    """Assert that text is well-formed Prometheus exposition, returning its samples by name."""
+
+    samples, types = {}, {}
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split(" ")
+            types[name] = kind
+        elif line and not line.startswith("#"):
+            label = r'[a-z_]+="(?:[^"\\]|\\.)*"'
+            match = re.fullmatch(rf"([a-z_]+)(\{{(?:{label},?)*\}})? (\S+)", line)
+            assert match, line
+            name = match.group(1)
+            samples.setdefault(name, []).append(float(match.group(3)))
+            family = re.sub("_(bucket|sum|count)$", "", name)
+            assert name in types or family in types, line
+    return samples
+
+
+def test_metrics(client):
+    """Assert that /metrics reports requests and queue operations in the Prometheus text format."""
+
+    create(client, "payload", ["CREATED"])
+    client.post("/api/v0/job/poll", json={"query": "false", "state": ["POLLED"]})
+
+    r = client.get("/metrics")
+    assert r.status_code == 200
+    assert r.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+
+    text = r.get_data(as_text=True)
+    assert "# TYPE jobqd_requests_total counter" in text
+    assert "# TYPE jobqd_request_latency_seconds histogram" in text
+    assert (
+        'jobqd_requests_total{route="/api/v0/job/poll",method="POST",status="404"} 1'
+        in text
+    )
+    assert 'jobq_operations_total{op="poll",outcome="miss"} 1' in text
+    assert 'jobq_depth{state="[\\"CREATED\\"]"} 1' in text
+    assert check_metrics_text(text)["jobqd_requests_in_flight"] == [1.0]